@@ -1,16 +1,22 @@
 """管理接口 - Token管理和系统配置"""
 
+import orjson
 import secrets
-from typing import Dict, Any, List, Optional
+from collections.abc import Mapping
+from typing import Dict, Any, List, Optional, Tuple, Iterator
 from datetime import datetime, timedelta
 from pathlib import Path
 from fastapi import APIRouter, HTTPException, Depends, Header
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from pydantic import BaseModel
 
 from app.core.config import setting
 from app.core.logger import logger
+from app.core.retry import retry_engine
+from app.core.breaker import circuit_breakers
+from app.core.limiter import concurrency_limiter
 from app.services.grok.token import token_manager
+from app.services.grok.quota import quota_manager
 from app.services.call_log import call_log_service
 from app.models.grok_models import TokenType
 
@@ -64,6 +70,9 @@ class TokenInfo(BaseModel):
     status: str
     tags: List[str] = []
     note: str = ""
+    cooldown_until: Optional[int] = None  # 冷却到期时间（毫秒），冷却中的Token暂不参与选择
+    cooldown_reason: Optional[str] = None
+    in_flight: int = 0  # 本进程在途请求数
 
 
 class TokenListResponse(BaseModel):
@@ -96,6 +105,15 @@ class TestTokenRequest(BaseModel):
     token_type: str
 
 
+class ReviveArchiveRequest(BaseModel):
+    tokens: List[str]
+
+
+class PurgeArchiveRequest(BaseModel):
+    tokens: List[str] = []
+    purge_all: bool = False  # 清空全部归档（忽略tokens）
+
+
 
 
 # === 辅助函数 ===
@@ -145,8 +163,9 @@ def calculate_token_stats(tokens: Dict[str, Any], token_type: str) -> Dict[str,
     """计算Token统计"""
     total = len(tokens)
     status_counts = {"未使用": 0, "限流中": 0, "失效": 0, "正常": 0}
-    for t in tokens.values():
-        status = get_token_status(t, "sso" if token_type == "normal" else "ssoSuper")
+    sso_type = "sso" if token_type == "normal" else "ssoSuper"
+    for remaining, heavy_remaining, state in _scan_tokens(tokens, STATUS_FIELDS):
+        status = _token_status(remaining, heavy_remaining, state, sso_type)
         if status in status_counts:
             status_counts[status] += 1
 
@@ -176,15 +195,28 @@ def verify_admin_session(authorization: Optional[str] = Header(None)) -> bool:
     return True
 
 
+STATUS_FIELDS = (("remainingQueries", -1), ("heavyremainingQueries", -1), ("status", None))
+
+
+def _scan_tokens(tokens: Mapping, fields: Tuple[Tuple[str, Any], ...]) -> Iterator[Tuple[Any, ...]]:
+    """按字段逐个读取Token（列式Token表直接读列，不创建记录视图）"""
+    if hasattr(tokens, "column"):
+        return zip(*(tokens.column(name, default) for name, default in fields))
+    return (tuple(data.get(name, default) for name, default in fields) for data in tokens.values())
+
+
 def get_token_status(token_data: Dict[str, Any], token_type: str) -> str:
     """获取Token状态"""
-    remaining = token_data.get("remainingQueries", -1)
-    heavy_remaining = token_data.get("heavyremainingQueries", -1)
-    
+    return _token_status(
+        *(token_data.get(name, default) for name, default in STATUS_FIELDS), token_type
+    )
+
+
+def _token_status(remaining: int, heavy_remaining: int, state: Optional[str], token_type: str) -> str:
     relevant = max(remaining, heavy_remaining) if token_type == "ssoSuper" else remaining
     
     if relevant == -1:
-        return "失效" if token_data.get("status") == "expired" else "未使用"
+        return "失效" if state == "expired" else "未使用"
     elif relevant == 0:
         return "限流中"
     else:
@@ -319,7 +351,10 @@ async def list_tokens(
                 video_limit=data.get("videoLimit", -1),
                 status=get_token_status(data, "sso"),
                 tags=data.get("tags", []),
-                note=data.get("note", "")
+                note=data.get("note", ""),
+                cooldown_until=data.get("cooldownUntil"),
+                cooldown_reason=data.get("cooldownReason"),
+                in_flight=token_manager.in_flight(token)
             ))
 
         # Super Token
@@ -334,7 +369,10 @@ async def list_tokens(
                 video_limit=data.get("videoLimit", -1),
                 status=get_token_status(data, "ssoSuper"),
                 tags=data.get("tags", []),
-                note=data.get("note", "")
+                note=data.get("note", ""),
+                cooldown_until=data.get("cooldownUntil"),
+                cooldown_reason=data.get("cooldownReason"),
+                in_flight=token_manager.in_flight(token)
             ))
 
         # 过滤
@@ -577,7 +615,11 @@ async def get_stats(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
                 "normal": normal_stats,
                 "super": super_stats,
                 "total": total,
-                "video": video_stats
+                "video": video_stats,
+                "quota": quota_manager.get_stats(),
+                "retry": retry_engine.get_stats(),
+                "breakers": circuit_breakers.get_stats(),
+                "concurrency": concurrency_limiter.get_stats()
             }
         }
 
@@ -586,6 +628,35 @@ async def get_stats(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail={"error": f"获取失败: {e}", "code": "STATS_ERROR"})
 
 
+class ResetBreakerRequest(BaseModel):
+    """恢复熔断请求"""
+    name: Optional[str] = None  # 接口名或代理URL，为空时全部恢复
+
+
+@router.get("/api/breakers")
+async def get_breakers(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """获取上游接口与代理的熔断状态"""
+    try:
+        return {"success": True, "data": circuit_breakers.get_stats()}
+
+    except Exception as e:
+        logger.error(f"[Admin] 获取熔断状态异常: {e}")
+        raise HTTPException(status_code=500, detail={"error": f"获取失败: {e}", "code": "BREAKER_STATS_ERROR"})
+
+
+@router.post("/api/breakers/reset")
+async def reset_breakers(request: ResetBreakerRequest, _: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """手动恢复熔断"""
+    try:
+        count = circuit_breakers.reset(request.name)
+        logger.info(f"[Admin] 恢复熔断: {request.name or '全部'}（{count}个）")
+        return {"success": True, "message": f"已恢复{count}个熔断器", "data": {"count": count}}
+
+    except Exception as e:
+        logger.error(f"[Admin] 恢复熔断异常: {e}")
+        raise HTTPException(status_code=500, detail={"error": f"恢复失败: {e}", "code": "BREAKER_RESET_ERROR"})
+
+
 @router.get("/api/stats/remaining")
 async def get_remaining_stats(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
     """获取全量剩余次数统计（不受分页影响）"""
@@ -598,12 +669,10 @@ async def get_remaining_stats(_: bool = Depends(verify_admin_session)) -> Dict[s
 
         for token_type in [TokenType.NORMAL, TokenType.SUPER]:
             token_map = all_tokens.get(token_type.value, {}) or {}
-            for _, data in token_map.items():
-                normal = int(data.get("remainingQueries", -1))
-                heavy = int(data.get("heavyremainingQueries", -1))
-                relevant = _calc_relevant_remaining(token_type, normal, heavy)
+            for normal, heavy, state in _scan_tokens(token_map, STATUS_FIELDS):
+                relevant = _calc_relevant_remaining(token_type, int(normal), int(heavy))
 
-                if relevant == -1 and data.get("status") != "expired":
+                if relevant == -1 and state != "expired":
                     relevant = assumed
 
                 if relevant > 0:
@@ -623,6 +692,89 @@ async def get_remaining_stats(_: bool = Depends(verify_admin_session)) -> Dict[s
         raise HTTPException(status_code=500, detail={"error": f"获取失败: {e}", "code": "REMAINING_STATS_ERROR"})
 
 
+@router.get("/api/tokens/refresh/stats")
+async def get_refresh_stats(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """获取Token状态刷新扫描统计（耗时/吞吐/429降速）"""
+    try:
+        from app.services.grok.refresh import token_refresher
+        return {"success": True, "data": token_refresher.get_stats()}
+    except Exception as e:
+        logger.error(f"[Admin] 获取刷新统计异常: {e}")
+        raise HTTPException(status_code=500, detail={"error": f"获取失败: {e}", "code": "REFRESH_STATS_ERROR"})
+
+
+@router.get("/api/tokens/archive")
+async def list_archived_tokens(
+    page: int = 1,
+    page_size: int = 20,
+    search: Optional[str] = None,
+    token_type: Optional[str] = None,
+    reason: Optional[str] = None,
+    _: bool = Depends(verify_admin_session)
+) -> Dict[str, Any]:
+    """浏览冷归档Token（按需读取归档存储，不影响热数据）"""
+    try:
+        from app.services.grok.archive import token_archive
+        if token_type == "sso":
+            token_type = TokenType.NORMAL.value
+        items, total = await token_archive.browse(page, page_size, search, token_type, reason)
+        data = []
+        for item in items:
+            record = item.get("data") or {}
+            data.append({
+                "token": item["token"],
+                "token_type": "ssoSuper" if item.get("type") == TokenType.SUPER.value else "sso",
+                "archived_at": item.get("archivedAt"),
+                "reason": item.get("reason"),
+                "created_time": parse_created_time(record.get("createdTime")),
+                "remaining_queries": record.get("remainingQueries", -1),
+                "heavy_remaining_queries": record.get("heavyremainingQueries", -1),
+                "last_failure_reason": record.get("lastFailureReason"),
+                "tags": record.get("tags", []),
+                "note": record.get("note", ""),
+            })
+        return {"success": True, "data": data, "total": total, "page": max(1, page), "page_size": max(1, page_size)}
+    except Exception as e:
+        logger.error(f"[Admin] 获取归档列表异常: {e}")
+        raise HTTPException(status_code=500, detail={"error": f"获取失败: {e}", "code": "ARCHIVE_LIST_ERROR"})
+
+
+@router.post("/api/tokens/archive/revive")
+async def revive_archived_tokens(request: ReviveArchiveRequest, _: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """批量恢复归档Token到热数据"""
+    try:
+        from app.services.grok.archive import token_archive
+        count = await token_archive.revive(request.tokens)
+        return {"success": True, "message": f"成功恢复 {count} 个Token", "count": count}
+    except Exception as e:
+        logger.error(f"[Admin] 恢复归档Token异常: {e}")
+        raise HTTPException(status_code=500, detail={"error": f"恢复失败: {e}", "code": "ARCHIVE_REVIVE_ERROR"})
+
+
+@router.post("/api/tokens/archive/purge")
+async def purge_archived_tokens(request: PurgeArchiveRequest, _: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """永久删除归档Token"""
+    try:
+        from app.services.grok.archive import token_archive
+        count = await token_archive.purge(None if request.purge_all else request.tokens)
+        return {"success": True, "message": f"成功清除 {count} 个归档Token", "count": count}
+    except Exception as e:
+        logger.error(f"[Admin] 清除归档Token异常: {e}")
+        raise HTTPException(status_code=500, detail={"error": f"清除失败: {e}", "code": "ARCHIVE_PURGE_ERROR"})
+
+
+@router.post("/api/tokens/archive/sweep")
+async def sweep_tokens(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """立即将满足条件的Token移入冷归档"""
+    try:
+        from app.services.grok.archive import token_archive
+        count = await token_archive.sweep()
+        return {"success": True, "message": f"已归档 {count} 个Token", "count": count, "data": token_archive.get_stats()}
+    except Exception as e:
+        logger.error(f"[Admin] 归档Token异常: {e}")
+        raise HTTPException(status_code=500, detail={"error": f"归档失败: {e}", "code": "ARCHIVE_SWEEP_ERROR"})
+
+
 @router.get("/api/storage/mode")
 async def get_storage_mode(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
     """获取存储模式"""
@@ -925,7 +1077,12 @@ async def get_proxies(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]
             "data": {
                 "proxies": proxies,
                 "assignments": assignments,
-                "total": len(proxies)
+                "total": len(proxies),
+                "probe": proxy_pool.get_probe_stats(),
+                "persist": proxy_pool.get_persist_stats(),
+                "prefetch": proxy_pool.get_prefetch_stats(),
+                "assignment": proxy_pool.get_assignment_stats(),
+                "health_sync": proxy_pool.get_health_sync_stats()
             }
         }
     except Exception as e:
@@ -933,6 +1090,17 @@ async def get_proxies(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]
         raise HTTPException(status_code=500, detail={"error": f"获取失败: {e}", "code": "PROXY_LIST_ERROR"})
 
 
+@router.get("/api/sessions/stats")
+async def get_session_stats(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """获取上游会话池统计（命中/新建/回收）"""
+    try:
+        from app.core.session_pool import session_pool
+        return {"success": True, "data": session_pool.get_stats()}
+    except Exception as e:
+        logger.error(f"[Admin] 获取会话池统计异常: {e}")
+        raise HTTPException(status_code=500, detail={"error": f"获取失败: {e}", "code": "SESSION_STATS_ERROR"})
+
+
 @router.post("/api/proxies")
 async def add_proxy(request: AddProxyRequest, _: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
     """添加代理"""
@@ -1001,6 +1169,22 @@ async def unassign_proxy(request: UnassignProxyRequest, _: bool = Depends(verify
         raise HTTPException(status_code=500, detail={"error": f"解绑失败: {e}", "code": "PROXY_UNASSIGN_ERROR"})
 
 
+class RebalanceProxyRequest(BaseModel):
+    apply: bool = False  # 为False时只预览
+
+
+@router.post("/api/proxies/rebalance")
+async def rebalance_proxies(request: RebalanceProxyRequest, _: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """预览或执行SSO在代理间的重新分配（只移动必要的SSO），返回移动列表与前后分布"""
+    try:
+        logger.debug(f"[Admin] SSO重新分配: {'执行' if request.apply else '预览'}")
+        return {"success": True, "data": proxy_pool.rebalance(apply=request.apply)}
+
+    except Exception as e:
+        logger.error(f"[Admin] SSO重新分配异常: {e}")
+        raise HTTPException(status_code=500, detail={"error": f"重新分配失败: {e}", "code": "PROXY_REBALANCE_ERROR"})
+
+
 @router.post("/api/proxies/health/reset")
 async def reset_proxy_health(request: AddProxyRequest, _: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
     """重置代理健康状态"""
@@ -1008,6 +1192,7 @@ async def reset_proxy_health(request: AddProxyRequest, _: bool = Depends(verify_
         logger.debug(f"[Admin] 重置代理健康状态: {request.url}")
         
         proxy_pool.mark_success(request.url)
+        circuit_breakers.reset(request.url)
         return {"success": True, "message": "健康状态已重置"}
     
     except Exception as e:
@@ -1015,6 +1200,33 @@ async def reset_proxy_health(request: AddProxyRequest, _: bool = Depends(verify_
         raise HTTPException(status_code=500, detail={"error": f"重置失败: {e}", "code": "PROXY_HEALTH_RESET_ERROR"})
 
 
+class BulkTestProxyRequest(BaseModel):
+    urls: Optional[List[str]] = None  # 为空时测试全部代理
+
+
+@router.post("/api/proxies/test/bulk")
+async def bulk_test_proxies(request: BulkTestProxyRequest, _: bool = Depends(verify_admin_session)) -> StreamingResponse:
+    """并发测试代理（NDJSON流式返回，每完成一个输出一行，最后一行为汇总）
+
+    池内代理按结果恢复或降级，未加入代理池的地址只测试不记录。
+    """
+    logger.info(f"[Admin] 批量测试代理: {len(request.urls) if request.urls else '全部'}")
+
+    async def generate():
+        total = ok = 0
+        try:
+            async for result in proxy_pool.probe_all(request.urls):
+                total += 1
+                ok += 1 if result["ok"] else 0
+                yield orjson.dumps(result) + b"\n"
+        except Exception as e:
+            logger.error(f"[Admin] 批量测试代理异常: {e}")
+            yield orjson.dumps({"error": f"测试失败: {e}", "code": "PROXY_BULK_TEST_ERROR"}) + b"\n"
+        yield orjson.dumps({"done": True, "total": total, "ok": ok}) + b"\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
 @router.post("/api/proxies/test")
 async def test_proxy(request: AddProxyRequest, _: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
     """测试代理连通性"""
@@ -1,6 +1,8 @@
 """聊天API路由 - OpenAI兼容的聊天接口"""
 
-from fastapi import APIRouter, Depends, HTTPException
+import math
+
+from fastapi import APIRouter, Depends, Header, HTTPException
 from typing import Optional
 from fastapi.responses import StreamingResponse
 
@@ -15,13 +17,20 @@ router = APIRouter(prefix="/chat", tags=["聊天"])
 
 
 @router.post("/completions", response_model=None)
-async def chat_completions(request: OpenAIChatRequest, _: Optional[str] = Depends(auth_manager.verify)):
-    """创建聊天补全（支持流式和非流式）"""
+async def chat_completions(
+    request: OpenAIChatRequest,
+    _: Optional[str] = Depends(auth_manager.verify),
+    x_request_timeout: Optional[float] = Header(None),
+):
+    """创建聊天补全（支持流式和非流式）
+
+    请求头 X-Request-Timeout 可指定请求总时长（秒），超时返回504；上游接口熔断中或并发排队已满/超时返回503并附带 Retry-After。
+    """
     try:
         logger.info("[Chat] 收到聊天请求")
 
         # 调用Grok客户端
-        result = await GrokClient.openai_to_grok(request.model_dump())
+        result = await GrokClient.openai_to_grok(request.model_dump(), timeout=x_request_timeout)
         
         # 流式响应
         if request.stream:
@@ -40,8 +49,15 @@ async def chat_completions(request: OpenAIChatRequest, _: Optional[str] = Depend
         
     except GrokApiException as e:
         logger.error(f"[Chat] Grok API错误: {e} - 详情: {e.details}")
+        status_code, headers = 500, None
+        if e.error_code == "DEADLINE_EXCEEDED":
+            status_code = 504
+        elif e.error_code in ("CIRCUIT_OPEN", "OVERLOADED"):
+            status_code = 503
+            headers = {"Retry-After": str(max(1, math.ceil(e.details.get("retry_in", 1))))}
         raise HTTPException(
-            status_code=500,
+            status_code=status_code,
+            headers=headers,
             detail={
                 "error": {
                     "message": str(e),
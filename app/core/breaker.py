@@ -0,0 +1,324 @@
+"""熔断器 - 按上游接口与代理统计滚动错误率，熔断期间快速失败并以少量半开探测试探恢复
+
+状态:
+    closed     正常放行，滚动窗口内请求数达到 breaker_min_calls 且错误率达到 breaker_error_rate 时熔断
+    open       快速失败（接口）或不参与代理选择（代理），breaker_open_seconds 后进入半开
+    half_open  最多放行 breaker_half_open_probes 个探测请求，全部成功则恢复，任一失败重新熔断
+
+结果分类: 2xx/3xx 成功；5xx 计为上游故障（只计入接口）；403 与网络/TLS错误计为代理故障
+（经代理时只计入代理，直连时计入接口）；401/429 等Token级错误不计入。
+接口整体健康时代理故障才归咎于代理（标记代理失败），上游整体降级时不再把代理误判为不健康。
+"""
+
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+from app.core.config import setting
+from app.core.exception import GrokApiException
+from app.core.logger import logger
+
+
+# 上游接口
+CHAT = "conversations/new"
+UPLOAD = "upload-file"
+POST_CREATE = "media/post/create"
+RATE_LIMITS = "rate-limits"
+ASSETS = "assets"
+
+# 状态
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 结果
+SUCCESS = "success"
+FAILURE = "failure"  # 上游故障（5xx）
+PROXY_FAILURE = "proxy_failure"  # 403 / 网络 / TLS
+IGNORE = "ignore"  # 不计入（Token级错误等）
+
+WINDOW_BUCKETS = 10  # 滚动窗口分桶数
+
+
+class CircuitOpenError(GrokApiException):
+    """上游接口熔断中"""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        self.retry_in = retry_in
+        super().__init__(
+            f"上游接口 {endpoint} 熔断中，约{retry_in:.0f}秒后重试",
+            "CIRCUIT_OPEN",
+            {"endpoint": endpoint, "retry_in": round(retry_in, 1)},
+        )
+
+
+def outcome_for_status(status: int) -> str:
+    """HTTP状态码对应的熔断结果"""
+    if status == 403:
+        return PROXY_FAILURE
+    if status >= 500:
+        return FAILURE
+    if status < 400:
+        return SUCCESS
+    return IGNORE
+
+
+def _config() -> Dict[str, float]:
+    cfg = setting.global_config
+    return {
+        "window": max(1.0, float(cfg.get("breaker_window", 30) or 30)),
+        "min_calls": max(1, int(cfg.get("breaker_min_calls", 20) or 1)),
+        "error_rate": float(cfg.get("breaker_error_rate", 0.5) or 0),
+        "open_seconds": max(1.0, float(cfg.get("breaker_open_seconds", 30) or 1)),
+        "probes": max(1, int(cfg.get("breaker_half_open_probes", 3) or 1)),
+    }
+
+
+@dataclass
+class _Bucket:
+    start: float
+    ok: int = 0
+    failed: int = 0
+
+
+class CircuitBreaker:
+    """单个接口或代理的熔断器"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self._buckets: Deque[_Bucket] = deque()
+        self._opened_at = 0.0
+        self._probes = 0  # 半开状态在途探测数
+        self._probe_ok = 0  # 半开状态已成功探测数
+        self.trips = 0  # 累计熔断次数
+        self.rejected = 0  # 熔断期间拒绝的请求数
+
+    # === 滚动窗口 ===
+
+    def _window(self, now: float, window: float) -> Deque[_Bucket]:
+        buckets = self._buckets
+        while buckets and buckets[0].start <= now - window:
+            buckets.popleft()
+        return buckets
+
+    def _counts(self, now: float, window: float) -> tuple:
+        buckets = self._window(now, window)
+        return sum(b.ok for b in buckets), sum(b.failed for b in buckets)
+
+    def _add(self, now: float, window: float, failed: bool) -> None:
+        buckets = self._window(now, window)
+        width = window / WINDOW_BUCKETS
+        if not buckets or now - buckets[-1].start >= width:
+            buckets.append(_Bucket(now - (now % width)))
+        if failed:
+            buckets[-1].failed += 1
+        else:
+            buckets[-1].ok += 1
+
+    def error_rate(self, now: Optional[float] = None) -> float:
+        ok, failed = self._counts(now or time.monotonic(), _config()["window"])
+        return failed / (ok + failed) if ok + failed else 0.0
+
+    # === 状态 ===
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """是否可放行一个请求（不占用探测名额）"""
+        now = now or time.monotonic()
+        if self.state == OPEN:
+            return now - self._opened_at >= _config()["open_seconds"]
+        if self.state == HALF_OPEN:
+            return self._probes < _config()["probes"]
+        return True
+
+    def allow(self, now: Optional[float] = None) -> Optional[float]:
+        """占用一次放行，返回None；熔断中返回距离半开的剩余秒数"""
+        now = now or time.monotonic()
+        cfg = _config()
+        if self.state == OPEN:
+            wait = self._opened_at + cfg["open_seconds"] - now
+            if wait > 0:
+                self.rejected += 1
+                return wait
+            self.state, self._probes, self._probe_ok = HALF_OPEN, 0, 0
+            logger.info(f"[Breaker] {self.name} 进入半开，开始探测")
+        if self.state == HALF_OPEN:
+            if self._probes >= cfg["probes"]:
+                self.rejected += 1
+                return 1.0
+            self._probes += 1
+        return None
+
+    def record(self, outcome: str, probe: bool, now: Optional[float] = None) -> None:
+        """记录一次结果（probe 为该请求是否占用了半开探测名额）"""
+        now = now or time.monotonic()
+        cfg = _config()
+        if probe and self.state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+        if outcome == IGNORE:
+            return
+
+        failed = outcome != SUCCESS
+        self._add(now, cfg["window"], failed)
+
+        if self.state == HALF_OPEN:
+            if failed:
+                self._open(now, "半开探测失败")
+            else:
+                self._probe_ok += 1
+                if self._probe_ok >= cfg["probes"]:
+                    self.state = CLOSED
+                    self._buckets.clear()
+                    logger.info(f"[Breaker] {self.name} 探测成功，已恢复")
+            return
+
+        if self.state == CLOSED and failed and cfg["error_rate"] > 0:
+            ok, bad = self._counts(now, cfg["window"])
+            if ok + bad >= cfg["min_calls"] and bad / (ok + bad) >= cfg["error_rate"]:
+                self._open(now, f"错误率{bad / (ok + bad):.0%}（{bad}/{ok + bad}）")
+
+    def _open(self, now: float, reason: str) -> None:
+        self.state = OPEN
+        self._opened_at = now
+        self._probes = self._probe_ok = 0
+        self.trips += 1
+        logger.warning(f"[Breaker] {self.name} 熔断: {reason}")
+
+    def reset(self) -> None:
+        self.state = CLOSED
+        self._buckets.clear()
+        self._probes = self._probe_ok = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        cfg = _config()
+        ok, failed = self._counts(now, cfg["window"])
+        data = {
+            "state": self.state,
+            "calls": ok + failed,
+            "failures": failed,
+            "error_rate": round(failed / (ok + failed), 4) if ok + failed else 0.0,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+        if self.state == OPEN:
+            data["retry_in"] = round(max(0.0, self._opened_at + cfg["open_seconds"] - now), 1)
+        return data
+
+
+class Permit:
+    """一次上游请求的熔断登记，记录结果后释放半开探测名额"""
+
+    __slots__ = ("_endpoint", "_proxy", "_endpoint_probe", "_proxy_probe", "_done")
+
+    def __init__(self, endpoint: CircuitBreaker, proxy: Optional[CircuitBreaker], endpoint_probe: bool, proxy_probe: bool):
+        self._endpoint = endpoint
+        self._proxy = proxy
+        self._endpoint_probe = endpoint_probe
+        self._proxy_probe = proxy_probe
+        self._done = False
+
+    def record(self, outcome: str) -> bool:
+        """记录结果
+
+        Returns:
+            代理故障是否应归咎于代理（接口整体健康时为True）
+        """
+        if self._done:
+            return False
+        self._done = True
+        blame = False
+        if outcome == PROXY_FAILURE:
+            # 先于本次结果判断：接口在熔断/半开或错误率已超过阈值时视为上游降级
+            blame = self._endpoint.state == CLOSED and self._endpoint.error_rate() < _config()["error_rate"]
+        if self._proxy is None:
+            self._endpoint.record(outcome, self._endpoint_probe)
+        else:
+            self._endpoint.record(IGNORE if outcome == PROXY_FAILURE else outcome, self._endpoint_probe)
+            self._proxy.record(IGNORE if outcome == FAILURE else outcome, self._proxy_probe)
+        return blame
+
+    def record_status(self, status: int) -> bool:
+        return self.record(outcome_for_status(status))
+
+    def __enter__(self) -> "Permit":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # 未分类的结束（如处理异常）只释放探测名额
+        self.record(IGNORE)
+
+
+class BreakerRegistry:
+    """接口与代理熔断器"""
+
+    def __init__(self):
+        self._endpoints: Dict[str, CircuitBreaker] = {}
+        self._proxies: Dict[str, CircuitBreaker] = {}
+
+    def endpoint(self, name: str) -> CircuitBreaker:
+        breaker = self._endpoints.get(name)
+        if breaker is None:
+            breaker = self._endpoints[name] = CircuitBreaker(name)
+        return breaker
+
+    def proxy(self, url: str) -> CircuitBreaker:
+        breaker = self._proxies.get(url)
+        if breaker is None:
+            breaker = self._proxies[url] = CircuitBreaker(f"proxy {url.split('@')[-1]}")
+        return breaker
+
+    def proxy_available(self, url: str) -> bool:
+        """代理是否可参与选择（熔断中的代理跳过，到期后放行半开探测）"""
+        breaker = self._proxies.get(url)
+        return breaker is None or breaker.available()
+
+    def proxy_state(self, url: str) -> str:
+        breaker = self._proxies.get(url)
+        return breaker.state if breaker else CLOSED
+
+    def permit(self, endpoint: str, proxy: Optional[str] = None) -> Permit:
+        """登记一次上游请求；接口熔断中抛出 CircuitOpenError
+
+        代理熔断不在此拒绝（代理选择时已跳过），只记录结果。
+        """
+        endpoint_breaker = self.endpoint(endpoint)
+        wait = endpoint_breaker.allow()
+        if wait is not None:
+            raise CircuitOpenError(endpoint, wait)
+        proxy_breaker = self.proxy(proxy) if proxy else None
+        proxy_probe = False
+        if proxy_breaker is not None and proxy_breaker.state != CLOSED and proxy_breaker.available():
+            proxy_probe = proxy_breaker.allow() is None
+        return Permit(endpoint_breaker, proxy_breaker, endpoint_breaker.state == HALF_OPEN, proxy_probe)
+
+    def reset(self, name: Optional[str] = None) -> int:
+        """手动恢复（name 为接口名或代理URL，为空时全部恢复）"""
+        breakers: List[CircuitBreaker] = []
+        if name is None:
+            breakers = [*self._endpoints.values(), *self._proxies.values()]
+        elif name in self._endpoints:
+            breakers = [self._endpoints[name]]
+        elif name in self._proxies:
+            breakers = [self._proxies[name]]
+        for breaker in breakers:
+            breaker.reset()
+        return len(breakers)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """熔断状态与统计"""
+        endpoints = {name: b.to_dict() for name, b in self._endpoints.items()}
+        proxies = {url: b.to_dict() for url, b in self._proxies.items()}
+        everything = [*endpoints.values(), *proxies.values()]
+        return {
+            "open": sum(1 for b in everything if b["state"] != CLOSED),
+            "trips": sum(b["trips"] for b in everything),
+            "rejected": sum(b["rejected"] for b in everything),
+            "endpoints": endpoints,
+            "proxies": proxies,
+        }
+
+
+# 全局实例
+circuit_breakers = BreakerRegistry()
@@ -24,7 +24,28 @@ DEFAULT_GROK = {
     "stream_first_response_timeout": 30,
     "stream_chunk_timeout": 120,
     "stream_total_timeout": 600,
+    "request_timeout": 0,  # 单个请求的总时长（秒，含选Token、上传、重试与流式读取），0 为沿用 stream_total_timeout；客户端可用 X-Request-Timeout 请求头指定
+    "request_timeout_models": {},  # 按模型覆盖 request_timeout
     "retry_status_codes": [401, 429],  # 可重试的HTTP状态码
+    "session_idle_timeout": 300,  # 池化会话空闲回收时间（秒）
+    "session_max_clients": 100,  # 单个池化会话最大并发连接句柄数
+    "session_http2": True,  # 池化会话允许HTTP/2多路复用
+    "session_prewarm": False,  # 启动时为健康代理预热会话
+    "proxy_probe_interval": 60,  # 代理主动探测间隔（秒，0为关闭），启动后立即探测一轮
+    "proxy_probe_concurrency": 16,  # 同时探测的代理数
+    "proxy_probe_timeout": 10,  # 单个代理探测超时（秒）
+    "proxy_probe_url": "https://grok.com/",  # 探测目标，非5xx响应视为代理可用
+    "proxy_probe_failures": 2,  # 连续探测失败该次数后标记代理不健康
+    "proxy_pool_buffer_size": 4,  # 代理池API预取缓冲大小（0为不预取，仅在请求路径上获取）
+    "proxy_pool_low_water": 2,  # 预取缓冲不超过该数量时后台补充
+    "proxy_pool_validate": True,  # 预取的代理先经 proxy_probe_url 探测，可用才放入缓冲
+    "proxy_assign_balance": 0.25,  # SSO分配允许偏离份额的比例（单个代理最多绑定 份额×1.25 个SSO）
+    "proxy_assign_rebalance": True,  # 代理增加/移除/恢复后自动做最少移动的重新分配
+    "proxy_health_shared": True,  # Redis存储时各节点共享代理失败计数与不健康标记
+    "proxy_health_ttl": 300,  # 共享健康状态的过期时间（秒，期间无人上报即失效）
+    "proxy_health_resync": 30,  # 全量校对共享健康状态的间隔（秒，弥补Pub/Sub丢失的消息）
+    "proxy_state_save_interval": 5,  # 代理健康/绑定变更合并写入 proxy_state 的间隔（秒）
+    "proxy_state_counter_interval": 60,  # 仅请求计数变化时的写入间隔（秒，0为只随结构变更或关闭时写入）
 }
 
 DEFAULT_GLOBAL = {
@@ -36,13 +57,46 @@ DEFAULT_GLOBAL = {
     "image_cache_max_size_mb": 512,
     "video_cache_max_size_mb": 1024,
     "max_upload_concurrency": 20,  # 最大并发上传数
-    "max_request_concurrency": 50,  # 最大并发请求数
+    "max_request_concurrency": 50,  # 最大并发请求数（自适应并发上限的上界）
+    "concurrency_adaptive": True,  # 按上游首字节延迟与429/403比例自动调整并发上限（关闭时固定为 max_request_concurrency）
+    "concurrency_min_limit": 4,  # 自适应并发上限的下界
+    "concurrency_queue_size": 100,  # 并发已满时的最大排队数，超出直接返回503
+    "concurrency_queue_timeout": 10,  # 排队最长等待（秒），超时返回503
+    "concurrency_latency_tolerance": 2.0,  # 首字节延迟超过基线的该倍数时视为上游拥塞
     "batch_save_interval": 1.0,  # 批量保存间隔（秒）
     "batch_save_threshold": 10,  # 触发批量保存的变更数阈值
     "log_max_count": 10000,  # 调用日志最大数量
     "token_refresh_interval": 3600,  # Token状态刷新间隔（秒）
     "token_refresh_scope": "expired",  # expired/all
+    "token_refresh_concurrency": 8,  # 状态刷新最大并发检查数（遇429自动降速）
     "token_zero_expire_threshold": 3,  # 连续0次数失效阈值
+    "token_archive_expired_days": 7,  # 失效超过该天数的Token移入冷归档（0为不归档）
+    "token_archive_zero_sweeps": 10,  # 连续该次数刷新为0次数的Token移入冷归档（0为不归档）
+    "token_cooldown_429": 60,  # 429后首次冷却时长（秒），连续429时指数退避
+    "token_cooldown_429_max": 900,  # 429冷却时长上限（秒）
+    "token_cooldown_5xx": 30,  # 连续5xx达到失败上限后的冷却时长（秒）
+    "token_cooldown_quota": 1800,  # 配额耗尽后的冷却时长（秒），到期后重新获取配额
+    "token_cooldown_probe": True,  # 冷却到期时先调用rate-limits探测再恢复
+    "token_select_policy": "round_robin",  # Token选择策略: max_remaining/round_robin/lru
+    "token_max_concurrency": 0,  # 单个Token最大在途请求数（0为不限），全部占满时请求排队
+    "token_acquire_timeout": 30,  # 全部Token并发占满时的最长排队时间（秒）
+    "redis_lease_ttl": 900,  # Redis存储时Token租约的过期时间（秒），节点崩溃后租约到期自动归还
+    "token_shared_memory": False,  # 文件存储多worker时，Token数值状态与在途数放在共享内存中供各worker共用
+    "token_shared_slots": 65536,  # 共享内存槽位数（应大于Token总数，每槽64字节）
+    "token_sync_interval": 1.0,  # 多进程文件模式下检测token.json变化的间隔（秒）
+    "token_journal_max_mb": 8,  # Token变更日志超过该大小（MB）时合并进token.json
+    "warm_restart": True,  # 关闭时写入热启动快照 data/warm_state.bin，启动时直接装载Token表、选择索引与对账状态
+    "retry_budget_ratio": 0.2,  # 上游重试预算：重试次数不超过调用次数的该比例（0为不限）
+    "retry_budget_burst": 20,  # 重试预算令牌桶容量（允许的突发重试数）
+    "breaker_window": 30,  # 熔断统计的滚动窗口（秒）
+    "breaker_min_calls": 20,  # 窗口内请求数达到该值才判断熔断
+    "breaker_error_rate": 0.5,  # 窗口内错误率达到该值时熔断（0为关闭熔断）
+    "breaker_open_seconds": 30,  # 熔断持续时间（秒），之后进入半开探测
+    "breaker_half_open_probes": 3,  # 半开状态的探测请求数，全部成功后恢复
+    "quota_reconcile_window": 60,  # 同一Token两次配额对账的最小间隔（秒）
+    "quota_reconcile_every": 20,  # 本地累计扣减达到该次数后对账
+    "quota_reconcile_low_water": 5,  # 本地剩余次数低于该值时对账
+    "quota_reconcile_concurrency": 4,  # 并发对账数
     # 统计展示用：当Token未使用/未拉取到配额（remaining=-1）时，按该值估算剩余次数
     "assumed_chat_quota_per_token": 80,
 }
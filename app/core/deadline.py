@@ -0,0 +1,96 @@
+"""请求截止时间 - 以 contextvar 贯穿一次请求的各阶段
+
+截止时间在 `GrokClient.openai_to_grok` 入口确定（客户端请求头 `X-Request-Timeout` 或按模型的默认值），
+之后选Token排队、图片上传、视频会话创建、上游请求、重试退避与流式读取都只使用剩余时间；
+时间用尽时抛出 DeadlineExceeded，及时释放Token租约、会话与代理，不再做没有人等待的工作。
+
+流式响应在 StreamingResponse 的任务中消费，需由 `adopt()` 沿用请求的截止时间。
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from app.core.config import setting
+from app.core.exception import GrokApiException
+
+
+# 截止时间（time.monotonic()），None 为不限
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(GrokApiException):
+    """请求截止时间已到"""
+
+    def __init__(self, stage: str = ""):
+        super().__init__(f"请求超时: {stage}时已超过截止时间" if stage else "请求超时: 已超过截止时间", "DEADLINE_EXCEEDED")
+
+
+class RequestDeadline:
+    """当前请求的截止时间"""
+
+    @staticmethod
+    def resolve(model: str, requested: Optional[float] = None) -> Optional[float]:
+        """请求的总时长（秒）：客户端指定优先，否则按模型默认值（未配置时沿用 stream_total_timeout）；不超过 stream_total_timeout
+
+        Returns:
+            秒数，None 为不限
+        """
+        cfg = setting.grok_config
+        if requested is None or requested <= 0:
+            per_model = cfg.get("request_timeout_models") or {}
+            requested = per_model.get(model, cfg.get("request_timeout", 0))
+        seconds = float(requested or 0)
+        total = float(cfg.get("stream_total_timeout", 600) or 0)
+        if total > 0:
+            seconds = min(seconds, total) if seconds > 0 else total
+        return seconds if seconds > 0 else None
+
+    @staticmethod
+    def get() -> Optional[float]:
+        return _deadline.get()
+
+    @staticmethod
+    def remaining() -> Optional[float]:
+        """剩余秒数（None 为不限，已过期为0）"""
+        deadline = _deadline.get()
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    def check(self, stage: str = "") -> None:
+        """截止时间已到时抛出 DeadlineExceeded"""
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(stage)
+
+    def bound(self, timeout: Optional[float], stage: str = "") -> Optional[float]:
+        """阶段超时不超过剩余时间（已过期时抛出 DeadlineExceeded）"""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise DeadlineExceeded(stage)
+        return remaining if timeout is None or timeout <= 0 else min(timeout, remaining)
+
+    @contextmanager
+    def scope(self, seconds: Optional[float]) -> Iterator[Optional[float]]:
+        """在代码块内设置截止时间（已有更早的截止时间时保留）"""
+        deadline = _deadline.get()
+        if seconds is not None and seconds > 0:
+            at = time.monotonic() + seconds
+            deadline = at if deadline is None else min(deadline, at)
+        token = _deadline.set(deadline)
+        try:
+            yield deadline
+        finally:
+            _deadline.reset(token)
+
+    @staticmethod
+    def adopt(deadline: Optional[float]) -> None:
+        """在消费流式响应的任务中沿用请求的截止时间（该任务只服务这一个响应，不需恢复）"""
+        if deadline is not None:
+            _deadline.set(deadline)
+
+
+# 全局实例
+request_deadline = RequestDeadline()
@@ -15,6 +15,7 @@ HTTP_ERROR_MAP = {
     429: ("rate_limit_error", "请求频率超出限制，请稍后再试"),
     500: ("api_error", "内部服务器错误"),
     503: ("api_error", "服务暂时不可用"),
+    504: ("api_error", "请求超时"),
 }
 
 # Grok错误码映射
@@ -29,6 +30,9 @@ GROK_STATUS_MAP = {
     "NO_RESPONSE": status.HTTP_502_BAD_GATEWAY,
     "TOKEN_SAVE_ERROR": status.HTTP_500_INTERNAL_SERVER_ERROR,
     "NO_AVAILABLE_TOKEN": status.HTTP_503_SERVICE_UNAVAILABLE,
+    "DEADLINE_EXCEEDED": status.HTTP_504_GATEWAY_TIMEOUT,
+    "CIRCUIT_OPEN": status.HTTP_503_SERVICE_UNAVAILABLE,
+    "OVERLOADED": status.HTTP_503_SERVICE_UNAVAILABLE,
 }
 
 GROK_TYPE_MAP = {
@@ -42,6 +46,9 @@ GROK_TYPE_MAP = {
     "NO_RESPONSE": "api_error",
     "TOKEN_SAVE_ERROR": "api_error",
     "NO_AVAILABLE_TOKEN": "api_error",
+    "DEADLINE_EXCEEDED": "api_error",
+    "CIRCUIT_OPEN": "api_error",
+    "OVERLOADED": "api_error",
 }
 
 
@@ -75,7 +82,8 @@ async def http_exception_handler(_: Request, exc: StarletteHTTPException) -> JSO
 
     return JSONResponse(
         status_code=exc.status_code,
-        content=build_error_response(message, error_type)
+        content=build_error_response(message, error_type),
+        headers=getattr(exc, "headers", None)
     )
 
 
@@ -0,0 +1,222 @@
+"""自适应并发限制 - 按上游首字节延迟与 429/403 比例调整在途请求上限（AIMD）
+
+对话请求在进入 `GrokClient._retry` 前取得一个名额，流式响应结束后归还：
+    - 在途数未达上限时直接放行，否则按先来先到排队，最长等待 `concurrency_queue_timeout` 秒（不超过请求剩余时间）；
+    - 排队人数达到 `concurrency_queue_size` 或等待超时时拒绝（503 + Retry-After，错误码 OVERLOADED）；
+    - 每次上游响应作为一个样本：429/403，或首字节延迟超过基线的 `concurrency_latency_tolerance` 倍时，
+      视为上游拥塞，上限乘以 0.9（每个基线延迟周期最多下调一次）；否则在名额被用满时每个周期加 1。
+
+上限介于 `concurrency_min_limit` 与 `max_request_concurrency` 之间，按进程各自统计。
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Deque, Dict, Optional
+
+from app.core.config import setting
+from app.core.deadline import request_deadline
+from app.core.exception import GrokApiException
+from app.core.logger import logger
+
+
+DECREASE_FACTOR = 0.9  # 拥塞时上限的乘性下调系数
+FAST_ALPHA = 0.2  # 近期首字节延迟的EWMA系数
+BASELINE_ALPHA = 0.02  # 基线首字节延迟的EWMA系数
+
+
+class ConcurrencyLimitExceeded(GrokApiException):
+    """并发已满且排队已满或等待超时"""
+
+    def __init__(self, reason: str, retry_in: float):
+        self.retry_in = retry_in
+        super().__init__(
+            f"服务繁忙（{reason}），请约{retry_in:.0f}秒后重试",
+            "OVERLOADED",
+            {"retry_in": round(retry_in, 1)},
+        )
+
+
+def _config() -> Dict[str, Any]:
+    cfg = setting.global_config
+    ceiling = max(1, int(cfg.get("max_request_concurrency", 50) or 1))
+    return {
+        "adaptive": bool(cfg.get("concurrency_adaptive", True)),
+        "max": ceiling,
+        "min": min(ceiling, max(1, int(cfg.get("concurrency_min_limit", 4) or 1))),
+        "queue_size": max(0, int(cfg.get("concurrency_queue_size", 100) or 0)),
+        "queue_timeout": max(0.0, float(cfg.get("concurrency_queue_timeout", 10) or 0)),
+        "tolerance": max(1.0, float(cfg.get("concurrency_latency_tolerance", 2.0) or 1)),
+    }
+
+
+class AdaptiveLimiter:
+    """在途对话请求的自适应上限与排队"""
+
+    def __init__(self):
+        self._limit: Optional[float] = None  # 首次使用时取 max_request_concurrency
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._ttfb: Optional[float] = None  # 近期首字节延迟（秒）
+        self._baseline: Optional[float] = None  # 基线首字节延迟（秒）
+        self._hold: Optional[float] = None  # 名额平均占用时长（秒）
+        self._last_change = 0.0
+        self._admitted = 0
+        self._queued_total = 0
+        self._shed = 0
+        self._timed_out = 0
+        self._increases = 0
+        self._decreases = 0
+
+    # === 上限 ===
+
+    def limit(self) -> int:
+        cfg = _config()
+        if not cfg["adaptive"]:
+            return cfg["max"]
+        if self._limit is None:
+            self._limit = float(cfg["max"])
+        # 配置变更后收敛到新的范围
+        self._limit = min(float(cfg["max"]), max(float(cfg["min"]), self._limit))
+        return int(self._limit)
+
+    def observe(self, status: int, ttfb: Optional[float] = None) -> None:
+        """记录一次上游响应（状态码与首字节延迟），调整上限"""
+        cfg = _config()
+        if not cfg["adaptive"]:
+            return
+        limit = self.limit()
+        now = time.monotonic()
+        period = max(0.5, self._baseline or 1.0)  # 每个基线延迟周期最多调整一次
+
+        congested = status in (429, 403)
+        if ttfb is not None and 200 <= status < 400:
+            self._ttfb = ttfb if self._ttfb is None else self._ttfb + FAST_ALPHA * (ttfb - self._ttfb)
+            if self._baseline is not None and self._ttfb > self._baseline * cfg["tolerance"]:
+                congested = True
+            # 基线缓慢跟随，延迟长期抬升（如换用更重的模型）后不会一直判为拥塞
+            self._baseline = ttfb if self._baseline is None else self._baseline + BASELINE_ALPHA * (ttfb - self._baseline)
+        elif status >= 500 or status == 0:
+            return  # 上游故障由熔断处理，不据此调整并发
+
+        if now - self._last_change < period:
+            return
+        if congested:
+            new_limit = max(float(cfg["min"]), self._limit * DECREASE_FACTOR)
+            if int(new_limit) < limit:
+                self._decreases += 1
+                logger.info(
+                    f"[Limiter] 上游拥塞（状态:{status}，首字节{(self._ttfb or 0) * 1000:.0f}ms），并发上限 {limit} -> {int(new_limit)}"
+                )
+            self._limit = new_limit
+            self._last_change = now
+        elif self._in_flight >= limit and limit < cfg["max"]:
+            # 名额用满且上游正常时才增加
+            self._limit = min(float(cfg["max"]), self._limit + 1)
+            self._increases += 1
+            self._last_change = now
+            logger.debug(f"[Limiter] 并发上限 {limit} -> {int(self._limit)}")
+            self._wake()
+
+    # === 名额 ===
+
+    async def acquire(self) -> float:
+        """取得一个在途名额，返回取得时间（用于 release）
+
+        Raises:
+            ConcurrencyLimitExceeded: 排队已满或等待超时
+            DeadlineExceeded: 等待期间请求截止时间已到
+        """
+        if self._in_flight < self.limit() and not self._waiters:
+            self._in_flight += 1
+            self._admitted += 1
+            return time.monotonic()
+
+        cfg = _config()
+        if len(self._waiters) >= cfg["queue_size"]:
+            self._shed += 1
+            raise ConcurrencyLimitExceeded("排队已满", self._retry_in())
+
+        timeout = request_deadline.bound(cfg["queue_timeout"], "等待并发名额")
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self._queued_total += 1
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            request_deadline.check("等待并发名额")
+            self._timed_out += 1
+            self._shed += 1
+            raise ConcurrencyLimitExceeded("排队超时", self._retry_in()) from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release_slot()  # 已分到名额但调用方被取消
+            raise
+        finally:
+            try:
+                self._waiters.remove(future)
+            except ValueError:
+                pass
+        self._admitted += 1
+        return time.monotonic()
+
+    def release(self, started: float) -> None:
+        """归还名额"""
+        held = time.monotonic() - started
+        self._hold = held if self._hold is None else self._hold + FAST_ALPHA * (held - self._hold)
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        self._in_flight = max(0, self._in_flight - 1)
+        self._wake()
+
+    def _wake(self) -> None:
+        limit = self.limit()
+        while self._waiters and self._in_flight < limit:
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self._in_flight += 1
+            future.set_result(None)
+
+    def _retry_in(self) -> float:
+        """建议的重试等待：排队人数按平均占用时长与上限估算"""
+        hold = self._hold or 1.0
+        return max(1.0, hold * (len(self._waiters) + 1) / max(1, self.limit()))
+
+    async def release_after(self, stream: AsyncGenerator[str, None], started: float) -> AsyncGenerator[str, None]:
+        """流式输出，结束或被取消时归还名额"""
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            try:
+                await stream.aclose()
+            finally:
+                self.release(started)
+
+    # === 统计 ===
+
+    def get_stats(self) -> Dict[str, Any]:
+        """当前上限、排队与拒绝统计"""
+        cfg = _config()
+        return {
+            "adaptive": cfg["adaptive"],
+            "limit": self.limit(),
+            "min_limit": cfg["min"],
+            "max_limit": cfg["max"],
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+            "admitted": self._admitted,
+            "queued_total": self._queued_total,
+            "shed": self._shed,
+            "timed_out": self._timed_out,
+            "increases": self._increases,
+            "decreases": self._decreases,
+            "ttfb_ms": round(self._ttfb * 1000, 1) if self._ttfb is not None else None,
+            "baseline_ttfb_ms": round(self._baseline * 1000, 1) if self._baseline is not None else None,
+        }
+
+
+# 全局实例
+concurrency_limiter = AdaptiveLimiter()
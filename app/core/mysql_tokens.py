@@ -0,0 +1,248 @@
+"""MySQL Token表 - 每个Token一行，配额/状态/失败计数为类型化列
+
+表 grok_token_rows:
+    sso 主键；token_type、status、remaining_queries 等为独立列（状态、剩余次数建有索引）
+    tags 为JSON列，未建列的字段存入 extra（JSON）
+
+批量保存只写入变更的Token：多行 INSERT ... ON DUPLICATE KEY UPDATE，删除按主键批量执行。
+旧版整表单行JSON（grok_tokens）仅作为首次启动的迁移来源。
+
+表 grok_token_archive:
+    冷归档Token，每个SSO一行，整条数据存为JSON；按需读取，不参与启动加载
+"""
+
+import orjson
+import warnings
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.logger import logger
+
+
+TABLE = "grok_token_rows"
+ARCHIVE_TABLE = "grok_token_archive"
+TOKEN_TYPES = ("ssoNormal", "ssoSuper")
+WRITE_BATCH = 500
+
+# 字段 -> (列名, 列类型)；NULL 读回为 None 的字段见 NULLABLE
+COLUMNS: Dict[str, Tuple[str, str]] = {
+    "createdTime": ("created_time", "BIGINT NULL"),
+    "remainingQueries": ("remaining_queries", "INT NULL"),
+    "heavyremainingQueries": ("heavy_remaining_queries", "INT NULL"),
+    "videoRemaining": ("video_remaining", "INT NULL"),
+    "videoLimit": ("video_limit", "INT NULL"),
+    "status": ("status", "VARCHAR(16) NULL"),
+    "failedCount": ("failed_count", "INT NULL"),
+    "zeroCount": ("zero_count", "INT NULL"),
+    "lastFailureTime": ("last_failure_time", "BIGINT NULL"),
+    "lastFailureReason": ("last_failure_reason", "TEXT NULL"),
+    "lastCheckTime": ("last_check_time", "BIGINT NULL"),
+    "cooldownUntil": ("cooldown_until", "BIGINT NULL"),
+    "cooldownReason": ("cooldown_reason", "VARCHAR(32) NULL"),
+    "cooldownCount": ("cooldown_count", "INT NULL"),
+    "tags": ("tags", "JSON NULL"),
+    "note": ("note", "TEXT NULL"),
+}
+NULLABLE = {"lastFailureTime", "lastFailureReason", "lastCheckTime", "cooldownUntil", "cooldownReason"}
+_INT_LIMITS = {"INT": 2 ** 31, "BIGINT": 2 ** 63}
+
+_NAMES = ["sso", "token_type"] + [column for column, _ in COLUMNS.values()] + ["extra"]
+
+CREATE_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+        sso VARCHAR(1024) CHARACTER SET ascii COLLATE ascii_bin NOT NULL PRIMARY KEY,
+        token_type VARCHAR(16) NOT NULL,
+        {", ".join(f"{column} {kind}" for column, kind in COLUMNS.values())},
+        extra JSON NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        KEY idx_status (token_type, status),
+        KEY idx_remaining (token_type, remaining_queries),
+        KEY idx_heavy_remaining (token_type, heavy_remaining_queries),
+        KEY idx_cooldown (cooldown_until)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+UPSERT_SQL = (
+    f"INSERT INTO {TABLE} ({', '.join(_NAMES)}) VALUES ({', '.join(['%s'] * len(_NAMES))}) "
+    f"ON DUPLICATE KEY UPDATE {', '.join(f'{name} = VALUES({name})' for name in _NAMES[1:])}"
+)
+SELECT_SQL = f"SELECT {', '.join(_NAMES)} FROM {TABLE}"
+
+ARCHIVE_CREATE_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} (
+        sso VARCHAR(1024) CHARACTER SET ascii COLLATE ascii_bin NOT NULL PRIMARY KEY,
+        token_type VARCHAR(16) NOT NULL,
+        archived_at BIGINT NOT NULL,
+        reason VARCHAR(32) NOT NULL,
+        data JSON NOT NULL,
+        KEY idx_archived_at (archived_at)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+ARCHIVE_UPSERT_SQL = (
+    f"INSERT INTO {ARCHIVE_TABLE} (sso, token_type, archived_at, reason, data) VALUES (%s, %s, %s, %s, %s) "
+    f"ON DUPLICATE KEY UPDATE token_type = VALUES(token_type), archived_at = VALUES(archived_at), "
+    f"reason = VALUES(reason), data = VALUES(data)"
+)
+
+
+def _column_value(key: str, value: Any) -> Tuple[bool, Any]:
+    """字段值 -> (是否可存入列, 列值)"""
+    kind = COLUMNS[key][1].split()[0]
+    if value is None:
+        return True, None
+    if kind in _INT_LIMITS:
+        ok = type(value) is int and -_INT_LIMITS[kind] <= value < _INT_LIMITS[kind]
+        return ok, value
+    if kind == "JSON":
+        ok = isinstance(value, list) and all(isinstance(t, str) for t in value)
+        return ok, orjson.dumps(value).decode() if ok else None
+    if kind.startswith("VARCHAR"):
+        limit = int(kind[8:-1])
+        return isinstance(value, str) and len(value) <= limit, value
+    return isinstance(value, str), value
+
+
+def to_row(token_type: str, sso: str, record: Dict[str, Any]) -> tuple:
+    """Token数据 -> 表行（不符合列类型的值与未建列字段存入 extra）"""
+    values: List[Any] = [sso, token_type]
+    extra: Dict[str, Any] = {key: value for key, value in record.items() if key not in COLUMNS}
+    for key in COLUMNS:
+        if key not in record:
+            values.append(None)
+            continue
+        ok, value = _column_value(key, record[key])
+        if not ok:
+            extra[key] = record[key]
+            value = None
+        values.append(value)
+    values.append(orjson.dumps(extra).decode() if extra else None)
+    return tuple(values)
+
+
+def from_row(row: Iterable[Any]) -> Tuple[str, str, Dict[str, Any]]:
+    """表行 -> (类型, sso, Token数据)"""
+    sso, token_type, *values, extra = row
+    record: Dict[str, Any] = {}
+    for key, value in zip(COLUMNS, values):
+        if value is None:
+            if key in NULLABLE:
+                record[key] = None
+        elif key == "tags":
+            record[key] = orjson.loads(value)
+        else:
+            record[key] = value
+    if extra:
+        record.update(orjson.loads(extra))
+    return token_type, sso, record
+
+
+class MysqlTokenStore:
+    """按行存储Token（使用 MysqlStorage 的连接池）"""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    async def create_table(self) -> None:
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                with warnings.catch_warnings():
+                    warnings.filterwarnings('ignore', message='.*already exists')
+                    await cursor.execute(CREATE_SQL)
+                    await cursor.execute(ARCHIVE_CREATE_SQL)
+
+    async def initialized(self) -> bool:
+        """表中是否已有数据"""
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"SELECT 1 FROM {TABLE} LIMIT 1")
+                return await cursor.fetchone() is not None
+
+    async def load_all(self) -> Dict[str, Any]:
+        """读取全部Token（按类型分组）"""
+        data: Dict[str, Any] = {token_type: {} for token_type in TOKEN_TYPES}
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(SELECT_SQL)
+                for row in await cursor.fetchall():
+                    token_type, sso, record = from_row(row)
+                    data.setdefault(token_type, {})[sso] = record
+        return data
+
+    async def apply_changes(self, changes: Dict[str, Tuple[Optional[str], Optional[Dict[str, Any]]]]) -> None:
+        """写入变更的Token（sso -> (类型, 数据)，数据为None表示删除）"""
+        rows = [to_row(token_type, sso, record) for sso, (token_type, record) in changes.items()
+                if token_type is not None and record is not None]
+        deleted = [sso for sso, (token_type, record) in changes.items() if token_type is None or record is None]
+
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                for start in range(0, len(rows), WRITE_BATCH):
+                    # executemany 会合并为单条多行 INSERT
+                    await cursor.executemany(UPSERT_SQL, rows[start:start + WRITE_BATCH])
+                for start in range(0, len(deleted), WRITE_BATCH):
+                    batch = deleted[start:start + WRITE_BATCH]
+                    await cursor.execute(
+                        f"DELETE FROM {TABLE} WHERE sso IN ({', '.join(['%s'] * len(batch))})", batch
+                    )
+
+    async def replace_all(self, data: Dict[str, Any]) -> int:
+        """以给定数据覆盖全部Token（迁移/全量保存）"""
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"SELECT sso FROM {TABLE}")
+                existing = {row[0] for row in await cursor.fetchall()}
+
+        changes = {}
+        for token_type in TOKEN_TYPES:
+            for sso, record in (data.get(token_type) or {}).items():
+                changes[sso] = (token_type, record)
+        for sso in existing - set(changes):
+            changes[sso] = (None, None)
+        await self.apply_changes(changes)
+        return len(changes)
+
+    # === 冷归档 ===
+
+    async def load_archive(self, ssos: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """读取归档条目（ssos为None时读取全部）"""
+        sql = f"SELECT sso, token_type, archived_at, reason, data FROM {ARCHIVE_TABLE}"
+        batches: List[Optional[List[str]]] = [None]
+        if ssos is not None:
+            ssos = list(ssos)
+            batches = [ssos[start:start + WRITE_BATCH] for start in range(0, len(ssos), WRITE_BATCH)]
+
+        result: Dict[str, Dict[str, Any]] = {}
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                for batch in batches:
+                    if batch is None:
+                        await cursor.execute(sql)
+                    else:
+                        await cursor.execute(f"{sql} WHERE sso IN ({', '.join(['%s'] * len(batch))})", batch)
+                    for sso, token_type, archived_at, reason, data in await cursor.fetchall():
+                        result[sso] = {"type": token_type, "archivedAt": archived_at,
+                                       "reason": reason, "data": orjson.loads(data)}
+        return result
+
+    async def save_archive(self, changes: Dict[str, Optional[Dict[str, Any]]]) -> None:
+        """写入归档变更（条目为None表示移出归档）"""
+        rows = [
+            (sso, entry["type"], entry["archivedAt"], entry["reason"], orjson.dumps(entry["data"]).decode())
+            for sso, entry in changes.items() if entry is not None
+        ]
+        deleted = [sso for sso, entry in changes.items() if entry is None]
+
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                for start in range(0, len(rows), WRITE_BATCH):
+                    await cursor.executemany(ARCHIVE_UPSERT_SQL, rows[start:start + WRITE_BATCH])
+                for start in range(0, len(deleted), WRITE_BATCH):
+                    batch = deleted[start:start + WRITE_BATCH]
+                    await cursor.execute(
+                        f"DELETE FROM {ARCHIVE_TABLE} WHERE sso IN ({', '.join(['%s'] * len(batch))})", batch
+                    )
+
+
+async def migrate_tokens(store: MysqlTokenStore, data: Dict[str, Any]) -> None:
+    """旧版单行JSON / 本地文件 -> 每Token一行"""
+    count = await store.replace_all(data)
+    logger.info(f"[Storage] Token已迁移为MySQL按行存储: {count} 个")
@@ -0,0 +1,163 @@
+"""SSO→代理分配 - 按代理实测容量加权的有界负载一致性哈希（consistent hashing with bounded loads）
+
+每个代理在哈希环上占 VNODES 个虚拟节点，SSO 按自身哈希顺时针找到第一个可用且未满的代理：
+    - 代理容量按权重（由延迟与成功率评分折算，见 ProxyPool._assignment_weights）分摊 SSO 总数，
+      上限为 ceil(份额 × (1 + proxy_assign_balance))，单个代理不会再堆积上百个账号；
+    - 代理失效时其 SSO 沿环分散到各自的后继代理，而不是集中到下一个轮询到的代理；
+    - 代理增加、移除或恢复后的重新分配只移动必要的 SSO：失效代理上的、超出上限的，
+      以及为填补低于份额 (1 - proxy_assign_balance) 的代理而从最满代理移出的。
+"""
+
+import hashlib
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+VNODES = 160  # 每个代理的虚拟节点数
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """代理哈希环（虚拟节点数固定，权重只影响容量，环结构不随延迟波动）"""
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = VNODES):
+        points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self._keys = [p for p, _ in points]
+        self._nodes = [n for _, n in points]
+        self.members = frozenset(self._nodes)
+
+    def walk(self, key: str) -> Iterator[str]:
+        """从 key 的位置顺时针依次返回各个代理（不重复）"""
+        if not self._keys:
+            return
+        start = bisect_left(self._keys, _hash(key)) % len(self._keys)
+        seen = set()
+        for i in range(len(self._keys)):
+            node = self._nodes[(start + i) % len(self._keys)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.members):
+                    return
+
+
+def capacity(fair: float, balance: float) -> int:
+    """份额对应的绑定上限"""
+    return max(1, math.ceil(fair * (1 + balance)))
+
+
+def shares(weights: Dict[str, float], total: int, balance: float) -> Dict[str, Tuple[float, int, int]]:
+    """按权重分摊 total 个SSO，返回 代理 -> (份额, 上限, 下限)"""
+    weight_sum = sum(weights.values())
+    if not weight_sum:
+        return {}
+    result = {}
+    for url, weight in weights.items():
+        fair = total * weight / weight_sum
+        result[url] = (fair, capacity(fair, balance), math.floor(fair * (1 - balance)))
+    return result
+
+
+def place(ring: HashRing, sso: str, has_room: Callable[[str], bool]) -> Optional[str]:
+    """沿环为 sso 找第一个可用且未满的代理"""
+    for url in ring.walk(sso):
+        if has_room(url):
+            return url
+    return None
+
+
+def plan(
+    ring: HashRing,
+    assignments: Dict[str, str],
+    weights: Dict[str, float],
+    balance: float,
+) -> List[Tuple[str, str, str]]:
+    """计算最少移动的重新分配
+
+    Args:
+        ring: 哈希环
+        assignments: 当前绑定 SSO -> 代理
+        weights: 可用代理及权重（不在其中的代理上的SSO需要迁出）
+        balance: 允许偏离份额的比例
+
+    Returns:
+        移动列表 [(sso, 原代理, 新代理)]
+    """
+    if not weights:
+        return []
+    bounds = shares(weights, len(assignments), balance)
+    caps = {url: cap for url, (_, cap, _) in bounds.items()}
+
+    members: Dict[str, List[str]] = {url: [] for url in weights}
+    moving: List[str] = []
+    for sso, url in assignments.items():
+        if url in members:
+            members[url].append(sso)
+        else:
+            moving.append(sso)
+
+    homes: Dict[str, Tuple[str, int]] = {}  # SSO -> (环上首选代理, 哈希)
+
+    def order(url: str, sso: str) -> Tuple[bool, int]:
+        # 优先迁出环上首选代理不是当前代理的SSO（移动后更接近一致性哈希的自然位置），其余按哈希顺序
+        if sso not in homes:
+            homes[sso] = (next(ring.walk(sso)), _hash(sso))
+        home, point = homes[sso]
+        return home == url, point
+
+    def evict(url: str, count: int) -> List[str]:
+        ordered = sorted(members[url], key=lambda sso: order(url, sso))
+        members[url] = ordered[count:]
+        return ordered[:count]
+
+    def take(url: str) -> str:
+        ssos = members[url]
+        index = min(range(len(ssos)), key=lambda i: order(url, ssos[i]))
+        sso = ssos[index]
+        ssos[index] = ssos[-1]
+        ssos.pop()
+        return sso
+
+    # 1. 超出上限的代理迁出多余部分，连同失效代理上的SSO沿环放置
+    for url in weights:
+        extra = len(members[url]) - caps[url]
+        if extra > 0:
+            moving.extend(evict(url, extra))
+    loads = {url: len(ssos) for url, ssos in members.items()}
+
+    def has_room(url: str) -> bool:
+        return url in caps and loads[url] < caps[url]
+
+    for sso in moving:
+        target = place(ring, sso, has_room)
+        if target is not None:
+            members[target].append(sso)
+            loads[target] += 1
+
+    # 2. 低于下限的代理（新增或刚恢复）从负载比最高的代理拉取，补到份额
+    for url in sorted(weights, key=_hash):
+        fair, _, floor = bounds[url]
+        if loads[url] >= floor:
+            continue
+        while loads[url] < math.floor(fair):
+            donor = max(
+                (u for u in weights if u != url and loads[u] > bounds[u][0]),
+                key=lambda u: loads[u] / bounds[u][0],
+                default=None,
+            )
+            if donor is None:
+                break
+            members[url].append(take(donor))
+            loads[donor] -= 1
+            loads[url] += 1
+
+    return [
+        (sso, assignments[sso], url)
+        for url, ssos in members.items()
+        for sso in ssos
+        if assignments[sso] != url
+    ]
@@ -2,10 +2,20 @@
 
 import asyncio
 import aiohttp
+import orjson
+import random
+import re
 import time
+from collections import deque
 from dataclasses import dataclass, field, asdict
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Deque, AsyncIterator, Iterable, Set
+from curl_cffi.const import CurlInfo
+from curl_cffi.requests import AsyncSession
+from app.core.breaker import circuit_breakers
+from app.core.proxy_assign import HashRing, capacity, place, plan, shares
+from app.core.config import setting
 from app.core.logger import logger
+from app.core.session_pool import DEFAULT_BROWSER
 
 
 @dataclass
@@ -32,6 +42,82 @@ class ProxyInfo:
 # 常量
 MAX_FAIL_COUNT = 3  # 最大连续失败次数
 HEALTH_CHECK_INTERVAL = 60  # 健康检查间隔（秒）
+LATENCY_ALPHA = 0.3  # 延迟EWMA系数
+LATENCY_SAMPLES = 128  # 每个代理保留的首字节延迟样本数（百分位用）
+SUCCESS_WINDOW = 50  # 成功率滑动窗口（最近请求数）
+LATENCY_STALE = 60  # 超过该时间（秒）没有样本的代理按未知处理，重新参与探索
+MIN_SUCCESS_RATE = 0.05  # 评分时成功率下限
+FAILURE_PENALTY = 1.0  # 每次预期失败（换代理重试）折算的延迟（秒）
+PROBE_INFOS = [CurlInfo.CONNECT_TIME, CurlInfo.APPCONNECT_TIME, CurlInfo.STARTTRANSFER_TIME]
+POOL_LIST_KEYS = ("data", "proxies", "proxy_list", "list", "result")  # 代理池API返回JSON对象时存放列表的字段
+
+
+class ProxyLatency:
+    """代理延迟与成功率（运行时统计，随热启动快照保存）"""
+
+    __slots__ = ("connect", "ttfb", "updated", "samples", "outcomes")
+
+    def __init__(self):
+        self.connect: Optional[float] = None  # 握手耗时EWMA（秒，仅新建连接时采样）
+        self.ttfb: Optional[float] = None  # 首字节延迟EWMA（秒）
+        self.updated = 0.0  # 最近一次延迟样本时间（time.monotonic()）
+        self.samples: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.outcomes: Deque[bool] = deque(maxlen=SUCCESS_WINDOW)
+
+    def observe(self, ok: Optional[bool], ttfb: Optional[float], connect: Optional[float]) -> None:
+        if ok is not None:
+            self.outcomes.append(ok)
+        if connect:
+            self.connect = connect if self.connect is None else self.connect + LATENCY_ALPHA * (connect - self.connect)
+        if ttfb:
+            self.ttfb = ttfb if self.ttfb is None else self.ttfb + LATENCY_ALPHA * (ttfb - self.ttfb)
+            self.samples.append(ttfb)
+            self.updated = time.monotonic()
+
+    def success_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 1.0
+
+    def score(self) -> float:
+        """选择评分（越小越好）：按成功率折算的预期延迟；没有近期样本时为0，优先探索"""
+        if self.ttfb is None or time.monotonic() - self.updated > LATENCY_STALE:
+            return 0.0
+        rate = max(self.success_rate(), MIN_SUCCESS_RATE)
+        return (self.ttfb + (1 - rate) * FAILURE_PENALTY) / rate
+
+    def to_dict(self) -> Dict[str, Any]:
+        ordered = sorted(self.samples)
+
+        def pct(q: float) -> Optional[float]:
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1) if ordered else None
+
+        return {
+            "connect_ms": round(self.connect * 1000, 1) if self.connect is not None else None,
+            "ttfb_ms": round(self.ttfb * 1000, 1) if self.ttfb is not None else None,
+            "p50_ms": pct(0.5),
+            "p90_ms": pct(0.9),
+            "p99_ms": pct(0.99),
+            "samples": len(ordered),
+            "success_rate": round(self.success_rate(), 4),
+        }
+
+    def export(self) -> Dict[str, Any]:
+        return {
+            "connect": self.connect,
+            "ttfb": self.ttfb,
+            "samples": list(self.samples),
+            "outcomes": [int(ok) for ok in self.outcomes],
+        }
+
+    @classmethod
+    def restore(cls, data: Dict[str, Any]) -> "ProxyLatency":
+        latency = cls()
+        latency.connect = data.get("connect")
+        latency.ttfb = data.get("ttfb")
+        latency.samples.extend(float(v) for v in data.get("samples") or [])
+        latency.outcomes.extend(bool(v) for v in data.get("outcomes") or [])
+        if latency.ttfb is not None:
+            latency.updated = time.monotonic()
+        return latency
 
 
 class ProxyPool:
@@ -49,22 +135,62 @@ class ProxyPool:
         self._storage = None
         self._suspend_persist = False
         self._state_loaded = False
+
+        # 延迟合并保存
+        self._dirty = False  # 健康/绑定等结构变更待保存
+        self._counters_dirty = False  # 仅请求计数变更待保存
+        self._pending_changes = 0  # 自上次保存以来合并的变更数
+        self._persist_task: Optional[asyncio.Task] = None
+        self._last_save = time.monotonic()
+        self._saves = 0
+        self._coalesced = 0
+        self._save_failures = 0
+        self._last_save_ms: Optional[float] = None
         
         # 多代理支持
         self._proxies: Dict[str, ProxyInfo] = {}  # URL -> ProxyInfo
         self._sso_assignments: Dict[str, str] = {}  # SSO -> Proxy URL
-        self._round_robin_index: int = 0
+        self._latency: Dict[str, ProxyLatency] = {}  # URL -> 延迟与成功率
+        # 健康代理集合（增量维护，选择时不再逐个扫描）
+        self._healthy: List[str] = []
+        self._healthy_pos: Dict[str, int] = {}
+        # SSO分配（有界负载一致性哈希）
+        self._ring: Optional[HashRing] = None  # 代理增删时重建
+        self._weights: Optional[tuple] = None  # (计算时间, 权重, 权重和)，分配新SSO时短暂复用
+        self._rebalance_due = False  # 代理增加/移除/恢复后待重新分配
+        self._rebalances = 0
+        self._rebalance_moves = 0
+
+        # 主动探测
+        self._probe_results: Dict[str, Dict[str, Any]] = {}  # URL -> 最近一次探测结果
+        self._probe_task: Optional[asyncio.Task] = None
+        self._probe_rounds = 0
+
+        # 代理池API预取（已验证、待使用的代理及获取时间）
+        self._buffer: Deque[tuple] = deque()
+        self._candidates: List[str] = []  # 代理池API已返回、尚未验证的代理
+        self._refill_task: Optional[asyncio.Task] = None
+        self._prefetch_stats: Dict[str, int] = {
+            "hits": 0, "misses": 0, "fetches": 0, "fetched": 0, "rejected": 0, "expired": 0,
+        }
+
+        # 跨节点健康共享（Redis存储时由 storage.proxy_health 提供）
+        self._health_store = None
+        self._health_task: Optional[asyncio.Task] = None
+        self._health_background: Set[asyncio.Task] = set()
+        self._health_stats: Dict[str, int] = {"published": 0, "received": 0, "applied": 0, "resyncs": 0, "errors": 0}
 
     def set_storage(self, storage: Any) -> None:
-        """设置存储实例（用于代理绑定持久化）"""
+        """设置存储实例（用于代理绑定持久化与跨节点健康共享）"""
         self._storage = storage
+        self._health_store = getattr(storage, "proxy_health", None)
     
     def configure(self, proxy_url: str, proxy_pool_url: str = "", proxy_pool_interval: int = 300):
         """配置代理池
         
         Args:
             proxy_url: 静态代理URL（socks5h://xxx 或 http://xxx）
-            proxy_pool_url: 代理池API URL，返回单个代理地址
+            proxy_pool_url: 代理池API URL，返回单个代理地址或代理列表（多行 / JSON）
             proxy_pool_interval: 代理池刷新间隔（秒）
         """
         self._static_proxy = self._normalize_proxy(proxy_url) if proxy_url else None
@@ -112,8 +238,13 @@ class ProxyPool:
             return True
         
         self._proxies[normalized] = ProxyInfo(url=normalized)
+        self._set_healthy(normalized, True)
+        self._ring = None
+        self._rebalance_due = True
         logger.info(f"[ProxyPool] 添加代理: {normalized}")
-        self._schedule_persist()
+        self._mark_dirty()
+        if self._health_task is not None:
+            self._spawn_health(self._pull_health([normalized]))
         return True
     
     def remove_proxy(self, url: str) -> bool:
@@ -136,8 +267,13 @@ class ProxyPool:
                 del self._sso_assignments[sso]
         
         del self._proxies[normalized]
+        self._set_healthy(normalized, False)
+        self._latency.pop(normalized, None)
+        self._probe_results.pop(normalized, None)
+        self._ring = None
+        self._rebalance_due = True
         logger.info(f"[ProxyPool] 移除代理: {normalized}")
-        self._schedule_persist()
+        self._mark_dirty()
         return True
     
     def assign_to_sso(self, proxy_url: str, sso: str) -> bool:
@@ -155,6 +291,12 @@ class ProxyPool:
             logger.warning(f"[ProxyPool] 代理不存在: {normalized}")
             return False
         
+        self._bind(sso, normalized)
+        logger.info(f"[ProxyPool] 绑定SSO: {sso[:10]}... -> {normalized}")
+        self._mark_dirty()
+        return True
+
+    def _bind(self, sso: str, url: str) -> None:
         # 如果SSO已绑定其他代理，先解绑
         if sso in self._sso_assignments:
             old_proxy = self._sso_assignments[sso]
@@ -162,14 +304,10 @@ class ProxyPool:
                 self._proxies[old_proxy].assigned_sso = [
                     s for s in self._proxies[old_proxy].assigned_sso if s != sso
                 ]
-        
-        self._sso_assignments[sso] = normalized
-        if sso not in self._proxies[normalized].assigned_sso:
-            self._proxies[normalized].assigned_sso.append(sso)
-        
-        logger.info(f"[ProxyPool] 绑定SSO: {sso[:10]}... -> {normalized}")
-        self._schedule_persist()
-        return True
+
+        self._sso_assignments[sso] = url
+        if sso not in self._proxies[url].assigned_sso:
+            self._proxies[url].assigned_sso.append(sso)
     
     def unassign_from_sso(self, sso: str) -> bool:
         """取消SSO的代理绑定
@@ -191,7 +329,7 @@ class ProxyPool:
         
         del self._sso_assignments[sso]
         logger.info(f"[ProxyPool] 解绑SSO: {sso[:10]}...")
-        self._schedule_persist()
+        self._mark_dirty()
         return True
 
     async def get_proxy_for_sso(self, sso: str = "") -> Optional[str]:
@@ -205,43 +343,223 @@ class ProxyPool:
         Returns:
             代理URL或None
         """
+        # 代理增加/移除/恢复后先做一次最少移动的重新分配
+        if self._rebalance_due and self._assign_config()["rebalance"]:
+            self.rebalance(apply=True)
+
         # 1. 检查SSO绑定
         if sso and sso in self._sso_assignments:
             proxy_url = self._sso_assignments[sso]
-            if proxy_url in self._proxies and self._proxies[proxy_url].healthy:
+            if proxy_url in self._proxies and self._proxies[proxy_url].healthy and circuit_breakers.proxy_available(proxy_url):
                 return proxy_url
-            # 解绑无效/不健康代理
+            # 解绑无效/不健康/熔断中的代理
             self.unassign_from_sso(sso)
         
-        # 2. 自动分配（轮询健康代理）
-        proxy = await self._select_proxy_round_robin()
+        # 2. 自动分配：有SSO时按一致性哈希放到环上第一个未满的代理，否则按延迟与成功率选择
+        if sso:
+            proxy = self._place_sso(sso)
+            if proxy:
+                self._proxies[proxy].last_used = int(time.time() * 1000)
+                self._proxies[proxy].total_requests += 1
+                self.assign_to_sso(proxy, sso)
+                return proxy
+        proxy = await self._select_proxy()
         if sso and proxy:
             self.assign_to_sso(proxy, sso)
         return proxy
+
+    # === SSO分配 ===
+
+    @staticmethod
+    def _assign_config() -> Dict[str, Any]:
+        cfg = setting.grok_config
+        return {
+            "balance": max(0.0, float(cfg.get("proxy_assign_balance", 0.25) or 0)),
+            "rebalance": bool(cfg.get("proxy_assign_rebalance", True)),
+        }
+
+    def _hash_ring(self) -> HashRing:
+        if self._ring is None:
+            self._ring = HashRing(self._proxies)
+        return self._ring
+
+    def _assignment_weights(self) -> Dict[str, float]:
+        """可分配SSO的代理（健康且未熔断）及权重
+
+        权重为中位数评分与该代理评分之比（评分越低、容量越大），限制在 0.25~4 倍；无延迟样本的代理按 1 计。
+        """
+        urls = [url for url in self._healthy if circuit_breakers.proxy_available(url)]
+        scores = {url: self._score(url) for url in urls}
+        known = sorted(v for v in scores.values() if v > 0)
+        if not known:
+            return {url: 1.0 for url in urls}
+        median = known[len(known) // 2]
+        return {url: min(4.0, max(0.25, median / score)) if score > 0 else 1.0 for url, score in scores.items()}
+
+    def _place_sso(self, sso: str) -> Optional[str]:
+        """为未绑定的SSO选择代理：环上顺时针第一个负载未达上限的可用代理
+
+        权重最多复用1秒（健康状态变化时重算），只为沿环经过的代理计算上限，分配不随代理数变慢。
+        """
+        now = time.monotonic()
+        if self._weights is None or now - self._weights[0] >= 1.0:
+            weights = self._assignment_weights()
+            self._weights = (now, weights, sum(weights.values()))
+        _, weights, weight_sum = self._weights
+        if not weight_sum:
+            return None
+        total = len(self._sso_assignments) + 1
+        balance = self._assign_config()["balance"]
+
+        def has_room(url: str) -> bool:
+            weight = weights.get(url)
+            info = self._proxies.get(url)
+            if weight is None or info is None or not info.healthy or not circuit_breakers.proxy_available(url):
+                return False
+            return len(info.assigned_sso) < capacity(total * weight / weight_sum, balance)
+
+        return place(self._hash_ring(), sso, has_room)
+
+    def rebalance(self, apply: bool = False) -> Dict[str, Any]:
+        """计算（并可应用）最少移动的重新分配
+
+        Args:
+            apply: 为False时只预览
+
+        Returns:
+            移动列表与移动前后的分配分布
+        """
+        self._rebalance_due = False
+        weights = self._assignment_weights()
+        before = dict(self._sso_assignments)
+        moves = plan(self._hash_ring(), before, weights, self._assign_config()["balance"])
+        after = dict(before)
+        after.update((sso, target) for sso, _, target in moves)
+
+        if apply and moves:
+            for sso, _, target in moves:
+                self._bind(sso, target)
+            self._rebalances += 1
+            self._rebalance_moves += len(moves)
+            self._mark_dirty()
+            logger.info(f"[ProxyPool] SSO重新分配: 移动 {len(moves)}/{len(before)} 个")
+        return {
+            "applied": apply,
+            "moves": [{"sso": sso, "from": source, "to": target} for sso, source, target in moves],
+            "before": self._distribution(before, weights),
+            "after": self._distribution(after, weights),
+        }
+
+    def _distribution(self, assignments: Dict[str, str], weights: Dict[str, float]) -> Dict[str, Any]:
+        """SSO在代理间的分布：每个代理的绑定数与份额，以及最大负载与份额之比"""
+        counts: Dict[str, int] = {url: 0 for url in self._proxies}
+        for url in assignments.values():
+            if url in counts:
+                counts[url] += 1
+        bounds = shares(weights, len(assignments), self._assign_config()["balance"])
+        proxies = {
+            url: {
+                "assigned": count,
+                "weight": round(weights[url], 3) if url in weights else 0.0,
+                "share": round(bounds[url][0], 1) if url in bounds else 0.0,
+                "cap": bounds[url][1] if url in bounds else 0,
+            }
+            for url, count in counts.items()
+        }
+        ratios = [counts[url] / fair for url, (fair, _, _) in bounds.items() if fair > 0]
+        return {
+            "total": len(assignments),
+            "stranded": sum(1 for url in assignments.values() if url not in weights),  # 绑定在不可用代理上
+            "max_load_ratio": round(max(ratios), 3) if ratios else 0.0,
+            "min_load_ratio": round(min(ratios), 3) if ratios else 0.0,
+            "proxies": proxies,
+        }
+
+    def get_assignment_stats(self) -> Dict[str, Any]:
+        """当前SSO分配分布与重新分配统计"""
+        cfg = self._assign_config()
+        return {
+            "balance": cfg["balance"],
+            "auto_rebalance": cfg["rebalance"],
+            "rebalances": self._rebalances,
+            "moves": self._rebalance_moves,
+            **self._distribution(self._sso_assignments, self._assignment_weights()),
+        }
     
-    async def _select_proxy_round_robin(self) -> Optional[str]:
-        """轮询选择健康代理"""
-        healthy_proxies = [url for url, info in self._proxies.items() if info.healthy]
+    async def _select_proxy(self) -> Optional[str]:
+        """选择健康代理（跳过熔断中的代理）"""
+        selected = self._pick()
         
-        if not healthy_proxies:
-            # 没有健康代理，尝试从代理池获取
+        if not selected:
+            # 没有健康代理，优先使用预取的代理，否则从代理池获取
             if self._enabled:
-                await self._fetch_proxy()
-                healthy_proxies = [url for url, info in self._proxies.items() if info.healthy]
+                selected = self._take_prefetched()
+                if not selected:
+                    await self._fetch_proxy()
+                    selected = self._pick()
             
-            if not healthy_proxies:
+            if not selected:
                 return self._static_proxy
         
-        # 轮询选择
-        self._round_robin_index = self._round_robin_index % len(healthy_proxies)
-        selected = healthy_proxies[self._round_robin_index]
-        self._round_robin_index += 1
-        
         # 更新使用时间
         self._proxies[selected].last_used = int(time.time() * 1000)
         self._proxies[selected].total_requests += 1
         
         return selected
+
+    def _pick(self) -> Optional[str]:
+        """二选一（power of two choices）：随机取两个健康代理，选评分（延迟/成功率）较低的一个"""
+        healthy = self._healthy
+        if len(healthy) <= 2:
+            candidates = [url for url in healthy if circuit_breakers.proxy_available(url)]
+        else:
+            candidates = []
+            for _ in range(3):  # 抽到熔断中的代理时重新抽样
+                candidates = [url for url in random.sample(healthy, 2) if circuit_breakers.proxy_available(url)]
+                if candidates:
+                    break
+            else:
+                candidates = [url for url in healthy if circuit_breakers.proxy_available(url)]
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+        return min(candidates, key=self._score)
+
+    def _score(self, url: str) -> float:
+        latency = self._latency.get(url)
+        return latency.score() if latency else 0.0
+
+    def _set_healthy(self, url: str, healthy: bool) -> None:
+        """维护健康代理集合（交换删除，O(1)）"""
+        self._weights = None
+        pos = self._healthy_pos.get(url)
+        if healthy and pos is None:
+            self._healthy_pos[url] = len(self._healthy)
+            self._healthy.append(url)
+        elif not healthy and pos is not None:
+            last = self._healthy.pop()
+            if last != url:
+                self._healthy[pos] = last
+                self._healthy_pos[last] = pos
+            del self._healthy_pos[url]
+
+    def observe(self, proxy_url: Optional[str], status: int, ttfb: Optional[float] = None, connect: Optional[float] = None) -> None:
+        """记录一次经代理的上游响应（延迟与成功率）
+
+        Args:
+            proxy_url: 代理URL（为空时忽略）
+            status: 上游状态码，0 为网络/TLS错误；403 与网络错误计为失败，401/429/5xx 不计入成功率
+            ttfb: 首字节延迟（秒）
+            connect: 握手耗时（秒，复用连接时为None）
+        """
+        if not proxy_url or proxy_url not in self._proxies:
+            return
+        ok = True if 0 < status < 400 else (False if status in (0, 403) else None)
+        latency = self._latency.get(proxy_url)
+        if latency is None:
+            latency = self._latency[proxy_url] = ProxyLatency()
+        latency.observe(ok, ttfb if ok else None, connect)
     
     def mark_failure(self, proxy_url: str) -> None:
         """标记代理失败
@@ -256,15 +574,23 @@ class ProxyPool:
         info = self._proxies[normalized]
         info.fail_count += 1
         
-        if info.fail_count >= MAX_FAIL_COUNT:
+        changed = info.fail_count >= MAX_FAIL_COUNT and self._demote(normalized, f"连续失败{info.fail_count}次")
+        self._mark_dirty(counters=not changed)
+        self._share_health(normalized, True, demote=not info.healthy)
+
+    def _demote(self, url: str, reason: str) -> bool:
+        """标记代理不健康并解绑所有SSO，返回健康状态或绑定是否有变化"""
+        info = self._proxies[url]
+        changed = info.healthy or bool(info.assigned_sso)
+        if info.healthy:
             info.healthy = False
-            logger.warning(f"[ProxyPool] 代理标记为不健康: {normalized} (连续失败{info.fail_count}次)")
-            # 解绑所有SSO
-            for sso in list(info.assigned_sso):
-                if sso in self._sso_assignments:
-                    del self._sso_assignments[sso]
-            info.assigned_sso = []
-        self._schedule_persist()
+            self._set_healthy(url, False)
+            logger.warning(f"[ProxyPool] 代理标记为不健康: {url} ({reason})")
+        for sso in list(info.assigned_sso):
+            if sso in self._sso_assignments:
+                del self._sso_assignments[sso]
+        info.assigned_sso = []
+        return changed
     
     def mark_success(self, proxy_url: str) -> None:
         """标记代理成功（重置失败计数）
@@ -277,18 +603,33 @@ class ProxyPool:
             return
         
         info = self._proxies[normalized]
+        if info.fail_count or not info.healthy:
+            self._share_health(normalized, False)  # 只在状态有变化时上报，健康代理的成功不产生Redis写入
         info.fail_count = 0
         info.success_requests += 1
         
         # 如果之前不健康，恢复健康状态
         if not info.healthy:
             info.healthy = True
+            self._set_healthy(normalized, True)
+            self._rebalance_due = True
             logger.info(f"[ProxyPool] 代理恢复健康: {normalized}")
-        self._schedule_persist()
+            self._mark_dirty()
+        else:
+            self._mark_dirty(counters=True)
     
     def get_all_proxies(self) -> List[Dict[str, Any]]:
-        """获取所有代理信息"""
-        return [info.to_dict() for info in self._proxies.values()]
+        """获取所有代理信息（含熔断状态、延迟百分位与成功率）"""
+        empty = ProxyLatency()
+        return [
+            {
+                **info.to_dict(),
+                "circuit": circuit_breakers.proxy_state(url),
+                "latency": self._latency.get(url, empty).to_dict(),
+                "probe": self._probe_results.get(url),
+            }
+            for url, info in self._proxies.items()
+        ]
     
     def get_sso_assignments(self) -> Dict[str, str]:
         """获取所有SSO绑定关系"""
@@ -314,6 +655,7 @@ class ProxyPool:
                 for key in ["healthy", "fail_count", "last_used", "total_requests", "success_requests"]:
                     if key in info_data:
                         setattr(info, key, info_data[key])
+                self._set_healthy(normalized, info.healthy)
                 if "assigned_sso" in info_data and isinstance(info_data["assigned_sso"], list):
                     info.assigned_sso = info_data["assigned_sso"]
 
@@ -344,31 +686,465 @@ class ProxyPool:
         finally:
             self._state_loaded = True
             self._suspend_persist = False
-            self._schedule_persist()
+            self._mark_dirty()
+
+    def export_runtime(self) -> Dict[str, Any]:
+        """导出运行时状态（热启动快照用；健康与失败计数已由 proxy_state 持久化）"""
+        return {
+            "latency": {url: latency.export() for url, latency in self._latency.items()},
+            "pool_url": self._pool_url,
+            "current_proxy": self._current_proxy if self._enabled else None,
+            "last_fetch_time": self._last_fetch_time,
+        }
+
+    def restore_runtime(self, state: Dict[str, Any]) -> None:
+        """恢复代理延迟统计；代理池API取得的代理仍在刷新间隔内时直接沿用，不再重新拉取"""
+        for url, data in (state.get("latency") or {}).items():
+            if url in self._proxies:
+                self._latency[url] = ProxyLatency.restore(data)
+        current = state.get("current_proxy")
+        fetched = float(state.get("last_fetch_time", 0) or 0)
+        if (
+            self._enabled and current and state.get("pool_url") == self._pool_url
+            and time.time() - fetched < self._fetch_interval
+        ):
+            self._current_proxy = current
+            self._last_fetch_time = fetched
+            logger.info(f"[ProxyPool] 沿用上次获取的代理: {current}")
+
+    # === 延迟合并保存 ===
+
+    @staticmethod
+    def _persist_config() -> Dict[str, float]:
+        cfg = setting.grok_config
+        return {
+            "interval": max(0.1, float(cfg.get("proxy_state_save_interval", 5) or 5)),
+            "counter_interval": max(0.0, float(cfg.get("proxy_state_counter_interval", 60) or 0)),
+        }
+
+    def _persistable(self) -> bool:
+        return bool(self._storage) and hasattr(self._storage, "save_proxy_state")
+
+    def _mark_dirty(self, counters: bool = False) -> None:
+        """标记代理状态待保存，由后台任务按间隔合并写入
+
+        Args:
+            counters: 仅请求计数/失败计数变化（健康状态与绑定未变），按 proxy_state_counter_interval 低频写入
+        """
+        if not self._persistable() or not self._state_loaded or self._suspend_persist:
+            return
+        if counters:
+            self._counters_dirty = True
+        else:
+            self._dirty = True
+        self._pending_changes += 1
+
+    def _due(self, now: float) -> bool:
+        """是否到了写入时间：结构变更每个间隔写入；仅计数变更时距上次写入超过 counter_interval 才写"""
+        if self._dirty:
+            return True
+        if not self._counters_dirty:
+            return False
+        counter_interval = self._persist_config()["counter_interval"]
+        return counter_interval > 0 and now - self._last_save >= counter_interval
 
     async def _persist_state(self) -> None:
-        if not self._storage or not hasattr(self._storage, "save_proxy_state"):
+        """写入当前代理状态（先清标记再序列化，写入期间的新变更留给下一次）"""
+        if not self._persistable():
             return
         async with self._save_lock:
+            changes = self._pending_changes
+            self._dirty = self._counters_dirty = False
+            self._pending_changes = 0
             data = {
                 "proxies": {url: info.to_dict() for url, info in self._proxies.items()},
                 "assignments": self._sso_assignments.copy(),
             }
-            await self._storage.save_proxy_state(data)
+            t0 = time.monotonic()
+            try:
+                await self._storage.save_proxy_state(data)
+            except Exception:
+                self._dirty = True
+                self._pending_changes += changes
+                self._save_failures += 1
+                raise
+            self._last_save = time.monotonic()
+            self._last_save_ms = (self._last_save - t0) * 1000
+            self._saves += 1
+            self._coalesced += max(0, changes - 1)
 
-    def _schedule_persist(self) -> None:
-        if not self._storage or not hasattr(self._storage, "save_proxy_state"):
-            return
-        if not self._state_loaded:
+    async def _persist_worker(self) -> None:
+        """后台保存：每个 proxy_state_save_interval 检查一次，有到期的变更时写入一次"""
+        while True:
+            await asyncio.sleep(self._persist_config()["interval"])
+            if not self._due(time.monotonic()):
+                continue
+            try:
+                await self._persist_state()
+            except Exception as e:
+                logger.error(f"[ProxyPool] 保存代理状态失败: {e}")
+
+    async def start_persist(self) -> None:
+        """启动代理状态保存任务（需已设置支持 proxy_state 的存储）"""
+        if self._persist_task is None and self._persistable():
+            self._persist_task = asyncio.create_task(self._persist_worker())
+            logger.info("[ProxyPool] 代理状态保存任务已创建")
+
+    async def flush(self) -> None:
+        """立即写入待保存的变更（含仅计数变更）"""
+        if self._dirty or self._counters_dirty:
+            await self._persist_state()
+
+    async def shutdown(self) -> None:
+        """停止探测、预取、健康同步与保存任务，并写入剩余变更"""
+        await self.stop_prober()
+        if self._refill_task and not self._refill_task.done():
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+        await self.stop_health_sync()
+        if self._persist_task:
+            self._persist_task.cancel()
+            try:
+                await self._persist_task
+            except asyncio.CancelledError:
+                pass
+            self._persist_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"[ProxyPool] 关闭时保存代理状态失败: {e}")
+
+    def get_persist_stats(self) -> Dict[str, Any]:
+        """保存次数、合并掉的变更数与待保存状态"""
+        cfg = self._persist_config()
+        return {
+            "interval": cfg["interval"],
+            "counter_interval": cfg["counter_interval"],
+            "saves": self._saves,
+            "coalesced": self._coalesced,
+            "failures": self._save_failures,
+            "pending_changes": self._pending_changes,
+            "dirty": self._dirty,
+            "counters_dirty": self._counters_dirty,
+            "last_save_ms": round(self._last_save_ms, 1) if self._last_save_ms is not None else None,
+        }
+
+    # === 主动探测 ===
+
+    @staticmethod
+    def _probe_config() -> Dict[str, Any]:
+        cfg = setting.grok_config
+        return {
+            "interval": float(cfg.get("proxy_probe_interval", 60) or 0),
+            "concurrency": max(1, int(cfg.get("proxy_probe_concurrency", 16) or 1)),
+            "timeout": max(1.0, float(cfg.get("proxy_probe_timeout", 10) or 10)),
+            "url": cfg.get("proxy_probe_url") or "https://grok.com/",
+            "failures": max(1, int(cfg.get("proxy_probe_failures", 2) or 1)),
+        }
+
+    async def start_prober(self) -> None:
+        """启动后台探测任务（proxy_probe_interval 为0时不探测）"""
+        if self._probe_task is None:
+            self._probe_task = asyncio.create_task(self._probe_worker())
+            logger.info("[ProxyPool] 代理探测任务已创建")
+
+    async def stop_prober(self) -> None:
+        """停止后台探测任务"""
+        if self._probe_task:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    async def _probe_worker(self) -> None:
+        """周期探测全部代理：启动后立即探测一轮，之后按间隔重复"""
+        while True:
+            interval = self._probe_config()["interval"]
+            if interval <= 0:
+                await asyncio.sleep(30)  # 探测关闭，等待配置变更
+                continue
+            if self._proxies:
+                try:
+                    t0 = time.monotonic()
+                    results = [r async for r in self.probe_all()]
+                    ok = sum(1 for r in results if r["ok"])
+                    logger.info(
+                        f"[ProxyPool] 探测完成: 可用 {ok}/{len(results)}，健康 {len(self._healthy)}/{len(self._proxies)}，"
+                        f"耗时 {time.monotonic() - t0:.1f}s"
+                    )
+                except Exception as e:
+                    logger.error(f"[ProxyPool] 探测异常: {e}")
+            await asyncio.sleep(interval)
+
+    async def probe_all(self, urls: Optional[Iterable[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """并发探测代理（受 proxy_probe_concurrency 限制），按完成顺序逐个返回结果
+
+        Args:
+            urls: 待探测的代理，为空时探测全部已知代理
+        """
+        cfg = self._probe_config()
+        targets = list(dict.fromkeys(self._normalize_proxy(u) for u in (urls if urls is not None else list(self._proxies))))
+        if not targets:
             return
-        if self._suspend_persist:
+        sem = asyncio.Semaphore(cfg["concurrency"])
+        # 每轮新建会话，测得的握手耗时不受连接复用影响
+        session = AsyncSession(impersonate=DEFAULT_BROWSER, max_clients=cfg["concurrency"], curl_infos=PROBE_INFOS)
+
+        async def limited(url: str) -> Dict[str, Any]:
+            async with sem:
+                return await self.probe(url, session, cfg)
+
+        tasks = [asyncio.create_task(limited(url)) for url in targets]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await session.close()
+            self._probe_rounds += 1
+
+    async def probe(self, url: str, session: AsyncSession, cfg: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """探测单个代理：测量TCP连接、TLS握手与首字节耗时，并据此恢复或降级代理
+
+        任何非5xx响应视为代理可用（403为被CF拦截，代理本身可达）。
+        """
+        cfg = cfg or self._probe_config()
+        result: Dict[str, Any] = {"url": url, "ok": False, "status": 0, "checked_at": int(time.time() * 1000)}
+        t0 = time.monotonic()
+        try:
+            response = await session.get(
+                cfg["url"],
+                proxies={"http": url, "https": url},
+                timeout=cfg["timeout"],
+                allow_redirects=False,
+            )
+            infos = getattr(response, "infos", None) or {}
+            connect = infos.get(CurlInfo.CONNECT_TIME) or None
+            tls = infos.get(CurlInfo.APPCONNECT_TIME) or None
+            ttfb = infos.get(CurlInfo.STARTTRANSFER_TIME) or (time.monotonic() - t0)
+            result.update(
+                ok=response.status_code < 500,
+                status=response.status_code,
+                connect_ms=round(connect * 1000, 1) if connect else None,
+                tls_ms=round(tls * 1000, 1) if tls else None,
+                ttfb_ms=round(ttfb * 1000, 1),
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result["error"] = str(e)[:200]
+            ttfb = tls = None
+        result["elapsed_ms"] = round((time.monotonic() - t0) * 1000, 1)
+
+        if url in self._proxies:
+            previous = self._probe_results.get(url)
+            result["streak"] = 0 if result["ok"] else (previous or {}).get("streak", 0) + 1  # 连续探测失败次数
+            self._probe_results[url] = result
+            if result["ok"]:
+                latency = self._latency.get(url)
+                if latency is None:
+                    latency = self._latency[url] = ProxyLatency()
+                latency.observe(None, ttfb, tls)  # 探测只贡献延迟，不计入成功率
+                self._probe_success(url)
+            else:
+                self._probe_failure(url, result["streak"], cfg["failures"])
+            result["healthy"] = self._proxies[url].healthy
+        return result
+
+    def _probe_success(self, url: str) -> None:
+        """探测成功：清零失败计数，不健康的代理提前恢复"""
+        info = self._proxies[url]
+        if info.healthy and not info.fail_count:
             return
+        self._share_health(url, False)
+        info.fail_count = 0
+        if not info.healthy:
+            info.healthy = True
+            self._set_healthy(url, True)
+            self._rebalance_due = True
+            logger.info(f"[ProxyPool] 探测恢复健康: {url}")
+            self._mark_dirty()
+        else:
+            self._mark_dirty(counters=True)
+
+    def _probe_failure(self, url: str, streak: int, threshold: int) -> None:
+        """探测失败：连续 proxy_probe_failures 次失败即降级，不必等用户请求失败"""
+        info = self._proxies[url]
+        info.fail_count += 1
+        changed = False
+        if info.healthy and (streak >= threshold or info.fail_count >= MAX_FAIL_COUNT):
+            changed = self._demote(url, f"连续{streak}次探测失败")
+        self._mark_dirty(counters=not changed)
+        self._share_health(url, True, demote=not info.healthy)
+
+    def get_probe_stats(self) -> Dict[str, Any]:
+        """探测统计"""
+        cfg = self._probe_config()
+        results = list(self._probe_results.values())
+        return {
+            "enabled": cfg["interval"] > 0 and self._probe_task is not None,
+            "interval": cfg["interval"],
+            "rounds": self._probe_rounds,
+            "probed": len(results),
+            "ok": sum(1 for r in results if r["ok"]),
+        }
+
+    # === 跨节点健康共享 ===
+
+    @staticmethod
+    def _health_config() -> Dict[str, Any]:
+        cfg = setting.grok_config
+        return {
+            "shared": bool(cfg.get("proxy_health_shared", True)),
+            "ttl": max(10, int(cfg.get("proxy_health_ttl", 300) or 300)),
+            "resync": max(1.0, float(cfg.get("proxy_health_resync", 30) or 30)),
+        }
+
+    def _shared_health(self):
+        """共享健康状态存储（Redis存储且开启 proxy_health_shared 时，否则为None）"""
+        if self._health_store is None or not self._health_config()["shared"]:
+            return None
+        return self._health_store
+
+    def _spawn_health(self, coro) -> None:
+        """在后台执行Redis读写，不阻塞请求路径"""
         try:
-            loop = asyncio.get_running_loop()
+            task = asyncio.get_running_loop().create_task(coro)
         except RuntimeError:
+            coro.close()
             return
-        loop.create_task(self._persist_state())
-    
+        self._health_background.add(task)
+        task.add_done_callback(self._health_background.discard)
+
+    def _share_health(self, url: str, failed: bool, demote: bool = False) -> None:
+        """上报一次失败/成功到共享健康状态
+
+        Args:
+            url: 代理URL
+            failed: 是否失败（失败累加全集群计数，成功清零并恢复健康）
+            demote: 本节点已判定不健康，直接标记全集群不健康
+        """
+        store = self._shared_health()
+        if store is not None:
+            self._spawn_health(self._report_health(store, url, failed, demote))
+
+    async def _report_health(self, store: Any, url: str, failed: bool, demote: bool) -> None:
+        try:
+            healthy, fail = await store.report(url, failed, demote, self._health_config()["ttl"], MAX_FAIL_COUNT)
+        except Exception as e:
+            self._health_stats["errors"] += 1
+            logger.warning(f"[ProxyPool] 上报代理健康状态失败: {e}")
+            return
+        self._health_stats["published"] += 1
+        info = self._proxies.get(url)
+        if failed and healthy and info is not None and not info.healthy:
+            return  # 并发上报的结果可能晚于本地降级返回，失败上报的结果不用于恢复
+        # 全集群累计失败达到阈值时，本节点即使只失败过一次也同步降级
+        self._apply_health(url, healthy, fail, "集群")
+
+    def _apply_health(self, url: str, healthy: bool, fail: int, source: str) -> bool:
+        """应用共享健康状态（不再上报），返回健康状态或绑定是否有变化"""
+        info = self._proxies.get(url)
+        if info is None:
+            return False
+        counters = info.fail_count != fail
+        changed = False
+        if not healthy:
+            info.fail_count = max(info.fail_count, fail)
+            changed = self._demote(url, f"{source}标记不健康，累计失败{fail}次")
+        else:
+            info.fail_count = fail
+            if not info.healthy:
+                info.healthy = True
+                self._set_healthy(url, True)
+                self._rebalance_due = True
+                logger.info(f"[ProxyPool] 代理恢复健康: {url} ({source})")
+                changed = True
+        if changed:
+            self._health_stats["applied"] += 1
+            self._mark_dirty()
+        elif counters:
+            self._mark_dirty(counters=True)
+        return changed
+
+    async def _pull_health(self, urls: Iterable[str]) -> None:
+        """读取共享健康状态并应用到本地（没有记录或已过期的代理保持本地状态）"""
+        store = self._shared_health()
+        if store is None:
+            return
+        try:
+            states = await store.fetch(urls)
+        except Exception as e:
+            self._health_stats["errors"] += 1
+            logger.warning(f"[ProxyPool] 读取共享代理健康状态失败: {e}")
+            return
+        for url, (healthy, fail) in states.items():
+            self._apply_health(url, healthy, fail, "集群")
+
+    async def start_health_sync(self) -> None:
+        """启动跨节点健康同步（Redis存储且开启 proxy_health_shared 时）"""
+        if self._health_task is None and self._shared_health() is not None:
+            self._health_task = asyncio.create_task(self._health_worker())
+            logger.info(f"[ProxyPool] 跨节点健康同步已启动（节点 {self._health_store.node}）")
+
+    async def stop_health_sync(self) -> None:
+        """停止健康同步，等待进行中的上报完成"""
+        if self._health_task:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        if self._health_background:
+            await asyncio.wait(list(self._health_background), timeout=2)
+
+    async def _health_worker(self) -> None:
+        """订阅其他节点的上报并即时应用；订阅建立后先全量读取一次，之后按 proxy_health_resync 间隔校对"""
+        while True:
+            store = self._shared_health()
+            if store is None:
+                await asyncio.sleep(30)  # 共享关闭，等待配置变更
+                continue
+            try:
+                synced = float("-inf")
+                async for event in store.listen():
+                    if event is not None:
+                        self._health_stats["received"] += 1
+                        self._apply_health(*event, "其他节点")
+                    if time.monotonic() - synced >= self._health_config()["resync"]:
+                        await self._pull_health(list(self._proxies))
+                        self._health_stats["resyncs"] += 1
+                        synced = time.monotonic()
+                    if self._shared_health() is None:
+                        break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._health_stats["errors"] += 1
+                logger.warning(f"[ProxyPool] 健康同步订阅中断，1秒后重连: {e}")
+                await asyncio.sleep(1)
+
+    def get_health_sync_stats(self) -> Dict[str, Any]:
+        """跨节点健康同步统计"""
+        cfg = self._health_config()
+        store = self._shared_health()
+        return {
+            "enabled": store is not None and self._health_task is not None,
+            "node": store.node if store is not None else None,
+            "ttl": cfg["ttl"],
+            "resync": cfg["resync"],
+            **self._health_stats,
+            "pending": len(self._health_background),
+        }
+
     async def get_proxy(self) -> Optional[str]:
         """获取代理地址（兼容旧接口）
         
@@ -379,9 +1155,9 @@ class ProxyPool:
         if not self._enabled and not self._proxies:
             return self._static_proxy
         
-        # 如果有多代理，使用轮询
+        # 如果有多代理，按延迟与成功率选择
         if self._proxies:
-            return await self._select_proxy_round_robin()
+            return await self._select_proxy()
         
         # 检查是否需要刷新
         now = time.time()
@@ -389,10 +1165,24 @@ class ProxyPool:
             async with self._lock:
                 # 双重检查
                 if not self._current_proxy or (now - self._last_fetch_time) >= self._fetch_interval:
-                    await self._fetch_proxy()
+                    if not self._take_prefetched():
+                        await self._fetch_proxy()
         
         return self._current_proxy
     
+    async def get_request_proxy(self, sso: str = "", rotate: bool = False) -> Optional[str]:
+        """上游请求使用的代理
+
+        Args:
+            sso: SSO标识，有则使用绑定代理（失败的代理已被标记，重试时自动换绑）
+            rotate: 403重试时为True，无SSO且启用代理池时强制刷新代理
+        """
+        if sso:
+            return await self.get_proxy_for_sso(sso)
+        if rotate and self._enabled:
+            return await self.force_refresh()
+        return await self.get_proxy() or ""
+
     async def force_refresh(self) -> Optional[str]:
         """强制刷新代理（用于403错误重试）
         
@@ -402,55 +1192,227 @@ class ProxyPool:
         if not self._enabled:
             # 如果有多代理，尝试切换到下一个
             if len(self._proxies) > 1:
-                return await self._select_proxy_round_robin()
+                return await self._select_proxy()
             return self._static_proxy
-        
+
+        # 预取缓冲中有已验证的代理时直接换用，不等待代理池API
+        proxy = self._take_prefetched()
+        if proxy:
+            return proxy
+
         async with self._lock:
             await self._fetch_proxy()
         
         return self._current_proxy
     
     async def _fetch_proxy(self):
-        """从代理池URL获取新的代理"""
+        """从代理池URL获取新的代理（请求路径上的同步获取，多余的代理交给预取缓冲验证）"""
         try:
-            logger.debug(f"[ProxyPool] 正在从代理池获取新代理: {self._pool_url}")
-            
-            timeout = aiohttp.ClientTimeout(total=10)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(self._pool_url) as response:
-                    if response.status == 200:
-                        proxy_text = await response.text()
-                        proxy = self._normalize_proxy(proxy_text.strip())
-                        
-                        # 验证代理格式
-                        if self._validate_proxy(proxy):
-                            self._current_proxy = proxy
-                            self._last_fetch_time = time.time()
-                            # 添加到代理列表
-                            self.add_proxy(proxy)
-                            logger.info(f"[ProxyPool] 成功获取新代理: {proxy}")
-                        else:
-                            logger.error(f"[ProxyPool] 代理格式无效: {proxy}")
-                            # 降级到静态代理
-                            if not self._current_proxy:
-                                self._current_proxy = self._static_proxy
-                    else:
-                        logger.error(f"[ProxyPool] 获取代理失败: HTTP {response.status}")
-                        # 降级到静态代理
-                        if not self._current_proxy:
-                            self._current_proxy = self._static_proxy
-        
+            proxies = await self._fetch_batch()
         except asyncio.TimeoutError:
             logger.error("[ProxyPool] 获取代理超时")
-            if not self._current_proxy:
-                self._current_proxy = self._static_proxy
-        
+            proxies = []
         except Exception as e:
             logger.error(f"[ProxyPool] 获取代理异常: {e}")
+            proxies = []
+
+        if not proxies:
             # 降级到静态代理
             if not self._current_proxy:
                 self._current_proxy = self._static_proxy
-    
+            return
+
+        proxy = proxies[0]
+        self._current_proxy = proxy
+        self._last_fetch_time = time.time()
+        # 添加到代理列表
+        self.add_proxy(proxy)
+        self._prefetch_stats["misses"] += 1
+        logger.info(f"[ProxyPool] 成功获取新代理: {proxy}")
+        self._kick_refill(proxies[1:])
+
+    async def _fetch_batch(self) -> List[str]:
+        """请求一次代理池API，返回解析出的有效代理（可能为多个）"""
+        logger.debug(f"[ProxyPool] 正在从代理池获取新代理: {self._pool_url}")
+        timeout = aiohttp.ClientTimeout(total=10)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(self._pool_url) as response:
+                if response.status != 200:
+                    logger.error(f"[ProxyPool] 获取代理失败: HTTP {response.status}")
+                    return []
+                text = await response.text()
+        self._prefetch_stats["fetches"] += 1
+
+        proxies = []
+        for candidate in self._parse_pool_response(text):
+            proxy = self._normalize_proxy(candidate)
+            if "://" not in proxy:
+                proxy = f"http://{proxy}"  # 仅返回 host:port 时按HTTP代理处理
+            if self._validate_proxy(proxy):
+                proxies.append(proxy)
+            else:
+                logger.error(f"[ProxyPool] 代理格式无效: {proxy}")
+        proxies = list(dict.fromkeys(proxies))
+        self._prefetch_stats["fetched"] += len(proxies)
+        return proxies
+
+    @staticmethod
+    def _parse_pool_response(text: str) -> List[str]:
+        """解析代理池API响应：单个代理、多行/逗号分隔列表，或JSON列表
+
+        JSON支持字符串列表、对象列表（proxy/url 字段，或 ip/host + port），
+        以及把列表放在 data/proxies/list 等字段中的对象。
+        """
+        text = text.strip()
+        if not text:
+            return []
+        if text[0] not in "[{":
+            return [part for part in re.split(r"[\s,;]+", text) if part]
+        try:
+            data = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            return [part for part in re.split(r"[\s,;]+", text) if part]
+
+        while isinstance(data, dict):
+            nested = next((data[k] for k in POOL_LIST_KEYS if isinstance(data.get(k), (list, dict))), None)
+            if nested is None:
+                break
+            data = nested
+        items = data if isinstance(data, list) else [data]
+
+        proxies = []
+        for item in items:
+            if isinstance(item, str):
+                proxies.append(item.strip())
+            elif isinstance(item, dict):
+                url = item.get("proxy") or item.get("url")
+                host = item.get("ip") or item.get("host")
+                if not url and host and item.get("port"):
+                    scheme = item.get("protocol") or item.get("scheme")
+                    url = f"{scheme}://{host}:{item['port']}" if scheme else f"{host}:{item['port']}"
+                if url:
+                    proxies.append(str(url).strip())
+        return [p for p in proxies if p]
+
+    # === 代理池预取 ===
+
+    def _prefetch_config(self) -> Dict[str, Any]:
+        cfg = setting.grok_config
+        size = max(0, int(cfg.get("proxy_pool_buffer_size", 4) or 0))
+        return {
+            "size": size,
+            "low_water": min(size, max(0, int(cfg.get("proxy_pool_low_water", 2) or 0))),
+            "validate": bool(cfg.get("proxy_pool_validate", True)),
+            "max_age": max(1.0, float(self._fetch_interval or 300)),  # 预取代理在刷新间隔内有效
+        }
+
+    def _take_prefetched(self) -> Optional[str]:
+        """取出一个预取的代理并设为当前代理，缓冲低于低水位时在后台补充"""
+        if not self._enabled:
+            return None
+        cfg = self._prefetch_config()
+        now = time.time()
+        proxy = None
+        while self._buffer:
+            url, fetched = self._buffer.popleft()
+            if now - fetched >= cfg["max_age"]:
+                self._prefetch_stats["expired"] += 1
+                continue
+            proxy = url
+            break
+        if len(self._buffer) <= cfg["low_water"]:
+            self._kick_refill()
+        if not proxy:
+            return None
+
+        self._current_proxy = proxy
+        self._last_fetch_time = now
+        self.add_proxy(proxy)
+        self._prefetch_stats["hits"] += 1
+        logger.info(f"[ProxyPool] 使用预取代理: {proxy}")
+        return proxy
+
+    def _kick_refill(self, candidates: Iterable[str] = ()) -> None:
+        """后台补充预取缓冲（已有补充任务时只并入候选）"""
+        if not self._enabled or self._prefetch_config()["size"] <= 0:
+            return
+        self._candidates.extend(candidates)
+        if self._refill_task is not None and not self._refill_task.done():
+            return
+        try:
+            self._refill_task = asyncio.get_running_loop().create_task(self._refill())
+        except RuntimeError:
+            pass
+
+    async def _refill(self) -> None:
+        """验证候选代理（不足时请求代理池API），直到缓冲达到 proxy_pool_buffer_size
+
+        缓冲与验证中的代理合计不足时继续取候选，某个代理探测超时不会拖住其他代理入缓冲；
+        每轮最多请求代理池 buffer_size 次，避免代理池持续返回重复或不可用代理时反复请求。
+        """
+        cfg = self._prefetch_config()
+        session = None
+        fetches = 0
+        pending: Set[asyncio.Task] = set()
+        try:
+            while True:
+                room = cfg["size"] - len(self._buffer) - len(pending)
+                if room > 0 and (self._candidates or fetches < cfg["size"]):
+                    if not self._candidates:
+                        fetches += 1
+                        self._candidates = await self._fetch_batch()
+                        if not self._candidates:
+                            fetches = cfg["size"]  # 代理池无可用返回，本轮不再请求
+                    known = {url for url, _ in self._buffer}
+                    fresh = [url for url in dict.fromkeys(self._candidates) if url not in self._proxies and url not in known]
+                    batch, self._candidates = fresh[:room], fresh[room:]
+                    if not cfg["validate"]:
+                        now = time.time()
+                        self._buffer.extend((url, now) for url in batch)
+                        continue
+                    if batch and session is None:
+                        session = AsyncSession(impersonate=DEFAULT_BROWSER, curl_infos=PROBE_INFOS)
+                    pending.update(asyncio.create_task(self.probe(url, session)) for url in batch)
+                    continue
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result["ok"]:
+                        self._buffer.append((result["url"], time.time()))
+                    else:
+                        self._prefetch_stats["rejected"] += 1
+            logger.debug(f"[ProxyPool] 预取缓冲: {len(self._buffer)}/{cfg['size']}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[ProxyPool] 预取代理异常: {e}")
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if session is not None:
+                await session.close()
+
+    async def start_prefetch(self) -> None:
+        """启动时预先填充代理池缓冲（未启用代理池或 proxy_pool_buffer_size 为0时不预取）"""
+        self._kick_refill()
+
+    def get_prefetch_stats(self) -> Dict[str, Any]:
+        """预取缓冲状态与命中统计"""
+        cfg = self._prefetch_config()
+        now = time.time()
+        return {
+            "enabled": self._enabled and cfg["size"] > 0,
+            "size": cfg["size"],
+            "low_water": cfg["low_water"],
+            "buffered": len(self._buffer),
+            "oldest_age": round(now - self._buffer[0][1], 1) if self._buffer else None,
+            "refilling": self._refill_task is not None and not self._refill_task.done(),
+            **self._prefetch_stats,
+        }
+
     def _validate_proxy(self, proxy: str) -> bool:
         """验证代理格式
         
@@ -0,0 +1,96 @@
+"""Redis代理健康共享 - 多节点/多worker共享代理失败计数与不健康标记
+
+键（前缀 grok:）:
+    proxy:health:{url哈希}   哈希，url / healthy（"1"/"0"）/ fail（全集群连续失败次数）/ updated（秒）；
+                             每次上报刷新TTL（proxy_health_ttl），长期无人上报的代理状态自动过期
+    proxy:health             Pub/Sub频道，每次上报后广播 {"u": url, "h": "0"/"1", "f": 失败次数, "n": 节点}
+
+上报为Lua原子操作：失败累加计数，达到阈值或上报方已判定降级时标记不健康；成功清零并恢复健康。
+各节点以本地 ProxyPool 状态作读缓存，订阅频道即时应用其他节点的变化，并按间隔读取本节点代理的共享状态校对（Pub/Sub 不保证送达）。
+"""
+
+import hashlib
+import uuid
+import orjson
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+
+from app.core.redis_tokens import PREFIX
+
+
+KEY_PREFIX = PREFIX + "proxy:health:"
+CHANNEL = PREFIX + "proxy:health"
+
+_REPORT = """
+local key, url, failed, demote = KEYS[1], ARGV[1], ARGV[2] == '1', ARGV[3] == '1'
+local ttl, threshold, node, channel = tonumber(ARGV[4]), tonumber(ARGV[5]), ARGV[6], ARGV[7]
+local healthy = redis.call('HGET', key, 'healthy') or '1'
+local fail = 0
+if failed then
+  fail = redis.call('HINCRBY', key, 'fail', 1)
+  if demote or fail >= threshold then healthy = '0' end
+else
+  healthy = '1'
+end
+redis.call('HSET', key, 'url', url, 'healthy', healthy, 'fail', fail, 'updated', redis.call('TIME')[1])
+redis.call('EXPIRE', key, ttl)
+redis.call('PUBLISH', channel, cjson.encode({u = url, h = healthy, f = fail, n = node}))
+return {healthy, fail}
+"""
+
+Health = Tuple[bool, int]  # (是否健康, 全集群连续失败次数)
+
+
+def _key(url: str) -> str:
+    return KEY_PREFIX + hashlib.blake2b(url.encode(), digest_size=12).hexdigest()
+
+
+class RedisProxyHealth:
+    """Redis代理健康上报、读取与订阅"""
+
+    def __init__(self, redis):
+        self._redis = redis
+        self.node = uuid.uuid4().hex[:12]  # 本进程标识，订阅时跳过自己的广播
+        self._report = redis.register_script(_REPORT)
+
+    async def report(self, url: str, failed: bool, demote: bool, ttl: int, threshold: int) -> Health:
+        """原子上报一次结果并广播，返回上报后的全集群状态"""
+        healthy, fail = await self._report(
+            keys=[_key(url)],
+            args=[url, int(failed), int(demote), ttl, threshold, self.node, CHANNEL],
+        )
+        return healthy == "1", int(fail)
+
+    async def fetch(self, urls: Iterable[str]) -> Dict[str, Health]:
+        """读取指定代理的共享状态（没有记录的代理不返回）"""
+        urls = list(urls)
+        pipe = self._redis.pipeline(transaction=False)
+        for url in urls:
+            pipe.hmget(_key(url), "healthy", "fail")
+        result = {}
+        for url, (healthy, fail) in zip(urls, await pipe.execute()):
+            if healthy is not None:
+                result[url] = (healthy == "1", int(fail or 0))
+        return result
+
+    async def listen(self, timeout: float = 1.0) -> AsyncIterator[Optional[Tuple[str, bool, int]]]:
+        """订阅其他节点的上报；每 timeout 秒无消息时返回None，便于调用方穿插定时任务"""
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(CHANNEL)
+        try:
+            while True:
+                message = await pubsub.get_message(timeout=timeout)
+                if message is None:
+                    yield None
+                    continue
+                try:
+                    data = orjson.loads(message["data"])
+                except (orjson.JSONDecodeError, TypeError):
+                    continue
+                if data.get("n") == self.node or not data.get("u"):
+                    continue
+                yield data["u"], data.get("h") == "1", int(data.get("f") or 0)
+        finally:
+            try:
+                await pubsub.unsubscribe(CHANNEL)
+            finally:
+                await pubsub.aclose()
@@ -0,0 +1,486 @@
+"""Redis Token后端 - 每个Token一个哈希，按模型类别维护有序集合，选择/租约/扣减/失败均为Lua原子操作
+
+键（前缀 grok:）:
+    token:{sso}            哈希，业务字段为JSON编码值；_type 为Token类型，_inFlight 为全局在途数
+    tokens:{type}          集合，该类型全部SSO
+    idx:{type}:{field}     有序集合，可选Token，分数越小越优先（在途数优先，其次未使用、剩余多）
+    sat:{type}:{field}     集合，可用但已达并发上限的Token
+    cooldown               有序集合，冷却中的Token，分数为到期毫秒时间戳
+    leases / lease:owner   租约到期时间 / 租约所属Token，节点崩溃后租约按TTL过期自动归还
+    tokens:changes         Stream，Token变更通知（各节点据此增量同步本地镜像）
+    tokens:archive         哈希，冷归档Token（sso -> 归档条目JSON），不参与调度与同步
+
+时间统一取 Redis 服务器 TIME，避免节点间时钟偏差。仅支持单实例/主从（脚本访问动态键，不支持Cluster）。
+"""
+
+import uuid
+import orjson
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core.logger import logger
+
+
+PREFIX = "grok:"
+SCHEMA_KEY = PREFIX + "tokens:schema"
+CHANGES_KEY = PREFIX + "tokens:changes"
+ARCHIVE_KEY = PREFIX + "tokens:archive"
+CHANGES_MAXLEN = 10000
+TOKEN_TYPES = ("ssoNormal", "ssoSuper")
+LOAD_BATCH = 1000
+
+# 公共Lua函数：重建单个Token的索引、清理到期冷却/租约
+_PRELUDE = """
+local P = '""" + PREFIX + """'
+local INDEXES = {{'ssoNormal', 'remainingQueries'}, {'ssoSuper', 'remainingQueries'}, {'ssoSuper', 'heavyremainingQueries'}}
+
+local function num(v, d)
+  local n = tonumber(v)
+  if n == nil then return d end
+  return n
+end
+
+local function now_ms()
+  local t = redis.call('TIME')
+  return tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+end
+
+local function changed(sso)
+  redis.call('XADD', P .. 'tokens:changes', 'MAXLEN', '~', """ + str(CHANGES_MAXLEN) + """, '*', 'k', sso)
+end
+
+local function reindex(sso, now, cap, maxf)
+  local f = redis.call('HMGET', P .. 'token:' .. sso, '_type', 'status', 'failedCount', 'cooldownUntil',
+    '_inFlight', 'remainingQueries', 'heavyremainingQueries')
+  local ttype = f[1]
+  local until_ms = num(f[4], 0)
+  local cooling = ttype and until_ms > now
+  if cooling then
+    redis.call('ZADD', P .. 'cooldown', until_ms, sso)
+  else
+    redis.call('ZREM', P .. 'cooldown', sso)
+  end
+  local usable = ttype and not cooling and f[2] ~= '"expired"' and num(f[3], 0) < maxf
+  local load = num(f[5], 0)
+  local saturated = cap > 0 and load >= cap
+  for i, ix in ipairs(INDEXES) do
+    local zkey = P .. 'idx:' .. ix[1] .. ':' .. ix[2]
+    local skey = P .. 'sat:' .. ix[1] .. ':' .. ix[2]
+    local remaining = nil
+    if usable and ttype == ix[1] then
+      if i == 3 then remaining = num(f[7], -1) else remaining = num(f[6], -1) end
+      if remaining == 0 then remaining = nil end
+    end
+    if remaining ~= nil and not saturated then
+      local score = load * 10000000
+      if remaining > 0 then score = score + 1000000 - math.min(remaining, 999999) end
+      redis.call('ZADD', zkey, score, sso)
+      redis.call('SREM', skey, sso)
+    else
+      redis.call('ZREM', zkey, sso)
+      if remaining ~= nil then redis.call('SADD', skey, sso) else redis.call('SREM', skey, sso) end
+    end
+  end
+end
+
+local function release_lease(lease, now, cap, maxf)
+  local sso = redis.call('HGET', P .. 'lease:owner', lease)
+  local removed = redis.call('ZREM', P .. 'leases', lease)
+  redis.call('HDEL', P .. 'lease:owner', lease)
+  if not sso or removed == 0 then return nil end
+  local key = P .. 'token:' .. sso
+  if redis.call('EXISTS', key) == 0 then return nil end
+  if redis.call('HINCRBY', key, '_inFlight', -1) < 0 then
+    redis.call('HSET', key, '_inFlight', 0)
+  end
+  reindex(sso, now, cap, maxf)
+  return sso
+end
+
+local function sweep(now, cap, maxf)
+  -- 到期冷却：放回索引（连续5xx的失败计数一并清零），节点崩溃时也能恢复
+  for _, sso in ipairs(redis.call('ZRANGEBYSCORE', P .. 'cooldown', '-inf', now, 'LIMIT', 0, 64)) do
+    local key = P .. 'token:' .. sso
+    if redis.call('HGET', key, 'cooldownReason') == '"server_error"' then
+      redis.call('HSET', key, 'failedCount', 0)
+    end
+    redis.call('HSET', key, 'cooldownUntil', 'null', 'cooldownReason', 'null')
+    reindex(sso, now, cap, maxf)
+    changed(sso)
+  end
+  -- 过期租约：持有节点已崩溃或超时
+  for _, lease in ipairs(redis.call('ZRANGEBYSCORE', P .. 'leases', '-inf', now, 'LIMIT', 0, 64)) do
+    release_lease(lease, now, cap, maxf)
+  end
+end
+"""
+
+# ARGV: cap, maxf, ttl_ms, lease_id, seed, 索引键...
+_ACQUIRE = _PRELUDE + """
+local cap, maxf, ttl, lease, seed = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), ARGV[4], tonumber(ARGV[5])
+local now = now_ms()
+sweep(now, cap, maxf)
+-- 并发上限变化后，饱和集合中的Token按新上限重建（调小时索引中超限的Token在下方选择时移出）
+local prev = redis.call('GETSET', P .. 'tokens:cap', cap)
+if prev and tonumber(prev) ~= cap then
+  for _, ix in ipairs(INDEXES) do
+    for _, sso in ipairs(redis.call('SMEMBERS', P .. 'sat:' .. ix[1] .. ':' .. ix[2])) do reindex(sso, now, cap, maxf) end
+  end
+end
+local saturated = 0
+for i = 6, #ARGV do
+  local zkey = P .. 'idx:' .. ARGV[i]
+  local skey = P .. 'sat:' .. ARGV[i]
+  for _ = 1, 16 do
+    local top = redis.call('ZRANGE', zkey, 0, 0, 'WITHSCORES')
+    if #top == 0 then break end
+    -- 并发上限调小后，索引中负载已超限的Token移入饱和集合后重选
+    if cap > 0 and math.floor(tonumber(top[2]) / 10000000) >= cap then
+      reindex(top[1], now, cap, maxf)
+    else
+      local ties = redis.call('ZRANGEBYSCORE', zkey, top[2], top[2], 'LIMIT', 0, 16)
+      local sso = ties[(seed % #ties) + 1]
+      local key = P .. 'token:' .. sso
+      redis.call('HINCRBY', key, '_inFlight', 1)
+      redis.call('ZADD', P .. 'leases', now + ttl, lease)
+      redis.call('HSET', P .. 'lease:owner', lease, sso)
+      reindex(sso, now, cap, maxf)
+      return {sso, redis.call('HGETALL', key)}
+    end
+  end
+  saturated = saturated + redis.call('SCARD', skey)
+end
+return {false, saturated}
+"""
+
+# ARGV: lease_id, cap, maxf
+_RELEASE = _PRELUDE + """
+local sso = release_lease(ARGV[1], now_ms(), tonumber(ARGV[2]), tonumber(ARGV[3]))
+if not sso then return false end
+return {sso, redis.call('HGETALL', P .. 'token:' .. sso)}
+"""
+
+# ARGV: sso, field, cost, cap, maxf
+_CONSUME = _PRELUDE + """
+local sso = ARGV[1]
+local key = P .. 'token:' .. sso
+if redis.call('EXISTS', key) == 0 then return false end
+local remaining = num(redis.call('HGET', key, ARGV[2]), -1)
+if remaining > 0 then
+  remaining = math.max(0, remaining - tonumber(ARGV[3]))
+  redis.call('HSET', key, ARGV[2], remaining)
+  reindex(sso, now_ms(), tonumber(ARGV[4]), tonumber(ARGV[5]))
+  changed(sso)
+end
+return redis.call('HGETALL', key)
+"""
+
+# ARGV: sso, status, reason(JSON), cap, maxf, cooldown_429, cooldown_429_max, cooldown_5xx（秒）
+_FAIL = _PRELUDE + """
+local sso = ARGV[1]
+local key = P .. 'token:' .. sso
+if redis.call('EXISTS', key) == 0 then return false end
+local status, cap, maxf = tonumber(ARGV[2]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local now = now_ms()
+redis.call('HSET', key, 'lastFailureTime', now, 'lastFailureReason', ARGV[3])
+if status == 429 then
+  local count = num(redis.call('HGET', key, 'cooldownCount'), 0) + 1
+  local seconds = math.min(tonumber(ARGV[7]), tonumber(ARGV[6]) * 2 ^ (count - 1))
+  redis.call('HSET', key, 'cooldownCount', count, 'cooldownUntil', math.floor(now + seconds * 1000),
+    'cooldownReason', '"rate_limit"')
+else
+  local failed = num(redis.call('HGET', key, 'failedCount'), 0) + 1
+  redis.call('HSET', key, 'failedCount', failed)
+  if status >= 400 and status < 500 and failed >= maxf then
+    redis.call('HSET', key, 'status', '"expired"')
+  end
+  if status >= 500 and failed >= maxf then
+    redis.call('HSET', key, 'cooldownUntil', math.floor(now + tonumber(ARGV[8]) * 1000),
+      'cooldownReason', '"server_error"')
+  end
+end
+reindex(sso, now, cap, maxf)
+changed(sso)
+return redis.call('HGETALL', key)
+"""
+
+# ARGV: sso, type, replace(0/1), cap, maxf, 字段, 值, ...
+_PATCH = _PRELUDE + """
+local sso, ttype = ARGV[1], ARGV[2]
+local key = P .. 'token:' .. sso
+local old = redis.call('HGET', key, '_type')
+if ARGV[3] == '1' or (old and old ~= ttype) then
+  local in_flight = redis.call('HGET', key, '_inFlight')
+  redis.call('DEL', key)
+  if in_flight then redis.call('HSET', key, '_inFlight', in_flight) end
+end
+if old and old ~= ttype then redis.call('SREM', P .. 'tokens:' .. old, sso) end
+redis.call('HSET', key, '_type', ttype)
+redis.call('SADD', P .. 'tokens:' .. ttype, sso)
+for i = 6, #ARGV, 2 do
+  redis.call('HSET', key, ARGV[i], ARGV[i + 1])
+end
+reindex(sso, now_ms(), tonumber(ARGV[4]), tonumber(ARGV[5]))
+changed(sso)
+return 1
+"""
+
+# ARGV: sso
+_DELETE = _PRELUDE + """
+local sso = ARGV[1]
+redis.call('DEL', P .. 'token:' .. sso)
+for _, ttype in ipairs({'ssoNormal', 'ssoSuper'}) do
+  redis.call('SREM', P .. 'tokens:' .. ttype, sso)
+end
+for _, ix in ipairs(INDEXES) do
+  redis.call('ZREM', P .. 'idx:' .. ix[1] .. ':' .. ix[2], sso)
+  redis.call('SREM', P .. 'sat:' .. ix[1] .. ':' .. ix[2], sso)
+end
+redis.call('ZREM', P .. 'cooldown', sso)
+changed(sso)
+return 1
+"""
+
+
+def _decode(flat: List[Any]) -> Tuple[Optional[str], Dict[str, Any], int]:
+    """HGETALL结果 -> (类型, 业务字段, 全局在途数)"""
+    if not flat:
+        return None, {}, 0
+    pairs = dict(zip(flat[::2], flat[1::2])) if isinstance(flat, list) else dict(flat)
+    token_type = pairs.pop("_type", None)
+    in_flight = int(pairs.pop("_inFlight", 0) or 0)
+    record = {}
+    for key, raw in pairs.items():
+        try:
+            record[key] = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            record[key] = raw
+    return token_type, record, in_flight
+
+
+def _encode_fields(record: Dict[str, Any], fields: Optional[Iterable[str]] = None) -> List[str]:
+    args: List[str] = []
+    for key in (record.keys() if fields is None else fields):
+        if key.startswith("_") or key not in record:
+            continue
+        args.append(key)
+        args.append(orjson.dumps(record[key]).decode())
+    return args
+
+
+def _stream_id(value: str) -> Tuple[int, int]:
+    ms, _, seq = value.partition("-")
+    return int(ms), int(seq or 0)
+
+
+class RedisTokenStore:
+    """Redis原生Token存储与调度"""
+
+    def __init__(self, redis):
+        self._redis = redis
+        self.max_in_flight = 0  # 单Token并发上限（0为不限），由Token管理器按配置更新
+        self.max_failures = 3  # 失败计数上限，达到后不参与选择
+        self._acquire = redis.register_script(_ACQUIRE)
+        self._release = redis.register_script(_RELEASE)
+        self._consume = redis.register_script(_CONSUME)
+        self._fail = redis.register_script(_FAIL)
+        self._patch = redis.register_script(_PATCH)
+        self._delete = redis.register_script(_DELETE)
+
+    # === 初始化与全量读写 ===
+
+    async def initialized(self) -> bool:
+        return bool(await self._redis.exists(SCHEMA_KEY))
+
+    async def load_all(self) -> Dict[str, Any]:
+        """读取全部Token（按类型分组）"""
+        data: Dict[str, Any] = {token_type: {} for token_type in TOKEN_TYPES}
+        for token_type in TOKEN_TYPES:
+            ssos = list(await self._redis.smembers(PREFIX + "tokens:" + token_type))
+            for start in range(0, len(ssos), LOAD_BATCH):
+                batch = ssos[start:start + LOAD_BATCH]
+                pipe = self._redis.pipeline(transaction=False)
+                for sso in batch:
+                    pipe.hgetall(PREFIX + "token:" + sso)
+                for sso, flat in zip(batch, await pipe.execute()):
+                    real_type, record, _ = _decode(flat)
+                    if real_type:
+                        data[real_type][sso] = record
+        return data
+
+    async def replace_all(self, data: Dict[str, Any]) -> int:
+        """以给定数据覆盖Redis中的全部Token（迁移/全量保存）"""
+        existing: Set[str] = set()
+        for token_type in TOKEN_TYPES:
+            existing |= set(await self._redis.smembers(PREFIX + "tokens:" + token_type))
+
+        changes = {}
+        for token_type in TOKEN_TYPES:
+            for sso, record in (data.get(token_type) or {}).items():
+                changes[sso] = (token_type, record)
+        for sso in existing - set(changes):
+            changes[sso] = (None, None)
+
+        await self.apply_changes(changes)
+        await self._redis.set(SCHEMA_KEY, "1")
+        return len(changes)
+
+    async def apply_changes(
+        self,
+        changes: Dict[str, Tuple[Optional[str], Optional[Dict[str, Any]]]],
+        fields: Optional[Dict[str, Optional[Set[str]]]] = None,
+    ) -> None:
+        """写入变更的Token
+
+        Args:
+            changes: sso -> (类型, 数据)，数据为None表示删除
+            fields: sso -> 本地修改过的字段；None或缺省表示整条覆盖
+        """
+        items = list(changes.items())
+        for start in range(0, len(items), LOAD_BATCH):
+            pipe = self._redis.pipeline(transaction=False)
+            for sso, (token_type, record) in items[start:start + LOAD_BATCH]:
+                if token_type is None or record is None:
+                    await self._delete(args=[sso], client=pipe)
+                    continue
+                changed = None if fields is None else fields.get(sso)
+                if changed is not None and not changed:
+                    continue
+                await self._patch(
+                    args=[sso, token_type, "1" if changed is None else "0", self.max_in_flight, self.max_failures,
+                          *_encode_fields(record, changed)],
+                    client=pipe,
+                )
+            await pipe.execute()
+
+    # === 调度 ===
+
+    async def acquire(self, index_keys: Iterable[Tuple[str, str]], ttl: float) -> Tuple[Optional[Tuple[str, str, Dict[str, Any], int, str]], int]:
+        """原子选择并租用Token
+
+        Returns:
+            ((类型, sso, 数据, 全局在途数, 租约ID) 或 None, 因并发上限不可选的Token数)
+        """
+        lease = uuid.uuid4().hex
+        result = await self._acquire(
+            args=[self.max_in_flight, self.max_failures, int(ttl * 1000), lease, uuid.uuid4().int % 1000003,
+                  *(f"{t}:{f}" for t, f in index_keys)],
+        )
+        sso, payload = result[0], result[1]
+        if not sso:
+            return None, int(payload or 0)
+        token_type, record, in_flight = _decode(payload)
+        return (token_type, sso, record, in_flight, lease), 0
+
+    async def release(self, lease: str) -> Optional[Tuple[str, str, Dict[str, Any], int]]:
+        """归还租约（重复归还无副作用）"""
+        result = await self._release(args=[lease, self.max_in_flight, self.max_failures])
+        if not result:
+            return None
+        token_type, record, in_flight = _decode(result[1])
+        return token_type, result[0], record, in_flight
+
+    async def consume(self, sso: str, field: str, cost: int) -> Optional[Tuple[str, Dict[str, Any], int]]:
+        """原子扣减剩余次数（未知配额-1不变）"""
+        result = await self._consume(args=[sso, field, cost, self.max_in_flight, self.max_failures])
+        return _decode(result) if result else None
+
+    async def fail(
+        self, sso: str, status: int, reason: str,
+        cooldown_429: float, cooldown_429_max: float, cooldown_5xx: float,
+    ) -> Optional[Tuple[str, Dict[str, Any], int]]:
+        """原子记录失败（429退避冷却 / 4xx计数失效 / 5xx计数冷却）"""
+        result = await self._fail(
+            args=[sso, status, orjson.dumps(reason).decode(), self.max_in_flight, self.max_failures,
+                  cooldown_429, cooldown_429_max, cooldown_5xx],
+        )
+        return _decode(result) if result else None
+
+    # === 变更通知 ===
+
+    async def change_cursor(self) -> str:
+        """当前变更流末尾位置"""
+        last = await self._redis.xrevrange(CHANGES_KEY, count=1)
+        return last[0][0] if last else "0-0"
+
+    async def read_changes(self, cursor: str) -> Tuple[str, Optional[Set[str]]]:
+        """读取游标之后的变更Token
+
+        Returns:
+            (新游标, 变更的SSO集合)；游标已被裁剪时集合为None，需全量重新加载
+        """
+        first = await self._redis.xrange(CHANGES_KEY, count=1)
+        if first and cursor != "0-0" and _stream_id(cursor) < _stream_id(first[0][0]):
+            return await self.change_cursor(), None
+
+        ssos: Set[str] = set()
+        while True:
+            batch = await self._redis.xread({CHANGES_KEY: cursor}, count=LOAD_BATCH)
+            if not batch:
+                break
+            entries = batch[0][1]
+            for entry_id, values in entries:
+                cursor = entry_id
+                if values.get("k"):
+                    ssos.add(values["k"])
+            if len(entries) < LOAD_BATCH:
+                break
+        return cursor, ssos
+
+    async def fetch(self, ssos: Iterable[str]) -> Dict[str, Tuple[Optional[str], Dict[str, Any], int]]:
+        """批量读取Token（不存在的类型为None）"""
+        ssos = list(ssos)
+        result = {}
+        for start in range(0, len(ssos), LOAD_BATCH):
+            batch = ssos[start:start + LOAD_BATCH]
+            pipe = self._redis.pipeline(transaction=False)
+            for sso in batch:
+                pipe.hgetall(PREFIX + "token:" + sso)
+            for sso, flat in zip(batch, await pipe.execute()):
+                result[sso] = _decode(flat)
+        return result
+
+    # === 冷归档 ===
+
+    async def load_archive(self, ssos: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """读取归档条目（ssos为None时读取全部）"""
+        if ssos is None:
+            flat = await self._redis.hgetall(ARCHIVE_KEY)
+            return {sso: orjson.loads(value) for sso, value in flat.items()}
+        ssos = list(ssos)
+        result = {}
+        for start in range(0, len(ssos), LOAD_BATCH):
+            batch = ssos[start:start + LOAD_BATCH]
+            for sso, value in zip(batch, await self._redis.hmget(ARCHIVE_KEY, batch)):
+                if value is not None:
+                    result[sso] = orjson.loads(value)
+        return result
+
+    async def save_archive(self, changes: Dict[str, Optional[Dict[str, Any]]]) -> None:
+        """写入归档变更（条目为None表示移出归档）"""
+        items = list(changes.items())
+        for start in range(0, len(items), LOAD_BATCH):
+            batch = items[start:start + LOAD_BATCH]
+            mapping = {sso: orjson.dumps(entry).decode() for sso, entry in batch if entry is not None}
+            deleted = [sso for sso, entry in batch if entry is None]
+            pipe = self._redis.pipeline(transaction=False)
+            if mapping:
+                pipe.hset(ARCHIVE_KEY, mapping=mapping)
+            if deleted:
+                pipe.hdel(ARCHIVE_KEY, *deleted)
+            await pipe.execute()
+
+    async def stats(self) -> Dict[str, Any]:
+        pipe = self._redis.pipeline(transaction=False)
+        for token_type in TOKEN_TYPES:
+            pipe.scard(PREFIX + "tokens:" + token_type)
+        pipe.zcard(PREFIX + "leases")
+        pipe.zcard(PREFIX + "cooldown")
+        pipe.hlen(ARCHIVE_KEY)
+        normal, super_, leases, cooling, archived = await pipe.execute()
+        return {"normal": normal, "super": super_, "leases": leases, "cooling": cooling, "archived": archived}
+
+
+async def migrate_tokens(store: RedisTokenStore, data: Dict[str, Any]) -> None:
+    """旧版单键JSON / 本地文件 -> 每Token哈希"""
+    count = await store.replace_all(data)
+    logger.info(f"[Storage] Token已迁移为Redis哈希存储: {count} 个")
@@ -0,0 +1,237 @@
+"""统一重试引擎 - 按错误类别退避重试，进程内共享重试预算
+
+所有上游调用（对话、上传、创建会话、缓存下载、rate-limits）通过 `retry_engine.run()` 执行：
+    - 每类错误（403换代理 / TLS握手 / 可重试状态码 / 网络 / 换Token）有独立的次数上限与指数退避（带抖动）；
+    - 退避会越过截止时间（默认取当前请求的截止时间，见 app/core/deadline.py）时不再重试；
+    - 令牌桶预算：每个外层调用存入 `retry_budget_ratio` 个令牌，每次重试取出 1 个，
+      故障期间重试总量不超过流量的固定比例，避免单个请求放大成几十次上游调用。
+
+嵌套调用（如对话请求内的上传）共享外层调用的那一份预算存入。
+"""
+
+import asyncio
+import random
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from app.core.config import setting
+from app.core.deadline import request_deadline
+from app.core.logger import logger
+
+
+T = TypeVar("T")
+
+# 错误类别
+FORBIDDEN = "forbidden"  # 403（代理被拦截，换代理重试）
+TLS = "tls"  # TLS/握手瞬断
+STATUS = "status"  # 可配置状态码（retry_status_codes，如401/429）
+NETWORK = "network"  # 其他网络异常
+TOKEN = "token"  # Token级错误，换Token重试
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """单类错误的重试策略"""
+    max_retries: int  # 最多重试次数
+    base_delay: float  # 首次退避（秒），之后按2倍增长
+    max_delay: float  # 退避上限（秒）
+
+    def backoff(self, retry: int) -> float:
+        """第 retry 次重试（从1开始）前的等待：指数退避，取上限的一半到全部之间的随机值"""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (retry - 1)))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+POLICIES: Dict[str, RetryPolicy] = {
+    FORBIDDEN: RetryPolicy(max_retries=5, base_delay=0.25, max_delay=2.0),
+    TLS: RetryPolicy(max_retries=2, base_delay=0.4, max_delay=2.0),
+    STATUS: RetryPolicy(max_retries=3, base_delay=0.1, max_delay=1.0),
+    NETWORK: RetryPolicy(max_retries=2, base_delay=0.5, max_delay=2.0),
+    TOKEN: RetryPolicy(max_retries=2, base_delay=0.1, max_delay=1.0),
+}
+
+
+class Retryable(Exception):
+    """可重试的失败：attempt 抛出后由引擎决定是否重试
+
+    放弃重试时引擎抛出 `error`（未给出时抛出本异常，调用方可从 `response` 取最后一次响应）。
+    """
+
+    def __init__(self, kind: str, message: str = "", response: Any = None, error: Optional[BaseException] = None):
+        self.kind = kind
+        self.response = response
+        self.error = error
+        super().__init__(message or kind)
+
+
+@dataclass
+class RetryState:
+    """单次 run() 的重试进度，传给每次 attempt"""
+    attempt: int = 0  # 当前尝试序号（从0开始）
+    retries: Dict[str, int] = field(default_factory=dict)  # 各类别已重试次数
+
+    def count(self, kind: str) -> int:
+        return self.retries.get(kind, 0)
+
+
+@dataclass
+class CallerStats:
+    """单个调用方的重试统计"""
+    calls: int = 0
+    attempts: int = 0
+    retries: Dict[str, int] = field(default_factory=dict)  # 各类别已执行的重试
+    recovered: int = 0  # 重试后成功
+    exhausted: int = 0  # 达到类别上限放弃
+    denied_budget: int = 0  # 预算不足放弃
+    denied_deadline: int = 0  # 截止时间不足放弃
+
+    def to_dict(self) -> Dict[str, Any]:
+        spent = sum(self.retries.values())
+        return {
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "retries": spent,
+            "retries_by_kind": dict(self.retries),
+            "retry_ratio": round(spent / self.calls, 4) if self.calls else 0.0,
+            "recovered": self.recovered,
+            "exhausted": self.exhausted,
+            "denied_budget": self.denied_budget,
+            "denied_deadline": self.denied_deadline,
+        }
+
+
+# 当前任务是否已在某个 run() 内（嵌套调用不重复存入预算）
+_active: ContextVar[bool] = ContextVar("retry_active", default=False)
+
+
+class RetryEngine:
+    """重试执行与全局预算"""
+
+    def __init__(self):
+        self._tokens: Optional[float] = None  # 预算令牌，首次使用时填满
+        self._stats: Dict[str, CallerStats] = {}
+
+    # === 预算 ===
+
+    @staticmethod
+    def _budget_config() -> tuple:
+        cfg = setting.global_config
+        ratio = float(cfg.get("retry_budget_ratio", 0.2) or 0)
+        burst = max(1.0, float(cfg.get("retry_budget_burst", 20) or 1))
+        return ratio, burst
+
+    def _deposit(self) -> None:
+        ratio, burst = self._budget_config()
+        tokens = burst if self._tokens is None else self._tokens
+        self._tokens = min(burst, tokens + ratio)
+
+    def _withdraw(self) -> bool:
+        ratio, burst = self._budget_config()
+        if ratio <= 0:
+            return True  # 0 为不限制
+        tokens = burst if self._tokens is None else self._tokens
+        if tokens < 1:
+            self._tokens = tokens
+            return False
+        self._tokens = tokens - 1
+        return True
+
+    @staticmethod
+    def policy(kind: str) -> RetryPolicy:
+        if kind == TLS:
+            # TLS重试次数沿用 max_tls_retries 配置
+            base = POLICIES[TLS]
+            return RetryPolicy(int(setting.grok_config.get("max_tls_retries", base.max_retries)), base.base_delay, base.max_delay)
+        return POLICIES.get(kind, POLICIES[NETWORK])
+
+    # === 执行 ===
+
+    async def run(
+        self,
+        caller: str,
+        attempt: Callable[[RetryState], Awaitable[T]],
+        deadline: Optional[float] = None,
+    ) -> T:
+        """执行 attempt，遇到 Retryable 时按策略、预算与截止时间决定是否重试
+
+        Args:
+            caller: 调用方名称（统计与日志用）
+            attempt: 单次尝试，返回结果或抛出 Retryable
+            deadline: 截止时间（time.monotonic()），退避会越过该时间时放弃；默认取当前请求的截止时间
+        """
+        if deadline is None:
+            deadline = request_deadline.get()
+        stats = self._stats.setdefault(caller, CallerStats())
+        stats.calls += 1
+        nested = _active.get()
+        if not nested:
+            self._deposit()
+        token = _active.set(True)
+        state = RetryState()
+        try:
+            while True:
+                stats.attempts += 1
+                try:
+                    result = await attempt(state)
+                except Retryable as e:
+                    delay = self._admit(caller, stats, state, e, deadline)
+                    if delay is None:
+                        raise e.error or e
+                    await asyncio.sleep(delay)
+                    state.attempt += 1
+                    continue
+                if state.attempt:
+                    stats.recovered += 1
+                    logger.info(f"[Retry] {caller} 重试成功（第{state.attempt}次重试）")
+                return result
+        finally:
+            _active.reset(token)
+
+    def _admit(self, caller: str, stats: CallerStats, state: RetryState, e: Retryable, deadline: Optional[float]) -> Optional[float]:
+        """决定是否重试，返回退避时间（None 为放弃）"""
+        policy = self.policy(e.kind)
+        retry = state.count(e.kind) + 1
+        if retry > policy.max_retries:
+            stats.exhausted += 1
+            logger.error(f"[Retry] {caller} {e}，{e.kind} 已重试{retry - 1}次，放弃")
+            return None
+
+        delay = policy.backoff(retry)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            stats.denied_deadline += 1
+            logger.warning(f"[Retry] {caller} {e}，剩余时间不足，放弃重试")
+            return None
+        if not self._withdraw():
+            stats.denied_budget += 1
+            logger.warning(f"[Retry] {caller} {e}，重试预算不足，放弃重试")
+            return None
+
+        state.retries[e.kind] = retry
+        stats.retries[e.kind] = stats.retries.get(e.kind, 0) + 1
+        logger.warning(f"[Retry] {caller} {e}，{e.kind} 重试 {retry}/{policy.max_retries}，等待{delay:.2f}s")
+        return delay
+
+    # === 统计 ===
+
+    def get_stats(self) -> Dict[str, Any]:
+        """重试消耗与拒绝统计"""
+        ratio, burst = self._budget_config()
+        callers = {name: s.to_dict() for name, s in self._stats.items()}
+        return {
+            "budget": {
+                "ratio": ratio,
+                "burst": burst,
+                "available": round(burst if self._tokens is None else self._tokens, 2),
+            },
+            "retries": sum(c["retries"] for c in callers.values()),
+            "denied_budget": sum(c["denied_budget"] for c in callers.values()),
+            "denied_deadline": sum(c["denied_deadline"] for c in callers.values()),
+            "exhausted": sum(c["exhausted"] for c in callers.values()),
+            "callers": callers,
+        }
+
+
+# 全局实例
+retry_engine = RetryEngine()
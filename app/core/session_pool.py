@@ -0,0 +1,281 @@
+"""HTTP会话池 - 按 (代理, 浏览器指纹) 复用 curl_cffi AsyncSession，减少TCP/TLS/CONNECT握手"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Tuple, Any, AsyncIterator
+
+from curl_cffi.requests import AsyncSession
+from curl_cffi.const import CurlHttpVersion, CurlInfo
+
+from app.core.logger import logger
+
+
+# 常量
+DEFAULT_BROWSER = "chrome133a"
+WARMUP_URL = "https://grok.com/"
+WARMUP_TIMEOUT = 10
+TIMING_INFOS = [CurlInfo.APPCONNECT_TIME, CurlInfo.STARTTRANSFER_TIME]  # 每个响应附带的握手与首字节耗时
+
+
+@dataclass
+class PooledSession:
+    """池化会话"""
+    session: AsyncSession
+    key: Tuple[str, str]
+    created_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+    in_use: int = 0  # 正在使用该会话的请求数
+
+
+@dataclass
+class PoolStats:
+    """单个池的统计"""
+    hits: int = 0  # 复用已有会话
+    misses: int = 0  # 新建会话（需要握手）
+    evictions: int = 0  # 空闲回收次数
+
+    def to_dict(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class SessionPool:
+    """会话池管理器
+
+    每个 (代理URL, impersonate) 对应一个长期存活的 AsyncSession，
+    会话内部的 curl multi 句柄保留连接缓存，实现 keep-alive 复用与 HTTP/2 多路复用。
+    """
+
+    def __init__(self):
+        self._sessions: Dict[Tuple[str, str], PooledSession] = {}
+        self._stats: Dict[Tuple[str, str], PoolStats] = {}  # 仅存活的会话，回收时并入 _retired
+        self._retired = PoolStats()  # 已回收会话的累计统计（代理池轮换代理时不再无限增长）
+        self._by_session: Dict[int, PooledSession] = {}  # id(session) -> PooledSession
+        self._lock = asyncio.Lock()
+        self._evict_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        # 配置
+        self._idle_timeout: float = 300
+        self._max_clients: int = 100
+        self._http2: bool = True
+
+    def configure(self, idle_timeout: float = 300, max_clients: int = 100, http2: bool = True) -> None:
+        """配置会话池
+
+        Args:
+            idle_timeout: 会话空闲多少秒后回收
+            max_clients: 单个会话允许的最大并发curl句柄数
+            http2: 是否允许HTTP/2多路复用（False则强制HTTP/1.1）
+        """
+        self._idle_timeout = max(10.0, float(idle_timeout or 300))
+        self._max_clients = max(1, int(max_clients or 100))
+        self._http2 = bool(http2)
+        logger.info(
+            f"[SessionPool] 配置: 空闲回收{self._idle_timeout:.0f}s, "
+            f"单会话并发{self._max_clients}, HTTP/2={'on' if self._http2 else 'off'}"
+        )
+
+    @staticmethod
+    def _key(proxy: Optional[str], impersonate: str) -> Tuple[str, str]:
+        return (proxy or "", impersonate or DEFAULT_BROWSER)
+
+    def _create(self, key: Tuple[str, str]) -> PooledSession:
+        """新建会话"""
+        proxy, impersonate = key
+        kwargs: Dict[str, Any] = {
+            "impersonate": impersonate,
+            "max_clients": self._max_clients,
+            # 多个SSO共享同一会话，禁止把响应Cookie带到其他账号的请求里
+            "discard_cookies": True,
+            "curl_infos": TIMING_INFOS,
+        }
+        if proxy:
+            kwargs["proxies"] = {"http": proxy, "https": proxy}
+        if not self._http2:
+            kwargs["http_version"] = CurlHttpVersion.V1_1
+        return PooledSession(session=AsyncSession(**kwargs), key=key)
+
+    async def acquire(self, proxy: Optional[str] = None, impersonate: str = DEFAULT_BROWSER) -> AsyncSession:
+        """获取会话（需配合 release 使用）"""
+        if self._closed:
+            raise RuntimeError("SessionPool已关闭")
+
+        key = self._key(proxy, impersonate)
+        stats = self._stats.setdefault(key, PoolStats())
+        pooled = self._sessions.get(key)
+
+        if pooled is None:
+            async with self._lock:
+                pooled = self._sessions.get(key)
+                if pooled is None:
+                    pooled = self._create(key)
+                    self._sessions[key] = pooled
+                    self._by_session[id(pooled.session)] = pooled
+                    stats.misses += 1
+                    self._ensure_evictor()
+                    logger.debug(f"[SessionPool] 新建会话: {self._label(key)}")
+                else:
+                    stats.hits += 1
+        else:
+            stats.hits += 1
+
+        pooled.in_use += 1
+        pooled.last_used = time.monotonic()
+        return pooled.session
+
+    def release(self, session: AsyncSession) -> None:
+        """归还会话"""
+        pooled = self._by_session.get(id(session))
+        if pooled is not None:
+            pooled.in_use = max(0, pooled.in_use - 1)
+            pooled.last_used = time.monotonic()
+
+    @staticmethod
+    def timings(response: Any, elapsed: Optional[float] = None) -> Tuple[Optional[float], Optional[float]]:
+        """响应的握手与首字节耗时（秒）
+
+        握手耗时只在新建连接时有值（复用连接为None）；首字节耗时取curl统计，缺失时用 elapsed。
+        """
+        infos = getattr(response, "infos", None) or {}
+        connect = infos.get(CurlInfo.APPCONNECT_TIME) or None
+        ttfb = infos.get(CurlInfo.STARTTRANSFER_TIME) or elapsed
+        return connect, ttfb
+
+    @asynccontextmanager
+    async def session(self, proxy: Optional[str] = None, impersonate: str = DEFAULT_BROWSER) -> AsyncIterator[AsyncSession]:
+        """以上下文方式使用会话"""
+        session = await self.acquire(proxy, impersonate)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    async def prewarm(self, proxies: list, impersonate: str = DEFAULT_BROWSER) -> int:
+        """为代理预建会话并完成一次握手
+
+        Args:
+            proxies: 代理URL列表（空字符串表示直连）
+
+        Returns:
+            预热成功的会话数
+        """
+        async def warm(proxy: str) -> bool:
+            try:
+                async with self.session(proxy, impersonate) as session:
+                    await session.head(WARMUP_URL, timeout=WARMUP_TIMEOUT)
+                return True
+            except Exception as e:
+                logger.debug(f"[SessionPool] 预热失败: {self._label(self._key(proxy, impersonate))}, {e}")
+                return False
+
+        targets = list(dict.fromkeys(proxies))
+        if not targets:
+            return 0
+        results = await asyncio.gather(*[warm(p) for p in targets])
+        warmed = sum(1 for ok in results if ok)
+        logger.info(f"[SessionPool] 预热完成: {warmed}/{len(targets)}")
+        return warmed
+
+    def _ensure_evictor(self) -> None:
+        if self._evict_task is None or self._evict_task.done():
+            self._evict_task = asyncio.create_task(self._evict_worker())
+
+    async def _evict_worker(self) -> None:
+        """回收空闲会话"""
+        while not self._closed and self._sessions:
+            await asyncio.sleep(max(5.0, self._idle_timeout / 2))
+            now = time.monotonic()
+            idle = [
+                key for key, pooled in self._sessions.items()
+                if pooled.in_use == 0 and now - pooled.last_used >= self._idle_timeout
+            ]
+            for key in idle:
+                pooled = self._sessions.pop(key, None)
+                if not pooled:
+                    continue
+                self._by_session.pop(id(pooled.session), None)
+                self._retire(key)
+                await self._close_session(pooled)
+                logger.debug(f"[SessionPool] 回收空闲会话: {self._label(key)}")
+
+    def _retire(self, key: Tuple[str, str]) -> None:
+        """会话被回收时将其统计并入累计值并移除"""
+        stats = self._stats.pop(key, None) or PoolStats()
+        self._retired.hits += stats.hits
+        self._retired.misses += stats.misses
+        self._retired.evictions += stats.evictions + 1
+
+    @staticmethod
+    async def _close_session(pooled: PooledSession) -> None:
+        try:
+            await pooled.session.close()
+        except Exception as e:
+            logger.warning(f"[SessionPool] 关闭会话失败: {e}")
+
+    @staticmethod
+    def _public_proxy(proxy: str) -> str:
+        """去掉代理URL中的认证信息（user:pass@）"""
+        if "@" not in proxy:
+            return proxy
+        scheme, sep, rest = proxy.partition("://")
+        host = (rest if sep else proxy).split("@")[-1]
+        return f"{scheme}://{host}" if sep else host
+
+    @classmethod
+    def _label(cls, key: Tuple[str, str]) -> str:
+        proxy, impersonate = key
+        return f"{cls._public_proxy(proxy) or 'direct'}|{impersonate}"
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各池统计"""
+        pools = []
+        now = time.monotonic()
+        for key, stats in self._stats.items():
+            pooled = self._sessions.get(key)
+            pools.append({
+                "proxy": self._public_proxy(key[0]),
+                "impersonate": key[1],
+                "alive": pooled is not None,
+                "in_use": pooled.in_use if pooled else 0,
+                "idle_seconds": round(now - pooled.last_used, 1) if pooled else None,
+                **stats.to_dict(),
+            })
+        hits = self._retired.hits + sum(s.hits for s in self._stats.values())
+        misses = self._retired.misses + sum(s.misses for s in self._stats.values())
+        return {
+            "sessions": len(self._sessions),
+            "hits": hits,
+            "misses": misses,
+            "evictions": self._retired.evictions,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "pools": pools,
+        }
+
+    async def close(self) -> None:
+        """关闭所有会话"""
+        self._closed = True
+        if self._evict_task:
+            self._evict_task.cancel()
+            try:
+                await self._evict_task
+            except asyncio.CancelledError:
+                pass
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        self._by_session.clear()
+        for pooled in sessions:
+            await self._close_session(pooled)
+        if sessions:
+            logger.info(f"[SessionPool] 已关闭 {len(sessions)} 个会话")
+
+
+# 全局实例
+session_pool = SessionPool()
@@ -0,0 +1,132 @@
+"""二进制快照文件 - 带版本号的分段容器，读取时 mmap 映射、按段切片
+
+布局（小端）:
+    头部   魔数(8) 版本(u32) 段数(u32) 写入时间毫秒(u64)
+    段表   每段: 名称长度(u16) 名称 偏移(u64) 长度(u64) CRC32(u32)
+    数据   各段按8字节对齐依次存放
+
+版本号或魔数不符、段校验失败时视为无快照，由调用方回退到常规加载。
+"""
+
+import os
+import mmap
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+
+MAGIC = b"G2ASNAP\0"
+VERSION = 1
+_HEADER = struct.Struct("<8sIIQ")
+_NAME_LEN = struct.Struct("<H")
+_ENTRY = struct.Struct("<QQI")
+_ALIGN = 8
+
+
+class SnapshotError(Exception):
+    """快照格式错误"""
+
+
+def write_snapshot(path: Path, sections: Dict[str, bytes], version: int = VERSION) -> int:
+    """写入快照（临时文件 + 原子替换），返回文件大小"""
+    table_size = _HEADER.size + sum(_NAME_LEN.size + len(name.encode()) + _ENTRY.size for name in sections)
+    offset = table_size + (-table_size) % _ALIGN
+
+    entries = []
+    for name, payload in sections.items():
+        entries.append((name.encode(), offset, len(payload), zlib.crc32(payload)))
+        offset += len(payload) + (-len(payload)) % _ALIGN
+
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")  # 多worker同时关闭时各写各的临时文件
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, version, len(sections), int(time.time() * 1000)))
+        for name, start, length, crc in entries:
+            f.write(_NAME_LEN.pack(len(name)) + name + _ENTRY.pack(start, length, crc))
+        for (_, start, _, _), payload in zip(entries, sections.values()):
+            f.write(b"\0" * (start - f.tell()))
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp, path)
+    return size
+
+
+class Snapshot:
+    """只读快照（mmap映射，段以 memoryview 返回，不复制）"""
+
+    def __init__(self, path: Path, version: int = VERSION):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SnapshotError("空文件")
+        self._view = memoryview(self._map)
+        self._sections: Dict[str, Tuple[int, int, int]] = {}
+        try:
+            self._parse(version)
+        except Exception:
+            self.close()
+            raise
+
+    def _parse(self, version: int) -> None:
+        view = self._view
+        if len(view) < _HEADER.size:
+            raise SnapshotError("文件过短")
+        magic, file_version, count, created = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise SnapshotError("魔数不符")
+        if file_version != version:
+            raise SnapshotError(f"版本不符: {file_version} != {version}")
+        self.created_ms = created
+
+        pos = _HEADER.size
+        for _ in range(count):
+            (name_len,) = _NAME_LEN.unpack_from(view, pos)
+            pos += _NAME_LEN.size
+            name = bytes(view[pos:pos + name_len]).decode()
+            pos += name_len
+            start, length, crc = _ENTRY.unpack_from(view, pos)
+            pos += _ENTRY.size
+            if start + length > len(view):
+                raise SnapshotError(f"段越界: {name}")
+            self._sections[name] = (start, length, crc)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._sections
+
+    def names(self) -> Iterator[str]:
+        return iter(self._sections)
+
+    def section(self, name: str) -> memoryview:
+        """读取段（首次读取时校验CRC）"""
+        start, length, crc = self._sections[name]
+        data = self._view[start:start + length]
+        if crc is not None:
+            if zlib.crc32(data) != crc:
+                raise SnapshotError(f"段校验失败: {name}")
+            self._sections[name] = (start, length, None)
+        return data
+
+    def get(self, name: str) -> Optional[memoryview]:
+        return self.section(name) if name in self._sections else None
+
+    def close(self) -> None:
+        """释放映射（调用方需先释放持有的段视图）"""
+        try:
+            self._view.release()
+            self._map.close()
+        except BufferError:
+            pass  # 仍有段视图未释放，交由GC回收
+        self._file.close()
+
+
+def open_snapshot(path: Path, version: int = VERSION) -> Optional[Snapshot]:
+    """打开快照，不存在返回None，格式错误抛出 SnapshotError"""
+    if not path.exists():
+        return None
+    return Snapshot(path, version)
@@ -6,15 +6,34 @@ import toml
 import asyncio
 import warnings
 import aiofiles
+import portalocker
+from collections.abc import Mapping
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Any, Optional, Literal
+from typing import Dict, Any, Optional, Literal, List, Tuple, Iterable, Iterator, Set
 from abc import ABC, abstractmethod
 from urllib.parse import urlparse, unquote
 
 from app.core.logger import logger
+from app.core.redis_tokens import RedisTokenStore, migrate_tokens
+from app.core.redis_proxy_health import RedisProxyHealth
+from app.core.mysql_tokens import MysqlTokenStore, migrate_tokens as migrate_mysql_tokens
 
 
 StorageMode = Literal["file", "mysql", "redis"]
+FileSig = Tuple[int, int, int]  # (inode, mtime_ns, size)
+TokenCursor = Tuple[Optional[FileSig], Optional[int], int]  # (快照签名, 日志inode, 日志读取偏移)
+TokenChanges = Dict[str, Tuple[Optional[str], Optional[Dict[str, Any]]]]  # sso -> (token类型, 数据)，数据为None表示删除
+TokenFields = Optional[Dict[str, Optional[Set[str]]]]  # sso -> 修改过的字段，None表示整条
+ArchiveChanges = Dict[str, Optional[Dict[str, Any]]]  # sso -> 归档条目，None表示移出归档
+
+
+def _json_default(obj: Any) -> Any:
+    """序列化非dict映射（如列式Token表及其记录视图）"""
+    if isinstance(obj, Mapping):
+        to_dict = getattr(obj, "to_dict", None)
+        return to_dict() if callable(to_dict) else dict(obj)
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
 
 
 class BaseStorage(ABC):
@@ -35,6 +54,28 @@ class BaseStorage(ABC):
         """保存token数据"""
         pass
 
+    async def save_token_changes(self, data: Dict[str, Any], changes: TokenChanges, fields: TokenFields = None) -> None:
+        """增量保存变更的token（默认全量保存）
+
+        Args:
+            fields: sso -> 本地修改过的字段（仅支持字段级写入的后端使用）
+        """
+        await self.save_tokens(data)
+
+    async def compact_tokens(self, max_journal_bytes: int = 0) -> None:
+        """压缩token变更日志（默认无日志，无需压缩）"""
+        pass
+
+    @abstractmethod
+    async def load_token_archive(self, ssos: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """加载冷归档Token（sso -> {type, data, archivedAt, reason}，ssos为None时加载全部）"""
+        pass
+
+    @abstractmethod
+    async def save_token_archive(self, changes: ArchiveChanges) -> None:
+        """写入冷归档变更"""
+        pass
+
     @abstractmethod
     async def load_config(self) -> Dict[str, Any]:
         """加载配置数据"""
@@ -52,11 +93,16 @@ class FileStorage(BaseStorage):
     def __init__(self, data_dir: Path):
         self.data_dir = data_dir
         self.token_file = data_dir / "token.json"
+        self.token_journal = data_dir / "token.journal"
+        self.token_lock_file = data_dir / "token.lock"
+        self.token_archive_file = data_dir / "token_archive.json"
+        self.token_archive_lock_file = data_dir / "token_archive.lock"
         self.config_file = data_dir / "setting.toml"
         self.proxy_state_file = data_dir / "proxy_state.json"
         self._token_lock = asyncio.Lock()
         self._config_lock = asyncio.Lock()
         self._proxy_state_lock = asyncio.Lock()
+        self._archive_lock = asyncio.Lock()
 
     async def init_db(self) -> None:
         """初始化文件存储"""
@@ -125,9 +171,15 @@ class FileStorage(BaseStorage):
             raise
 
     async def load_tokens(self) -> Dict[str, Any]:
-        """加载token"""
-        data = await self._load_json(self.token_file, {"ssoNormal": {}, "ssoSuper": {}}, self._token_lock)
-        if isinstance(data, dict) and "sso" in data:
+        """加载token（快照 + 重放变更日志）"""
+        try:
+            _, data, _ = await self.read_token_updates(None)
+        except Exception as e:
+            logger.error(f"[Storage] 加载{self.token_file.name}失败: {e}")
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+        if "sso" in data:
             if "ssoNormal" in data:
                 data["ssoNormal"].update(data.get("sso", {}))
             else:
@@ -138,8 +190,232 @@ class FileStorage(BaseStorage):
         return data
 
     async def save_tokens(self, data: Dict[str, Any]) -> None:
-        """保存token"""
-        await self._save_json(self.token_file, data, self._token_lock)
+        """全量保存token（写入快照并清空变更日志）"""
+        try:
+            content = orjson.dumps(data, default=_json_default, option=orjson.OPT_INDENT_2)
+            async with self._token_lock:
+                await asyncio.to_thread(self._write_snapshot, content)
+        except Exception as e:
+            logger.error(f"[Storage] 保存{self.token_file.name}失败: {e}")
+            raise
+
+    async def save_token_changes(self, data: Dict[str, Any], changes: TokenChanges, fields: TokenFields = None) -> None:
+        """追加变更的token到日志，写入量与变更数成正比"""
+        if not changes:
+            return
+        lines = b"".join(
+            orjson.dumps({"k": sso, "t": token_type, "v": value}, default=_json_default) + b"\n"
+            for sso, (token_type, value) in changes.items()
+        )
+        try:
+            async with self._token_lock:
+                await asyncio.to_thread(self._append_journal, lines)
+        except Exception as e:
+            logger.error(f"[Storage] 写入{self.token_journal.name}失败: {e}")
+            raise
+
+    async def compact_tokens(self, max_journal_bytes: int = 0) -> None:
+        """将变更日志合并进快照
+
+        Args:
+            max_journal_bytes: 日志不超过该大小时跳过（0表示只要有日志就压缩）
+        """
+        size = self.journal_size()
+        if size == 0 or size <= max_journal_bytes:
+            return
+        try:
+            async with self._token_lock:
+                count = await asyncio.to_thread(self._compact)
+            logger.info(f"[Storage] Token日志已压缩: {count} 条记录, {size / 1024:.1f}KB")
+        except Exception as e:
+            logger.error(f"[Storage] 压缩{self.token_journal.name}失败: {e}")
+            raise
+
+    async def read_token_updates(self, cursor: Optional[TokenCursor]) -> Tuple[TokenCursor, Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """读取游标之后的token变化
+
+        快照被替换（压缩/全量保存）或游标为空时返回完整数据，
+        否则只读取日志新增部分。
+
+        Returns:
+            (新游标, 完整数据或None, 日志记录列表)
+        """
+        async with self._token_lock:
+            return await asyncio.to_thread(self._read_updates, cursor)
+
+    def token_changed(self, cursor: Optional[TokenCursor]) -> bool:
+        """快照或日志是否在游标之后发生变化（仅stat）"""
+        if cursor is None:
+            return True
+        snapshot_sig, journal_ino, offset = cursor
+        if self._stat(self.token_file) != snapshot_sig:
+            return True
+        journal = self._stat(self.token_journal)
+        if journal is None:
+            return offset != 0
+        return journal[0] != journal_ino or journal[2] != offset
+
+    def journal_size(self) -> int:
+        """变更日志大小（字节）"""
+        sig = self._stat(self.token_journal)
+        return sig[2] if sig else 0
+
+    @staticmethod
+    def _stat(path: Path) -> Optional[FileSig]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    @contextmanager
+    def _token_file_lock(self, mode: int, path: Optional[Path] = None) -> Iterator[None]:
+        """跨进程锁：日志追加/读取共享，快照替换独占"""
+        with open(path or self.token_lock_file, "a") as f:
+            portalocker.lock(f, mode)
+            try:
+                yield
+            finally:
+                portalocker.unlock(f)
+
+    @staticmethod
+    def _apply_change(data: Dict[str, Any], record: Dict[str, Any]) -> None:
+        """将一条日志记录应用到数据"""
+        sso = record.get("k")
+        if not sso:
+            return
+        for token_map in data.values():
+            if isinstance(token_map, dict):
+                token_map.pop(sso, None)
+        token_type, value = record.get("t"), record.get("v")
+        if token_type and value is not None:
+            data.setdefault(token_type, {})[sso] = value
+
+    def _read_journal(self, offset: int) -> Tuple[List[Dict[str, Any]], int]:
+        """从偏移处读取完整的日志行（未写完的尾行留待下次）"""
+        try:
+            with open(self.token_journal, "rb") as f:
+                f.seek(offset)
+                buf = f.read()
+        except FileNotFoundError:
+            return [], 0
+
+        end = buf.rfind(b"\n") + 1
+        records = []
+        for line in buf[:end].splitlines():
+            if not line:
+                continue
+            try:
+                records.append(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                logger.warning(f"[Storage] 跳过损坏的日志记录: {line[:80]!r}")
+        return records, offset + end
+
+    def _load_snapshot(self) -> Dict[str, Any]:
+        if not self.token_file.exists():
+            return {"ssoNormal": {}, "ssoSuper": {}}
+        with open(self.token_file, "rb") as f:
+            return orjson.loads(f.read())
+
+    def _read_updates(self, cursor: Optional[TokenCursor]) -> Tuple[TokenCursor, Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        with self._token_file_lock(portalocker.LOCK_SH):
+            snapshot_sig = self._stat(self.token_file)
+            journal = self._stat(self.token_journal)
+            journal_ino = journal[0] if journal else None
+
+            full = (
+                cursor is None
+                or cursor[0] != snapshot_sig
+                or cursor[1] != journal_ino
+                or (journal[2] if journal else 0) < cursor[2]
+            )
+            if full:
+                data = self._load_snapshot()
+                records, offset = self._read_journal(0)
+                for record in records:
+                    self._apply_change(data, record)
+                return (snapshot_sig, journal_ino, offset), data, []
+
+            records, offset = self._read_journal(cursor[2])
+            return (snapshot_sig, journal_ino, offset), None, records
+
+    def _append_journal(self, lines: bytes) -> None:
+        with self._token_file_lock(portalocker.LOCK_SH):
+            with open(self.token_journal, "ab") as f:
+                f.write(lines)  # O_APPEND单次写入，多进程追加互不交错
+                f.flush()
+
+    def _replace_snapshot(self, content: bytes) -> None:
+        """原子替换快照并清空日志（调用方持有独占锁）"""
+        tmp = self.token_file.with_suffix(".json.tmp")
+        with open(tmp, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.token_file)
+        with open(self.token_journal, "wb"):
+            pass
+
+    def _write_snapshot(self, content: bytes) -> None:
+        with self._token_file_lock(portalocker.LOCK_EX):
+            self._replace_snapshot(content)
+
+    def _compact(self) -> int:
+        with self._token_file_lock(portalocker.LOCK_EX):
+            data = self._load_snapshot()
+            records, _ = self._read_journal(0)
+            for record in records:
+                self._apply_change(data, record)
+            self._replace_snapshot(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+            return len(records)
+
+    async def load_token_archive(self, ssos: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """加载冷归档（token_archive.json，仅在访问归档时读取）"""
+        try:
+            async with self._archive_lock:
+                archive = await asyncio.to_thread(self._read_archive)
+        except Exception as e:
+            logger.error(f"[Storage] 加载{self.token_archive_file.name}失败: {e}")
+            raise
+        if ssos is None:
+            return archive
+        return {sso: archive[sso] for sso in ssos if sso in archive}
+
+    async def save_token_archive(self, changes: ArchiveChanges) -> None:
+        """合并写入冷归档（跨进程独占锁内读-改-原子替换）"""
+        if not changes:
+            return
+        try:
+            async with self._archive_lock:
+                await asyncio.to_thread(self._update_archive, changes)
+        except Exception as e:
+            logger.error(f"[Storage] 保存{self.token_archive_file.name}失败: {e}")
+            raise
+
+    def _read_archive(self) -> Dict[str, Dict[str, Any]]:
+        with self._token_file_lock(portalocker.LOCK_SH, self.token_archive_lock_file):
+            if not self.token_archive_file.exists():
+                return {}
+            with open(self.token_archive_file, "rb") as f:
+                return orjson.loads(f.read())
+
+    def _update_archive(self, changes: ArchiveChanges) -> None:
+        with self._token_file_lock(portalocker.LOCK_EX, self.token_archive_lock_file):
+            archive = {}
+            if self.token_archive_file.exists():
+                with open(self.token_archive_file, "rb") as f:
+                    archive = orjson.loads(f.read())
+            for sso, entry in changes.items():
+                if entry is None:
+                    archive.pop(sso, None)
+                else:
+                    archive[sso] = entry
+            tmp = self.token_archive_file.with_suffix(".json.tmp")
+            with open(tmp, "wb") as f:
+                f.write(orjson.dumps(archive, default=_json_default))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.token_archive_file)
 
     async def load_config(self) -> Dict[str, Any]:
         """加载配置"""
@@ -158,8 +434,23 @@ class FileStorage(BaseStorage):
         )
 
     async def save_proxy_state(self, data: Dict[str, Any]) -> None:
-        """保存代理状态"""
-        await self._save_json(self.proxy_state_file, data, self._proxy_state_lock)
+        """保存代理状态（写临时文件后原子替换，写入中途退出不会留下半个文件）"""
+        try:
+            async with self._proxy_state_lock:
+                content = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+                await asyncio.to_thread(self._replace_proxy_state, content)
+        except Exception as e:
+            logger.error(f"[Storage] 保存{self.proxy_state_file.name}失败: {e}")
+            raise
+
+    def _replace_proxy_state(self, content: bytes) -> None:
+        # 临时文件按进程区分，多worker同时保存时互不覆盖
+        tmp = self.proxy_state_file.with_suffix(f".json.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.proxy_state_file)
 
 
 class MysqlStorage(BaseStorage):
@@ -170,6 +461,7 @@ class MysqlStorage(BaseStorage):
         self.data_dir = data_dir
         self._pool = None
         self._file = FileStorage(data_dir)
+        self.token_store: Optional[MysqlTokenStore] = None
 
     async def init_db(self) -> None:
         """初始化MySQL"""
@@ -184,6 +476,7 @@ class MysqlStorage(BaseStorage):
                 password=parsed['password'], db=parsed['db'], charset="utf8mb4",
                 autocommit=True, maxsize=10
             )
+            self.token_store = MysqlTokenStore(self._pool)
             await self._create_tables()
             await self._file.init_db()
             await self._sync_data()
@@ -230,6 +523,7 @@ class MysqlStorage(BaseStorage):
     async def _create_tables(self) -> None:
         """创建表"""
         tables = {
+            # 旧版整表单行JSON，仅作迁移来源
             "grok_tokens": """
                 CREATE TABLE IF NOT EXISTS grok_tokens (
                     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -254,24 +548,33 @@ class MysqlStorage(BaseStorage):
                     warnings.filterwarnings('ignore', message='.*already exists')
                     for sql in tables.values():
                         await cursor.execute(sql)
-                logger.info("[Storage] MySQL表就绪")
+        await self.token_store.create_table()
+        logger.info("[Storage] MySQL表就绪")
 
     async def _sync_data(self) -> None:
         """同步数据"""
         try:
-            for table, key in [("grok_tokens", "ssoNormal"), ("grok_settings", "global")]:
-                data = await self._load_db(table)
-                if data:
-                    if table == "grok_tokens":
-                        await self._file.save_tokens(data)
-                    else:
-                        await self._file.save_config(data)
-                    logger.info(f"[Storage] {table.split('_')[1]}数据已从DB同步")
-                else:
-                    file_data = await (self._file.load_tokens() if table == "grok_tokens" else self._file.load_config())
-                    if (file_data.get(key) or file_data.get("sso") or (table == "grok_tokens" and file_data.get("ssoSuper"))):
-                        await self._save_db(table, file_data)
-                        logger.info(f"[Storage] {table.split('_')[1]}数据已初始化到DB")
+            # Token：按行表为准；为空时由旧版单行JSON或本地文件迁移（旧表保留不再写入）
+            if await self.token_store.initialized():
+                await self._file.save_tokens(await self.token_store.load_all())
+                logger.info("[Storage] tokens数据已从DB同步")
+            else:
+                data = await self._load_db("grok_tokens") or await self._file.load_tokens()
+                if "sso" in data:
+                    data.setdefault("ssoNormal", {}).update(data.pop("sso") or {})
+                if data.get("ssoNormal") or data.get("ssoSuper"):
+                    await migrate_mysql_tokens(self.token_store, data)
+                    await self._file.save_tokens(data)
+
+            data = await self._load_db("grok_settings")
+            if data:
+                await self._file.save_config(data)
+                logger.info("[Storage] settings数据已从DB同步")
+            else:
+                file_data = await self._file.load_config()
+                if file_data.get("global"):
+                    await self._save_db("grok_settings", file_data)
+                    logger.info("[Storage] settings数据已初始化到DB")
         except Exception as e:
             logger.warning(f"[Storage] 同步失败: {e}")
 
@@ -292,7 +595,7 @@ class MysqlStorage(BaseStorage):
         try:
             async with self._pool.acquire() as conn:
                 async with conn.cursor() as cursor:
-                    json_data = orjson.dumps(data).decode()
+                    json_data = orjson.dumps(data, default=_json_default).decode()
                     await cursor.execute(f"SELECT id FROM {table} ORDER BY id DESC LIMIT 1")
                     result = await cursor.fetchone()
 
@@ -311,7 +614,32 @@ class MysqlStorage(BaseStorage):
     async def save_tokens(self, data: Dict[str, Any]) -> None:
         """保存token"""
         await self._file.save_tokens(data)
-        await self._save_db("grok_tokens", data)
+        await self.token_store.replace_all(data)
+
+    async def save_token_changes(self, data: Dict[str, Any], changes: TokenChanges, fields: TokenFields = None) -> None:
+        """保存token（本地文件与DB均只写入变更的Token）"""
+        await self._file.save_token_changes(data, changes)
+        try:
+            await self.token_store.apply_changes(changes)
+        except Exception as e:
+            logger.error(f"[Storage] 保存{len(changes)}个token到DB失败: {e}")
+            raise
+
+    async def compact_tokens(self, max_journal_bytes: int = 0) -> None:
+        """压缩本地文件日志"""
+        await self._file.compact_tokens(max_journal_bytes)
+
+    async def load_token_archive(self, ssos: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """加载冷归档（grok_token_archive 表）"""
+        return await self.token_store.load_archive(ssos)
+
+    async def save_token_archive(self, changes: ArchiveChanges) -> None:
+        """写入冷归档"""
+        try:
+            await self.token_store.save_archive(changes)
+        except Exception as e:
+            logger.error(f"[Storage] 保存{len(changes)}个归档token到DB失败: {e}")
+            raise
 
     async def load_config(self) -> Dict[str, Any]:
         """加载配置"""
@@ -338,6 +666,8 @@ class RedisStorage(BaseStorage):
         self.data_dir = data_dir
         self._redis = None
         self._file = FileStorage(data_dir)
+        self.token_store: Optional[RedisTokenStore] = None
+        self.proxy_health: Optional[RedisProxyHealth] = None
 
     async def init_db(self) -> None:
         """初始化Redis"""
@@ -353,6 +683,8 @@ class RedisStorage(BaseStorage):
 
             await self._redis.ping()
             logger.info(f"[Storage] Redis连接成功")
+            self.token_store = RedisTokenStore(self._redis)
+            self.proxy_health = RedisProxyHealth(self._redis)
 
             await self._file.init_db()
             await self._sync_data()
@@ -366,42 +698,62 @@ class RedisStorage(BaseStorage):
     async def _sync_data(self) -> None:
         """同步数据"""
         try:
-            for key, file_func, key_name in [
-                ("grok:tokens", self._file.load_tokens, "ssoNormal"),
-                ("grok:settings", self._file.load_config, "global")
-            ]:
-                data = await self._redis.get(key)
-                if data:
-                    parsed = orjson.loads(data)
-                    if key == "grok:tokens":
-                        await self._file.save_tokens(parsed)
-                    else:
-                        await self._file.save_config(parsed)
-                    logger.info(f"[Storage] {key.split(':')[1]}数据已从Redis同步")
-                else:
-                    file_data = await file_func()
-                    if (file_data.get(key_name) or file_data.get("sso") or (key == "grok:tokens" and file_data.get("ssoSuper"))):
-                        await self._redis.set(key, orjson.dumps(file_data).decode())
-                        logger.info(f"[Storage] {key.split(':')[1]}数据已初始化到Redis")
+            # Token：首次启动时由旧版单键JSON或本地文件迁移为每Token哈希，之后以Redis为准同步到本地备份
+            if await self.token_store.initialized():
+                await self._file.save_tokens(await self.token_store.load_all())
+                logger.info("[Storage] tokens数据已从Redis同步")
+            else:
+                legacy = await self._redis.get("grok:tokens")
+                data = orjson.loads(legacy) if legacy else await self._file.load_tokens()
+                if "sso" in data:
+                    data.setdefault("ssoNormal", {}).update(data.pop("sso") or {})
+                await migrate_tokens(self.token_store, data)
+
+            data = await self._redis.get("grok:settings")
+            if data:
+                await self._file.save_config(orjson.loads(data))
+                logger.info("[Storage] settings数据已从Redis同步")
+            else:
+                file_data = await self._file.load_config()
+                if file_data.get("global"):
+                    await self._redis.set("grok:settings", orjson.dumps(file_data).decode())
+                    logger.info("[Storage] settings数据已初始化到Redis")
         except Exception as e:
             logger.warning(f"[Storage] 同步失败: {e}")
 
     async def _save_redis(self, key: str, data: Dict) -> None:
         """保存到Redis"""
         try:
-            await self._redis.set(key, orjson.dumps(data).decode())
+            await self._redis.set(key, orjson.dumps(data, default=_json_default).decode())
         except Exception as e:
             logger.error(f"[Storage] 保存Redis失败: {e}")
             raise
 
     async def load_tokens(self) -> Dict[str, Any]:
-        """加载token"""
-        return await self._file.load_tokens()
+        """加载token（每Token一个哈希）"""
+        return await self.token_store.load_all()
 
     async def save_tokens(self, data: Dict[str, Any]) -> None:
         """保存token"""
         await self._file.save_tokens(data)
-        await self._save_redis("grok:tokens", data)
+        await self.token_store.replace_all(data)
+
+    async def save_token_changes(self, data: Dict[str, Any], changes: TokenChanges, fields: TokenFields = None) -> None:
+        """保存token（本地文件增量作备份，Redis按Token/字段写入）"""
+        await self._file.save_token_changes(data, changes)
+        await self.token_store.apply_changes(changes, fields)
+
+    async def compact_tokens(self, max_journal_bytes: int = 0) -> None:
+        """压缩本地文件日志"""
+        await self._file.compact_tokens(max_journal_bytes)
+
+    async def load_token_archive(self, ssos: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """加载冷归档（grok:tokens:archive 哈希）"""
+        return await self.token_store.load_archive(ssos)
+
+    async def save_token_archive(self, changes: ArchiveChanges) -> None:
+        """写入冷归档"""
+        await self.token_store.save_archive(changes)
 
     async def load_config(self) -> Dict[str, Any]:
         """加载配置"""
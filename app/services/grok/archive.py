@@ -0,0 +1,200 @@
+"""Token冷归档 - 长期失效 / 持续0次数的Token移出热数据，按需读取
+
+热数据（token_data、调度索引、刷新扫描、统计与批量保存）只包含仍可能使用的Token；
+归档存放于存储层（文件 token_archive.json / MySQL grok_token_archive 表 / Redis grok:tokens:archive 哈希），
+仅在后台浏览、恢复、清除时读取，不随启动加载。
+
+归档条件（每轮状态刷新后检查，也可在后台手动触发）:
+    - 失效（status=expired）持续超过 token_archive_expired_days 天
+    - 连续 token_archive_zero_sweeps 次刷新为0次数
+"""
+
+import time
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import setting
+from app.core.logger import logger
+from app.models.grok_models import TokenType
+from app.services.grok.token import token_manager
+
+
+DAY_MS = 86400 * 1000
+REASON_EXPIRED = "expired"
+REASON_ZERO = "zero_quota"
+
+
+class TokenArchive:
+    """Token冷归档"""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()  # 归档/恢复/清除互斥
+        self._last_sweep: Optional[Dict[str, Any]] = None
+        self._totals = {"archived": 0, "revived": 0, "purged": 0}
+
+    @staticmethod
+    def _storage():
+        return token_manager._storage
+
+    # === 归档 ===
+
+    def _candidates(self, now: int) -> List[Tuple[str, str, str]]:
+        """按列扫描热数据，返回 (类型, sso, 原因)；同时维护失效起始时间 expiredTime"""
+        cfg = setting.global_config
+        expired_ms = float(cfg.get("token_archive_expired_days", 7) or 0) * DAY_MS
+        zero_sweeps = int(cfg.get("token_archive_zero_sweeps", 10) or 0)
+
+        found = []
+        for token_type in (TokenType.NORMAL.value, TokenType.SUPER.value):
+            table = token_manager.token_data.get(token_type, {})
+            rows = zip(
+                list(table),
+                table.column("status"),
+                table.column("expiredTime"),
+                table.column("zeroCount", 0),
+            )
+            for sso, status, expired_at, zero_count in rows:
+                if status != "expired":
+                    if expired_at is not None:
+                        del table[sso]["expiredTime"]  # 已恢复，重新计时
+                        token_manager._mark_dirty(sso)
+                    if zero_sweeps and (zero_count or 0) >= zero_sweeps and not token_manager.in_flight(sso):
+                        found.append((token_type, sso, REASON_ZERO))
+                    continue
+                if expired_at is None:
+                    table[sso]["expiredTime"] = now  # 首次发现失效，从此刻计时
+                    token_manager._mark_dirty(sso)
+                    expired_at = now
+                if token_manager.in_flight(sso):
+                    continue
+                if expired_ms and now - expired_at >= expired_ms:
+                    found.append((token_type, sso, REASON_EXPIRED))
+                elif zero_sweeps and (zero_count or 0) >= zero_sweeps:
+                    found.append((token_type, sso, REASON_ZERO))
+        return found
+
+    async def sweep(self) -> int:
+        """将满足条件的Token移入归档，返回归档数
+
+        先写入归档再从热数据删除，中途失败时Token仍留在热数据中。
+        """
+        if not token_manager.token_data:
+            return 0
+        async with self._lock:
+            t0 = time.monotonic()
+            now = int(time.time() * 1000)
+            found = self._candidates(now)
+            if found:
+                entries = {
+                    sso: {
+                        "type": token_type,
+                        "data": token_manager.token_data[token_type][sso].copy(),
+                        "archivedAt": now,
+                        "reason": reason,
+                    }
+                    for token_type, sso, reason in found
+                }
+                await self._storage().save_token_archive(entries)
+                for token_type in (TokenType.NORMAL, TokenType.SUPER):
+                    ssos = [sso for t, sso, _ in found if t == token_type.value]
+                    if ssos:
+                        await token_manager.delete_token(ssos, token_type)
+
+            self._totals["archived"] += len(found)
+            self._last_sweep = {
+                "finished_at": now,
+                "archived": len(found),
+                "expired": sum(1 for *_, reason in found if reason == REASON_EXPIRED),
+                "zero_quota": sum(1 for *_, reason in found if reason == REASON_ZERO),
+                "duration_ms": round((time.monotonic() - t0) * 1000, 2),
+            }
+            if found:
+                logger.info(f"[Archive] 已归档 {len(found)} 个Token（失效{self._last_sweep['expired']} / 0次数{self._last_sweep['zero_quota']}）")
+            return len(found)
+
+    # === 浏览 / 恢复 / 清除 ===
+
+    async def browse(
+        self,
+        page: int = 1,
+        page_size: int = 20,
+        search: Optional[str] = None,
+        token_type: Optional[str] = None,
+        reason: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """分页浏览归档（按归档时间倒序），返回 (条目, 总数)"""
+        archive = await self._storage().load_token_archive()
+        items = []
+        for sso, entry in archive.items():
+            if token_type and entry.get("type") != token_type:
+                continue
+            if reason and entry.get("reason") != reason:
+                continue
+            if search and search not in sso and search not in (entry.get("data") or {}).get("note", ""):
+                continue
+            items.append({"token": sso, **entry})
+        items.sort(key=lambda item: item.get("archivedAt") or 0, reverse=True)
+
+        page, page_size = max(1, page), max(1, page_size)
+        start = (page - 1) * page_size
+        return items[start:start + page_size], len(items)
+
+    async def revive(self, ssos: Iterable[str]) -> int:
+        """将归档Token恢复到热数据（重置为可用、配额未知，由对账/刷新重新拉取），返回恢复数"""
+        ssos = list(dict.fromkeys(ssos))
+        if not ssos:
+            return 0
+        async with self._lock:
+            entries = await self._storage().load_token_archive(ssos)
+            revived = []
+            for sso, entry in entries.items():
+                token_type = entry.get("type")
+                if token_type not in (TokenType.NORMAL.value, TokenType.SUPER.value):
+                    continue
+                owner, _ = token_manager._find_token(sso)
+                if owner is None:
+                    data = dict(entry.get("data") or {})
+                    data.pop("expiredTime", None)
+                    data.update({
+                        "status": "active",
+                        "remainingQueries": -1,
+                        "heavyremainingQueries": -1,
+                        "failedCount": 0,
+                        "zeroCount": 0,
+                        "lastFailureTime": None,
+                        "lastFailureReason": None,
+                        "cooldownUntil": None,
+                        "cooldownReason": None,
+                        "cooldownCount": 0,
+                    })
+                    token_manager.token_data[token_type][sso] = data
+                    token_manager._sync_index(sso)
+                    token_manager._mark_dirty(sso)
+                revived.append(sso)
+
+            # 先写热数据再移出归档：即使删除失败也不会丢失Token
+            await token_manager._flush()
+            await self._storage().save_token_archive({sso: None for sso in revived})
+            self._totals["revived"] += len(revived)
+            logger.info(f"[Archive] 已恢复 {len(revived)} 个Token")
+            return len(revived)
+
+    async def purge(self, ssos: Optional[Iterable[str]] = None) -> int:
+        """永久删除归档Token（ssos为None时清空归档），返回删除数"""
+        async with self._lock:
+            if ssos is None:
+                ssos = list(await self._storage().load_token_archive())
+            else:
+                ssos = list(await self._storage().load_token_archive(ssos))
+            await self._storage().save_token_archive({sso: None for sso in ssos})
+            self._totals["purged"] += len(ssos)
+            logger.info(f"[Archive] 已清除 {len(ssos)} 个归档Token")
+            return len(ssos)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """归档统计（本进程）"""
+        return {"last_sweep": self._last_sweep, **self._totals}
+
+
+# 全局实例
+token_archive = TokenArchive()
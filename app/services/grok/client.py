@@ -2,17 +2,24 @@
 
 import asyncio
 import orjson
-from typing import Dict, List, Tuple, Any, Optional
+from typing import AsyncGenerator, Dict, List, Tuple, Any, Optional
 from curl_cffi import requests as curl_requests
+from curl_cffi.requests import AsyncSession
 
 import time
 
 from app.core.config import setting
 from app.core.logger import logger
+from app.core.session_pool import session_pool
+from app.core.breaker import circuit_breakers, CHAT, IGNORE, PROXY_FAILURE
+from app.core.deadline import request_deadline, DeadlineExceeded
+from app.core.limiter import concurrency_limiter
+from app.core.retry import retry_engine, Retryable, RetryState, FORBIDDEN, TLS, TOKEN
 from app.models.grok_models import Models
 from app.services.grok.processer import GrokResponseProcessor
 from app.services.grok.statsig import get_dynamic_headers
 from app.services.grok.token import token_manager
+from app.services.grok.quota import quota_manager
 from app.services.grok.upload import ImageUploadManager
 from app.services.grok.create import PostCreateManager
 from app.core.exception import GrokApiException
@@ -23,7 +30,6 @@ from app.services.call_log import call_log_service
 API_ENDPOINT = "https://grok.com/rest/app-chat/conversations/new"
 TIMEOUT = 120
 BROWSER = "chrome133a"
-MAX_RETRY = 3
 MAX_UPLOADS = 20  # 提高并发上传限制以支持更高并发
 
 
@@ -51,8 +57,12 @@ class GrokClient:
         return GrokClient._upload_sem
 
     @staticmethod
-    async def openai_to_grok(request: dict):
-        """转换OpenAI请求为Grok请求"""
+    async def openai_to_grok(request: dict, timeout: Optional[float] = None):
+        """转换OpenAI请求为Grok请求
+
+        Args:
+            timeout: 客户端指定的请求总时长（秒），为空时按模型默认值
+        """
         model = request["model"]
         content, images = GrokClient._extract_content(request["messages"])
         stream = request.get("stream", False)
@@ -67,9 +77,20 @@ class GrokClient:
             logger.warning(f"[Client] 视频模型仅支持1张图片，已截取前1张")
             images = images[:1]
 
-        return await GrokClient._retry(
-            model, content, images, grok_model, mode, is_video, stream
-        )
+        with request_deadline.scope(request_deadline.resolve(model, timeout)):
+            # 自适应并发限制：名额随流式响应结束归还
+            started = await concurrency_limiter.acquire()
+            try:
+                result = await GrokClient._retry(
+                    model, content, images, grok_model, mode, is_video, stream
+                )
+            except BaseException:
+                concurrency_limiter.release(started)
+                raise
+            if stream:
+                return concurrency_limiter.release_after(result, started)
+            concurrency_limiter.release(started)
+            return result
 
     @staticmethod
     async def _retry(
@@ -81,21 +102,20 @@ class GrokClient:
         is_video: bool,
         stream: bool,
     ):
-        """重试请求"""
+        """换Token重试请求（仅 retry_status_codes 中的Token级错误，网络层重试在 _request 内）"""
         from app.core.proxy_pool import proxy_pool
 
-        last_err = None
         start_time = time.time()
-        sso_token = ""
-        proxy_used = ""
+        used = {"sso": "", "proxy": ""}  # 最近一次尝试的Token与代理（日志用）
 
-        for i in range(MAX_RETRY):
+        async def attempt(state: RetryState):
+            request_deadline.check("选择Token")
+            token = await token_manager.acquire_token(model)  # 当前持有的Token租约
             try:
-                token = token_manager.get_token(model)
-                sso_token = token_manager._extract_sso(token) or ""
+                used["sso"] = token_manager._extract_sso(token) or ""
 
                 # 获取当前使用的代理
-                proxy_used = await proxy_pool.get_proxy_for_sso(sso_token) or ""
+                used["proxy"] = await proxy_pool.get_proxy_for_sso(used["sso"]) or ""
 
                 img_ids, img_uris = await GrokClient._upload(images, token)
 
@@ -112,93 +132,68 @@ class GrokClient:
                 result = await GrokClient._request(
                     payload, token, model, stream, post_id
                 )
-                media_urls = []
-                if not stream and isinstance(result, tuple):
-                    result, media_urls = result
-
-                # 记录成功日志
-                response_time = time.time() - start_time
-                asyncio.create_task(
-                    call_log_service.record_call(
-                        sso=sso_token,
-                        model=model,
-                        success=True,
-                        status_code=200,
-                        response_time=response_time,
-                        proxy_used=proxy_used,
-                        media_urls=media_urls,
-                    )
-                )
-
-                # 标记代理成功
-                if proxy_used:
-                    proxy_pool.mark_success(proxy_used)
-
+                if stream:
+                    # 租约随流结束（或被取消）释放
+                    result = GrokClient._release_after(result, token)
+                    token = None
                 return result
 
             except GrokApiException as e:
-                last_err = e
-                # 检查是否可重试
-                if e.error_code not in ["HTTP_ERROR", "NO_AVAILABLE_TOKEN"]:
-                    # 记录失败日志
-                    response_time = time.time() - start_time
-                    status = e.context.get("status", 0) if e.context else 0
-                    asyncio.create_task(
-                        call_log_service.record_call(
-                            sso=sso_token,
-                            model=model,
-                            success=False,
-                            status_code=status,
-                            response_time=response_time,
-                            error_message=str(e),
-                            proxy_used=proxy_used,
-                        )
-                    )
-                    raise
-
-                status = e.context.get("status") if e.context else None
+                status = GrokClient._error_status(e)
                 retry_codes = setting.grok_config.get("retry_status_codes", [401, 429])
+                if e.error_code == "HTTP_ERROR" and status in retry_codes:
+                    raise Retryable(TOKEN, f"失败(状态:{status})", error=e) from e
+                raise
+            finally:
+                if token:
+                    token_manager.release_token(token)
 
-                if status not in retry_codes:
-                    # 记录失败日志
-                    response_time = time.time() - start_time
-                    asyncio.create_task(
-                        call_log_service.record_call(
-                            sso=sso_token,
-                            model=model,
-                            success=False,
-                            status_code=status or 0,
-                            response_time=response_time,
-                            error_message=str(e),
-                            proxy_used=proxy_used,
-                        )
-                    )
-                    raise
+        try:
+            result = await retry_engine.run("chat", attempt)
+        except Exception as e:
+            # 记录失败日志
+            asyncio.create_task(
+                call_log_service.record_call(
+                    sso=used["sso"],
+                    model=model,
+                    success=False,
+                    status_code=GrokClient._error_status(e) or 0,
+                    response_time=time.time() - start_time,
+                    error_message=str(e) or "请求失败",
+                    proxy_used=used["proxy"],
+                )
+            )
+            raise
 
-                if i < MAX_RETRY - 1:
-                    logger.warning(
-                        f"[Client] 失败(状态:{status}), 重试 {i + 1}/{MAX_RETRY}"
-                    )
-                    await asyncio.sleep(0.5)
+        media_urls = []
+        if not stream and isinstance(result, tuple):
+            result, media_urls = result
 
-        # 记录最终失败日志
-        response_time = time.time() - start_time
-        status = (
-            last_err.context.get("status", 0) if last_err and last_err.context else 0
-        )
+        # 记录成功日志
         asyncio.create_task(
             call_log_service.record_call(
-                sso=sso_token,
+                sso=used["sso"],
                 model=model,
-                success=False,
-                status_code=status,
-                response_time=response_time,
-                error_message=str(last_err) if last_err else "请求失败",
-                proxy_used=proxy_used,
+                success=True,
+                status_code=200,
+                response_time=time.time() - start_time,
+                proxy_used=used["proxy"],
+                media_urls=media_urls,
             )
         )
 
-        raise last_err or GrokApiException("请求失败", "REQUEST_ERROR")
+        # 标记代理成功
+        if used["proxy"]:
+            proxy_pool.mark_success(used["proxy"])
+
+        return result
+
+    @staticmethod
+    def _error_status(e: Exception) -> Optional[int]:
+        """GrokApiException 中的上游状态码"""
+        if not isinstance(e, GrokApiException):
+            return None
+        return (e.context or e.details or {}).get("status")
 
     @staticmethod
     def _extract_content(messages: List[Dict]) -> Tuple[str, List[str]]:
@@ -233,9 +228,12 @@ class GrokClient:
         results = await asyncio.gather(
             *[upload_limited(u) for u in urls], return_exceptions=True
         )
+        request_deadline.check("上传图片")
 
         ids, uris = [], []
         for url, result in zip(urls, results):
+            if isinstance(result, GrokApiException):
+                raise result  # 上传熔断等：整个请求失败（503），不带着缺失的图片继续
             if isinstance(result, Exception):
                 logger.warning(f"[Client] 上传失败: {url} - {result}")
             elif isinstance(result, tuple) and len(result) == 2:
@@ -253,6 +251,8 @@ class GrokClient:
             result = await PostCreateManager.create(file_id, file_uri, token)
             if result and result.get("success"):
                 return result.get("post_id")
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.warning(f"[Client] 创建会话失败: {e}")
         return None
@@ -314,173 +314,181 @@ class GrokClient:
     async def _request(
         payload: dict, token: str, model: str, stream: bool, post_id: str = None
     ):
-        """发送请求"""
+        """发送请求（403换代理与TLS瞬断由重试引擎重试，状态码错误交给 _retry 换Token）"""
         if not token:
             raise GrokApiException("认证令牌缺失", "NO_AUTH_TOKEN")
         sso_token = token_manager._extract_sso(token) or ""
         from app.core.proxy_pool import proxy_pool
 
-        # 外层重试：可配置状态码（401/429等）
-        retry_codes = setting.grok_config.get("retry_status_codes", [401, 429])
-        MAX_OUTER_RETRY = 3
-        MAX_TLS_RETRY = int(setting.grok_config.get("max_tls_retries", 2))
-
-        for outer_retry in range(MAX_OUTER_RETRY + 1):  # +1确保实际重试3次
-            # 内层重试：403代理池重试
-            max_403_retries = 5
-            retry_403_count = 0
-            tls_retry_count = 0
-
-            while retry_403_count <= max_403_retries:
-                proxy = None
-                try:
-                    # 构建请求
-                    headers = GrokClient._build_headers(token)
-                    if model == "grok-imagine-0.9":
-                        file_attachments = payload.get("fileAttachments", [])
-                        ref_id = post_id or (
-                            file_attachments[0] if file_attachments else ""
-                        )
-                        if ref_id:
-                            headers["Referer"] = f"https://grok.com/imagine/{ref_id}"
-
-                    # 异步获取代理
-                    # 如果是403重试且使用代理池，强制刷新代理
-                    if retry_403_count > 0 and proxy_pool._enabled:
-                        logger.info(
-                            f"[Client] 403重试 {retry_403_count}/{max_403_retries}，刷新代理..."
-                        )
-                        if sso_token:
-                            proxy = await proxy_pool.get_proxy_for_sso(sso_token)
-                        else:
-                            proxy = await proxy_pool.force_refresh()
-                    else:
-                        proxy = (
-                            await proxy_pool.get_proxy_for_sso(sso_token)
-                            if sso_token
-                            else await setting.get_proxy_async("service")
-                        )
+        async def attempt(state: RetryState):
+            proxy = None
+            permit = None  # 熔断登记（接口熔断中直接抛出 CircuitOpenError）
+            try:
+                # 构建请求
+                headers = GrokClient._build_headers(token)
+                if model == "grok-imagine-0.9":
+                    file_attachments = payload.get("fileAttachments", [])
+                    ref_id = post_id or (
+                        file_attachments[0] if file_attachments else ""
+                    )
+                    if ref_id:
+                        headers["Referer"] = f"https://grok.com/imagine/{ref_id}"
 
-                    # 检查是否使用 Cloudflare Workers 代理
-                    import os
+                # 异步获取代理（403重试时换代理）
+                proxy = await proxy_pool.get_request_proxy(
+                    sso_token, rotate=state.count(FORBIDDEN) > 0
+                )
 
-                    proxy_url = os.getenv("PROXY_URL")
-                    api_endpoint = API_ENDPOINT
+                # 检查是否使用 Cloudflare Workers 代理
+                import os
 
-                    if proxy_url:
-                        # 使用 Workers 代理：替换域名，不使用 proxies 参数
-                        api_endpoint = proxy_url + "/v1/rest/app-chat/conversations/new"
-                        proxies = None
-                        logger.debug(
-                            f"[Client] 使用 Cloudflare Workers 代理: {proxy_url}"
-                        )
-                    else:
-                        # 使用传统代理
-                        proxies = {"http": proxy, "https": proxy} if proxy else None
+                proxy_url = os.getenv("PROXY_URL")
+                api_endpoint = API_ENDPOINT
 
-                    # 执行请求
-                    response = await asyncio.to_thread(
-                        curl_requests.post,
+                if proxy_url:
+                    # 使用 Workers 代理：替换域名，不使用 proxies 参数
+                    api_endpoint = proxy_url + "/v1/rest/app-chat/conversations/new"
+                    session_proxy = None
+                    logger.debug(
+                        f"[Client] 使用 Cloudflare Workers 代理: {proxy_url}"
+                    )
+                else:
+                    # 使用传统代理
+                    session_proxy = proxy
+
+                # 执行请求（原生异步流式，复用池化会话）
+                permit = circuit_breakers.permit(CHAT, proxy)
+                session = await session_pool.acquire(session_proxy, BROWSER)
+                sent = time.monotonic()
+                try:
+                    response = await session.post(
                         api_endpoint,
                         headers=headers,
                         data=orjson.dumps(payload),
-                        impersonate=BROWSER,
-                        timeout=TIMEOUT,
+                        timeout=request_deadline.bound(GrokClient._stream_timeout(), "上游请求"),
                         stream=True,
-                        proxies=proxies,
                     )
+                except BaseException:
+                    session_pool.release(session)
+                    raise
 
-                    # 内层403重试：仅当有代理池时触发
-                    if response.status_code == 403 and proxy_pool._enabled:
-                        if proxy:
-                            proxy_pool.mark_failure(proxy)
-                        retry_403_count += 1
-
-                        if retry_403_count <= max_403_retries:
-                            logger.warning(
-                                f"[Client] 遇到403错误，正在重试 ({retry_403_count}/{max_403_retries})..."
-                            )
-                            await asyncio.sleep(0.5)
-                            continue
-
-                        # 内层重试全部失败
-                        logger.error(
-                            f"[Client] 403错误，已重试{retry_403_count - 1}次，放弃"
-                        )
-
-                    # 检查可配置状态码错误 - 外层重试
-                    if response.status_code in retry_codes:
-                        if outer_retry < MAX_OUTER_RETRY:
-                            delay = (
-                                outer_retry + 1
-                            ) * 0.1  # 渐进延迟：0.1s, 0.2s, 0.3s
-                            logger.warning(
-                                f"[Client] 遇到{response.status_code}错误，外层重试 ({outer_retry + 1}/{MAX_OUTER_RETRY})，等待{delay}s..."
-                            )
-                            await asyncio.sleep(delay)
-                            break  # 跳出内层循环，进入外层重试
-                        else:
-                            logger.error(
-                                f"[Client] {response.status_code}错误，已重试{outer_retry}次，放弃"
-                            )
-                            GrokClient._handle_error(response, token)
-
-                    # 检查响应状态
-                    if response.status_code != 200:
-                        GrokClient._handle_error(response, token)
-
-                    # 成功 - 重置失败计数
-                    asyncio.create_task(token_manager.reset_failure(token))
-
-                    # 如果是重试成功，记录日志
-                    if outer_retry > 0 or retry_403_count > 0:
-                        logger.info(f"[Client] 重试成功！")
-
-                    # 处理响应
-                    result = (
-                        GrokResponseProcessor.process_stream(response, token)
-                        if stream
-                        else await GrokResponseProcessor.process_normal(
+                if response.status_code != 200:
+                    # 读取错误响应体后归还会话
+                    try:
+                        response.content = await response.acontent()
+                    except Exception:
+                        pass
+                    finally:
+                        session_pool.release(session)
+
+                # 首字节延迟与429/403用于调整并发上限与代理选择
+                connect, ttfb = session_pool.timings(response, time.monotonic() - sent)
+                concurrency_limiter.observe(response.status_code, ttfb)
+                proxy_pool.observe(proxy, response.status_code, ttfb, connect)
+
+                # 上游整体降级时不归咎于代理
+                blame = permit.record_status(response.status_code)
+
+                # 403：仅当有代理池时换代理重试
+                if response.status_code == 403 and proxy_pool._enabled:
+                    if proxy and blame:
+                        proxy_pool.mark_failure(proxy)
+                    raise Retryable(FORBIDDEN, "遇到403错误", response=response)
+
+                # 检查响应状态
+                if response.status_code != 200:
+                    GrokClient._handle_error(response, token, model)
+
+                # 成功 - 重置失败计数
+                asyncio.create_task(token_manager.reset_failure(token))
+
+                # 处理响应
+                if stream:
+                    result = GrokClient._stream_response(
+                        session, response, token, request_deadline.get()
+                    )
+                else:
+                    try:
+                        result = await GrokResponseProcessor.process_normal(
                             response, token, model
                         )
-                    )
+                    finally:
+                        session_pool.release(session)
 
-                    asyncio.create_task(GrokClient._update_limits(token, model))
-                    return result
+                # 本地扣减配额（按需后台对账，不再每次请求调用rate-limits）
+                quota_manager.consume(token, model)
+                return result
 
-                except curl_requests.RequestsError as e:
-                    err_text = str(e)
-                    is_tls = any(
-                        hint in err_text for hint in GrokClient._TLS_ERROR_HINTS
-                    )
-                    if is_tls and tls_retry_count < MAX_TLS_RETRY:
-                        tls_retry_count += 1
-                        if proxy:
-                            try:
-                                proxy_pool.mark_failure(proxy)
-                            except Exception:
-                                pass
-                        logger.warning(
-                            f"[Client] TLS/握手瞬断，重试 {tls_retry_count}/{MAX_TLS_RETRY} "
-                            f"(outer={outer_retry}/{MAX_OUTER_RETRY}, 403_retry={retry_403_count}/{max_403_retries}, proxy={'on' if proxy else 'off'}): {e}"
-                        )
-                        await asyncio.sleep(0.4 * tls_retry_count)
-                        continue
+            except curl_requests.RequestsError as e:
+                if request_deadline.remaining() == 0:
+                    # curl超时由请求截止时间截短（bound），按504返回而不是网络错误；
+                    # 客户端超时过短不是代理的问题：不计入熔断与代理评分
+                    if permit:
+                        permit.record(IGNORE)
+                    raise DeadlineExceeded("上游请求") from e
+                error = GrokApiException(f"网络错误: {e}", "NETWORK_ERROR")
+                blame = permit.record(PROXY_FAILURE) if permit else False
+                proxy_pool.observe(proxy, 0)
+                if any(hint in str(e) for hint in GrokClient._TLS_ERROR_HINTS):
+                    if proxy and blame:
+                        proxy_pool.mark_failure(proxy)
+                    raise Retryable(
+                        TLS, f"TLS/握手瞬断(proxy={'on' if proxy else 'off'})", error=error
+                    ) from e
+                logger.error(
+                    f"[Client] 网络错误(proxy={'on' if proxy else 'off'}): {e}"
+                )
+                raise error from e
+            except (GrokApiException, Retryable):
+                raise
+            except Exception as e:
+                logger.error(f"[Client] 请求错误: {e}")
+                raise GrokApiException(f"请求错误: {e}", "REQUEST_ERROR") from e
+            finally:
+                if permit:
+                    permit.record(IGNORE)  # 未分类的结束只释放半开探测名额
 
-                    logger.error(
-                        f"[Client] 网络错误(outer={outer_retry}/{MAX_OUTER_RETRY}, 403_retry={retry_403_count}/{max_403_retries}, "
-                        f"tls_retry={tls_retry_count}/{MAX_TLS_RETRY}, proxy={'on' if proxy else 'off'}): {e}"
-                    )
-                    raise GrokApiException(f"网络错误: {e}", "NETWORK_ERROR") from e
-                except GrokApiException:
-                    # 重新抛出GrokApiException（包括403错误）
-                    raise
-                except Exception as e:
-                    logger.error(f"[Client] 请求错误: {e}")
-                    raise GrokApiException(f"请求错误: {e}", "REQUEST_ERROR") from e
+        try:
+            return await retry_engine.run("chat.request", attempt)
+        except Retryable as e:
+            # 403重试全部失败
+            GrokClient._handle_error(e.response, token, model)
+
+    @staticmethod
+    def _stream_timeout() -> Optional[float]:
+        """curl层超时：流式读取由StreamTimeoutManager按首次/数据块/总超时控制，这里只兜底"""
+        total = setting.grok_config.get("stream_total_timeout", 600)
+        return max(TIMEOUT, total + 5) if total and total > 0 else None
 
-        # 理论上不应该到这里，但以防万一
-        raise GrokApiException("请求失败：已达到最大重试次数", "MAX_RETRIES_EXCEEDED")
+    @staticmethod
+    async def _stream_response(
+        session: AsyncSession, response, token: str, deadline: Optional[float] = None
+    ) -> AsyncGenerator[str, None]:
+        """流式输出，结束或被取消时归还会话
+
+        Args:
+            deadline: 请求截止时间（流在其他任务中消费，需显式传入）
+        """
+        request_deadline.adopt(deadline)
+        try:
+            async for chunk in GrokResponseProcessor.process_stream(response, token, deadline):
+                yield chunk
+        finally:
+            session_pool.release(session)
+
+    @staticmethod
+    async def _release_after(
+        stream: AsyncGenerator[str, None], token: str
+    ) -> AsyncGenerator[str, None]:
+        """流式输出，结束或被取消时释放Token租约"""
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            try:
+                await stream.aclose()
+            finally:
+                token_manager.release_token(token)
 
     @staticmethod
     def _build_headers(token: str) -> Dict[str, str]:
@@ -499,7 +507,7 @@ class GrokClient:
         return headers
 
     @staticmethod
-    def _handle_error(response, token: str):
+    def _handle_error(response, token: str, model: Optional[str] = None):
         """处理错误"""
         if response.status_code == 403:
             msg = "您的IP被拦截，请尝试以下方法之一: 1.更换IP 2.使用代理 3.配置CF值"
@@ -516,16 +524,13 @@ class GrokClient:
         asyncio.create_task(
             token_manager.record_failure(token, response.status_code, msg)
         )
+        if response.status_code == 429 and model:
+            # 疑似配额耗尽，立即对账
+            sso = token_manager._extract_sso(token)
+            if sso:
+                quota_manager.schedule(sso, model, force=True)
         raise GrokApiException(
             f"请求失败: {response.status_code} - {msg}",
             "HTTP_ERROR",
             {"status": response.status_code, "data": data},
         )
-
-    @staticmethod
-    async def _update_limits(token: str, model: str):
-        """更新速率限制"""
-        try:
-            await token_manager.check_limits(token, model)
-        except Exception as e:
-            logger.error(f"[Client] 更新限制失败: {e}")
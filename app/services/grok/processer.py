@@ -4,9 +4,10 @@ import orjson
 import uuid
 import time
 import asyncio
-from typing import AsyncGenerator, Tuple
+from typing import AsyncGenerator, List, Optional, Tuple
 
 from app.core.config import setting
+from app.core.deadline import request_deadline, DeadlineExceeded
 from app.core.exception import GrokApiException
 from app.core.logger import logger
 from app.models.openai_schema import (
@@ -20,31 +21,63 @@ from app.models.openai_schema import (
 from app.services.grok.cache import image_cache_service, video_cache_service
 
 
+class StreamTimeoutError(Exception):
+    """流式响应超时"""
+
+    def __init__(self, message: str, deadline: bool = False):
+        super().__init__(message)
+        self.deadline = deadline  # 是否由请求截止时间触发（而非首次/数据块/总超时）
+
+
 class StreamTimeoutManager:
     """流式响应超时管理"""
     
-    def __init__(self, chunk_timeout: int = 120, first_timeout: int = 30, total_timeout: int = 600):
+    def __init__(self, chunk_timeout: int = 120, first_timeout: int = 30, total_timeout: int = 600, deadline: Optional[float] = None):
         self.chunk_timeout = chunk_timeout
         self.first_timeout = first_timeout
         self.total_timeout = total_timeout
         self.start_time = asyncio.get_event_loop().time()
+        # 请求截止时间（time.monotonic()）换算到事件循环时钟
+        self.deadline = None if deadline is None else self.start_time + (deadline - time.monotonic())
         self.last_chunk_time = self.start_time
         self.first_received = False
-    
-    def check_timeout(self) -> Tuple[bool, str]:
-        """检查超时"""
-        now = asyncio.get_event_loop().time()
-        
-        if not self.first_received and now - self.start_time > self.first_timeout:
-            return True, f"首次响应超时({self.first_timeout}秒)"
-        
-        if self.total_timeout > 0 and now - self.start_time > self.total_timeout:
-            return True, f"总超时({self.total_timeout}秒)"
-        
-        if self.first_received and now - self.last_chunk_time > self.chunk_timeout:
-            return True, f"数据块超时({self.chunk_timeout}秒)"
-        
-        return False, ""
+
+    def _limits(self) -> List[Tuple[float, str]]:
+        """当前生效的各个截止时刻（事件循环时钟）及超时说明"""
+        limits = []
+        if not self.first_received:
+            if self.first_timeout > 0:
+                limits.append((self.start_time + self.first_timeout, f"首次响应超时({self.first_timeout}秒)"))
+        elif self.chunk_timeout > 0:
+            limits.append((self.last_chunk_time + self.chunk_timeout, f"数据块超时({self.chunk_timeout}秒)"))
+
+        if self.total_timeout > 0:
+            limits.append((self.start_time + self.total_timeout, f"总超时({self.total_timeout}秒)"))
+
+        if self.deadline is not None:
+            limits.append((self.deadline, "已超过请求截止时间"))
+        return limits
+
+    def remaining(self) -> Optional[float]:
+        """距离最近一个截止时间的剩余秒数（None表示不限）"""
+        limits = self._limits()
+        if not limits:
+            return None
+        return max(0.0, min(limits)[0] - asyncio.get_event_loop().time())
+
+    async def aiter_lines(self, response) -> AsyncGenerator[bytes, None]:
+        """按行读取响应，每行等待都受首次/数据块/总超时约束"""
+        lines = response.aiter_lines()
+        while True:
+            try:
+                line = await asyncio.wait_for(lines.__anext__(), self.remaining())
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                # 等待时长取自最近的截止时刻，触发的就是它
+                when, msg = min(self._limits())
+                raise StreamTimeoutError(msg, deadline=when == self.deadline)
+            yield line
     
     def mark_received(self):
         """标记收到数据"""
@@ -62,9 +95,9 @@ class GrokResponseProcessor:
     @staticmethod
     async def process_normal(response, auth_token: str, model: str = None) -> Tuple[OpenAIChatCompletionResponse, list]:
         """处理非流式响应"""
-        response_closed = False
+        timeout_mgr = GrokResponseProcessor._timeout_manager(request_deadline.get())
         try:
-            for chunk in response.iter_lines():
+            async for chunk in timeout_mgr.aiter_lines(response):
                 if not chunk:
                     continue
 
@@ -79,6 +112,8 @@ class GrokResponseProcessor:
                     )
 
                 grok_resp = data.get("result", {}).get("response", {})
+                if grok_resp:
+                    timeout_mgr.mark_received()
                 
                 media_urls = []
                 # 视频响应
@@ -87,8 +122,6 @@ class GrokResponseProcessor:
                         media_urls = [f"https://assets.grok.com/{video_url}" if not str(video_url).startswith("http") else video_url]
                         content = await GrokResponseProcessor._build_video_content(video_url, auth_token)
                         result = GrokResponseProcessor._build_response(content, model or "grok-imagine-0.9")
-                        response_closed = True
-                        response.close()
                         return result, media_urls
 
                 # 模型响应
@@ -112,12 +145,17 @@ class GrokResponseProcessor:
                     content = await GrokResponseProcessor._append_images(content, images, auth_token)
 
                 result = GrokResponseProcessor._build_response(content, model_name)
-                response_closed = True
-                response.close()
                 return result, media_urls
 
             raise GrokApiException("无响应数据", "NO_RESPONSE")
 
+        except StreamTimeoutError as e:
+            logger.warning(f"[Processor] {e}")
+            if e.deadline or request_deadline.remaining() == 0:
+                raise DeadlineExceeded("读取响应") from e
+            raise GrokApiException(f"响应超时: {e}", "STREAM_ERROR") from e
+        except GrokApiException:
+            raise
         except orjson.JSONDecodeError as e:
             logger.error(f"[Processor] JSON解析失败: {e}")
             raise GrokApiException(f"JSON解析失败: {e}", "JSON_ERROR") from e
@@ -125,15 +163,15 @@ class GrokResponseProcessor:
             logger.error(f"[Processor] 处理错误: {type(e).__name__}: {e}")
             raise GrokApiException(f"响应处理错误: {e}", "PROCESS_ERROR") from e
         finally:
-            if not response_closed and hasattr(response, 'close'):
-                try:
-                    response.close()
-                except Exception as e:
-                    logger.warning(f"[Processor] 关闭响应失败: {e}")
+            await GrokResponseProcessor.close_response(response)
 
     @staticmethod
-    async def process_stream(response, auth_token: str) -> AsyncGenerator[str, None]:
-        """处理流式响应"""
+    async def process_stream(response, auth_token: str, deadline: Optional[float] = None) -> AsyncGenerator[str, None]:
+        """处理流式响应
+
+        Args:
+            deadline: 请求截止时间（time.monotonic()）
+        """
         # 状态变量
         is_image = False
         is_thinking = False
@@ -142,15 +180,10 @@ class GrokResponseProcessor:
         filtered_tags = setting.grok_config.get("filtered_tags", "").split(",")
         video_progress_started = False
         last_video_progress = -1
-        response_closed = False
         show_thinking = setting.grok_config.get("show_thinking", True)
 
         # 超时管理
-        timeout_mgr = StreamTimeoutManager(
-            chunk_timeout=setting.grok_config.get("stream_chunk_timeout", 120),
-            first_timeout=setting.grok_config.get("stream_first_response_timeout", 30),
-            total_timeout=setting.grok_config.get("stream_total_timeout", 600)
-        )
+        timeout_mgr = GrokResponseProcessor._timeout_manager(deadline)
 
         def make_chunk(content: str, finish: str = None):
             """生成响应块"""
@@ -170,15 +203,7 @@ class GrokResponseProcessor:
             return f"data: {chunk_data.model_dump_json()}\n\n"
 
         try:
-            for chunk in response.iter_lines():
-                # 超时检查
-                is_timeout, timeout_msg = timeout_mgr.check_timeout()
-                if is_timeout:
-                    logger.warning(f"[Processor] {timeout_msg}")
-                    yield make_chunk("", "stop")
-                    yield "data: [DONE]\n\n"
-                    return
-
+            async for chunk in timeout_mgr.aiter_lines(response):
                 logger.debug(f"[Processor] 收到数据块: {len(chunk)} bytes")
                 if not chunk:
                     continue
@@ -351,17 +376,40 @@ class GrokResponseProcessor:
             yield "data: [DONE]\n\n"
             logger.info(f"[Processor] 流式完成，耗时: {timeout_mgr.duration():.2f}秒")
 
+        except StreamTimeoutError as e:
+            logger.warning(f"[Processor] {e}")
+            yield make_chunk("", "stop")
+            yield "data: [DONE]\n\n"
         except Exception as e:
             logger.error(f"[Processor] 严重错误: {e}")
             yield make_chunk(f"处理错误: {e}", "error")
             yield "data: [DONE]\n\n"
         finally:
-            if not response_closed and hasattr(response, 'close'):
-                try:
-                    response.close()
-                    logger.debug("[Processor] 响应已关闭")
-                except Exception as e:
-                    logger.warning(f"[Processor] 关闭失败: {e}")
+            await GrokResponseProcessor.close_response(response)
+
+    @staticmethod
+    def _timeout_manager(deadline: Optional[float] = None) -> StreamTimeoutManager:
+        """按配置创建超时管理器（同时受请求截止时间约束）"""
+        return StreamTimeoutManager(
+            chunk_timeout=setting.grok_config.get("stream_chunk_timeout", 120),
+            first_timeout=setting.grok_config.get("stream_first_response_timeout", 30),
+            total_timeout=setting.grok_config.get("stream_total_timeout", 600),
+            deadline=deadline
+        )
+
+    @staticmethod
+    async def close_response(response) -> None:
+        """关闭流式响应（不等待上游把剩余数据发完）"""
+        try:
+            if quit_now := getattr(response, "quit_now", None):
+                quit_now.set()
+            task = getattr(response, "astream_task", None)
+            if task is not None and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            logger.debug("[Processor] 响应已关闭")
+        except Exception as e:
+            logger.warning(f"[Processor] 关闭失败: {e}")
 
     @staticmethod
     async def _build_video_content(video_url: str, auth_token: str) -> str:
@@ -0,0 +1,266 @@
+"""配额记账 - 本地按模型倍率扣减剩余次数，后台合并队列按需对账 rate-limits"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple
+
+from app.core.config import setting
+from app.core.logger import logger
+from app.models.grok_models import Models
+from app.services.grok.scheduler import NORMAL_FIELD, HEAVY_FIELD
+from app.services.grok.token import token_manager
+
+
+# 常量
+HEAVY_MODEL = "grok-4-heavy"
+STATS_WINDOW = 300  # 对账速率统计窗口（秒）
+
+
+@dataclass
+class RateModelStats:
+    """单个 rate_limit_model 的统计"""
+    requests: int = 0  # 本地记账请求数
+    consumed: int = 0  # 本地扣减的次数（含倍率）
+    reconciles: int = 0  # 实际对账次数
+    drift_samples: int = 0  # 有效漂移样本数
+    drift_abs_total: int = 0  # 漂移绝对值累计
+    drift_max: int = 0  # 最大漂移（绝对值）
+    last_drift: Optional[int] = None  # 最近一次漂移（本地估算 - 真实值）
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "consumed": self.consumed,
+            "reconciles": self.reconciles,
+            "reconcile_ratio": round(self.reconciles / self.requests, 4) if self.requests else 0.0,
+            "avg_abs_drift": round(self.drift_abs_total / self.drift_samples, 2) if self.drift_samples else 0.0,
+            "max_abs_drift": self.drift_max,
+            "last_drift": self.last_drift,
+        }
+
+
+class QuotaManager:
+    """配额记账与对账
+
+    每次成功请求按 `_MODEL_CONFIG["cost"]["multiplier"]` 在本地扣减剩余次数，
+    仅在疑似漂移（累计本地扣减过多）、配额未知或即将耗尽时，
+    把 (Token, rate_limit_model) 放入合并队列；同一 Token 在对账窗口内最多对账一次。
+    """
+
+    def __init__(self):
+        # (sso, rate_model) -> 自上次对账以来本地扣减次数
+        self._usage: Dict[Tuple[str, str], int] = {}
+        # sso -> 上次对账时间
+        self._last_reconcile: Dict[str, float] = {}
+        # 合并队列：(sso, rate_model) -> (模型名, 是否强制)
+        self._pending: "OrderedDict[Tuple[str, str], Tuple[str, bool]]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._shutdown = False
+
+        self._stats: Dict[str, RateModelStats] = {}
+        self._coalesced = 0  # 已在队列中被合并的对账请求数
+        self._failures = 0  # 对账失败次数
+        self._recent: deque[float] = deque()  # 最近对账时间戳（计算速率）
+
+    # === 记账 ===
+
+    def consume(self, auth_token: str, model: str) -> None:
+        """成功请求后本地扣减配额，必要时排队对账"""
+        sso = token_manager._extract_sso(auth_token)
+        if not sso:
+            return
+
+        info = Models.get_model_info(model)
+        cost = int((info.get("cost") or {}).get("multiplier", 1) or 1) if info else 1
+        rate_model = Models.to_rate_limit(model)
+        field = HEAVY_FIELD if model == HEAVY_MODEL else NORMAL_FIELD
+
+        stats = self._stats.setdefault(rate_model, RateModelStats())
+        stats.requests += 1
+        stats.consumed += cost
+
+        key = (sso, rate_model)
+        used = self._usage.get(key, 0) + cost
+        self._usage[key] = used
+
+        remaining = token_manager.consume_quota(sso, field, cost)
+
+        cfg = setting.global_config
+        if remaining is None:
+            return  # Token已被删除
+        if remaining == -1:
+            self.schedule(sso, model)  # 配额未知，拉取真实值
+        elif remaining <= int(cfg.get("quota_reconcile_low_water", 5)):
+            self.schedule(sso, model)  # 即将耗尽
+        elif used >= int(cfg.get("quota_reconcile_every", 20)):
+            self.schedule(sso, model)  # 本地累计扣减过多，可能漂移
+
+    def schedule(self, sso: str, model: str, force: bool = False) -> None:
+        """放入合并队列（同一Token同一rate_model只保留一条）
+
+        Args:
+            force: 忽略对账窗口（如上游返回429时）
+        """
+        key = (sso, Models.to_rate_limit(model))
+        if key in self._pending:
+            self._coalesced += 1
+            _, pending_force = self._pending[key]
+            self._pending[key] = (model, pending_force or force)
+            return
+        self._pending[key] = (model, force)
+        self._wakeup.set()
+
+    # === 对账 ===
+
+    async def start(self) -> None:
+        """启动对账任务"""
+        if self._task is None:
+            self._shutdown = False
+            self._task = asyncio.create_task(self._reconcile_worker())
+            logger.info("[Quota] 对账任务已创建")
+
+    async def shutdown(self) -> None:
+        """停止对账任务"""
+        self._shutdown = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _reconcile_worker(self) -> None:
+        """消费合并队列，窗口未到的条目延后处理"""
+        logger.info("[Quota] 对账任务已启动")
+        while not self._shutdown:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            window = float(setting.global_config.get("quota_reconcile_window", 60) or 0)
+            concurrency = max(1, int(setting.global_config.get("quota_reconcile_concurrency", 4) or 1))
+            now = time.monotonic()
+
+            due, next_due = [], None
+            for key, (model, force) in list(self._pending.items()):
+                if any(key[0] == k[0] for k, _ in due):
+                    continue  # 同一Token本轮只对账一次
+                ready_at = self._last_reconcile.get(key[0], 0.0) + window
+                if force or ready_at <= now:
+                    due.append((key, model))
+                    del self._pending[key]
+                    if len(due) >= concurrency:
+                        break
+                else:
+                    next_due = ready_at if next_due is None else min(next_due, ready_at)
+
+            if not due:
+                # 全部处于窗口内：睡到最早到期或有新的强制请求
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.1, (next_due or now + 1) - now))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await asyncio.gather(*[self._reconcile(key, model) for key, model in due])
+
+    async def _reconcile(self, key: Tuple[str, str], model: str) -> None:
+        """调用rate-limits接口校准一个Token"""
+        sso, rate_model = key
+        field = HEAVY_FIELD if model == HEAVY_MODEL else NORMAL_FIELD
+        _, data = token_manager._find_token(sso)
+        if data is None:
+            self._usage.pop(key, None)
+            self._last_reconcile.pop(sso, None)
+            return
+
+        before = data.get(field, -1)
+        self._last_reconcile[sso] = time.monotonic()
+        self._usage[key] = 0
+
+        try:
+            result = await token_manager.check_limits(f"sso-rw={sso};sso={sso}", model)
+        except Exception as e:
+            result = None
+            logger.error(f"[Quota] 对账异常: {sso[:10]}..., {e}")
+
+        stats = self._stats.setdefault(rate_model, RateModelStats())
+        stats.reconciles += 1
+        self._record_recent()
+
+        if result is None:
+            self._failures += 1
+            return
+
+        _, data = token_manager._find_token(sso)
+        after = data.get(field, -1) if data else -1
+        if isinstance(before, int) and isinstance(after, int) and before >= 0 and after >= 0:
+            drift = before - after
+            stats.drift_samples += 1
+            stats.drift_abs_total += abs(drift)
+            stats.drift_max = max(stats.drift_max, abs(drift))
+            stats.last_drift = drift
+            if drift:
+                logger.debug(f"[Quota] 对账漂移: {sso[:10]}..., {rate_model}, 本地{before} 实际{after}")
+
+    def _record_recent(self) -> None:
+        now = time.monotonic()
+        self._recent.append(now)
+        cutoff = now - STATS_WINDOW
+        while self._recent and self._recent[0] < cutoff:
+            self._recent.popleft()
+
+    # === 热启动 ===
+
+    def export_state(self) -> Dict[str, Any]:
+        """导出对账状态（单调时钟换算为墙钟时间）"""
+        offset = time.time() - time.monotonic()
+        return {
+            "usage": [[sso, rate_model, used] for (sso, rate_model), used in self._usage.items() if used],
+            "last_reconcile": {sso: at + offset for sso, at in self._last_reconcile.items()},
+            "pending": [[sso, rate_model, model, force] for (sso, rate_model), (model, force) in self._pending.items()],
+        }
+
+    def restore_state(self, state: Dict[str, Any]) -> None:
+        """恢复对账状态：累计扣减与对账窗口延续，未完成的对账重新排队"""
+        offset = time.time() - time.monotonic()
+        for sso, rate_model, used in state.get("usage", []):
+            self._usage[(sso, rate_model)] = self._usage.get((sso, rate_model), 0) + int(used)
+        for sso, at in state.get("last_reconcile", {}).items():
+            self._last_reconcile[sso] = max(self._last_reconcile.get(sso, 0.0), float(at) - offset)
+        for sso, rate_model, model, force in state.get("pending", []):
+            self._pending.setdefault((sso, rate_model), (model, bool(force)))
+        if self._pending:
+            self._wakeup.set()
+
+    # === 统计 ===
+
+    def get_stats(self) -> Dict[str, Any]:
+        """对账速率与漂移统计"""
+        now = time.monotonic()
+        recent = sum(1 for t in self._recent if t >= now - STATS_WINDOW)
+        requests = sum(s.requests for s in self._stats.values())
+        reconciles = sum(s.reconciles for s in self._stats.values())
+        samples = sum(s.drift_samples for s in self._stats.values())
+        drift_total = sum(s.drift_abs_total for s in self._stats.values())
+        return {
+            "requests": requests,
+            "reconciles": reconciles,
+            "reconcile_ratio": round(reconciles / requests, 4) if requests else 0.0,
+            "reconciles_per_minute": round(recent / (STATS_WINDOW / 60), 2),
+            "avg_abs_drift": round(drift_total / samples, 2) if samples else 0.0,
+            "pending": len(self._pending),
+            "coalesced": self._coalesced,
+            "failures": self._failures,
+            "models": {name: s.to_dict() for name, s in self._stats.items()},
+        }
+
+
+# 全局实例
+quota_manager = QuotaManager()
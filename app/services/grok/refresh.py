@@ -0,0 +1,215 @@
+"""Token状态刷新 - 有界并发、按代理分散、遇429自适应降速、可断点续扫"""
+
+import asyncio
+import time
+import orjson
+import aiofiles
+from collections import deque
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+
+from app.core.config import setting
+from app.core.logger import logger
+from app.models.grok_models import TokenType
+from app.services.grok.token import token_manager
+
+
+# 常量
+CHECKPOINT_FILE = Path(__file__).parents[3] / "data" / "token_refresh_state.json"
+MAX_DELAY = 10.0  # 429降速时单次检查前的最大等待（秒）
+RECOVER_STREAK = 20  # 连续成功多少次后恢复一个并发
+
+
+class TokenRefresher:
+    """Token状态刷新流水线
+
+    - 按 lastCheckTime 从旧到新排序，再按绑定代理交错，避免同一代理被集中请求
+    - 并发上限为 token_refresh_concurrency，出现429时并发减半并加入等待，连续成功后逐步恢复
+    - 扫描开始时写入检查点；进程重启后继续扫描，跳过检查点之后已刷新过的Token
+    """
+
+    def __init__(self):
+        self._running = False
+        self._limit = 1  # 当前允许的并发数
+        self._delay = 0.0  # 每次检查前的等待（秒）
+        self._streak = 0  # 连续成功次数
+        self._t0 = 0.0  # 本轮开始（monotonic）
+        self._epoch = 0  # 降速代数：同一批在途请求只触发一次降速
+        self._current: Optional[Dict[str, Any]] = None  # 进行中的扫描
+        self._last: Optional[Dict[str, Any]] = None  # 最近一次完成的扫描
+
+    # === 检查点 ===
+
+    async def _load_checkpoint(self) -> Optional[Dict[str, Any]]:
+        try:
+            if not CHECKPOINT_FILE.exists():
+                return None
+            async with aiofiles.open(CHECKPOINT_FILE, "rb") as f:
+                data = orjson.loads(await f.read())
+            return data if isinstance(data, dict) else None
+        except Exception as e:
+            logger.warning(f"[Refresh] 读取检查点失败: {e}")
+            return None
+
+    async def _save_checkpoint(self, data: Dict[str, Any]) -> None:
+        try:
+            async with aiofiles.open(CHECKPOINT_FILE, "wb") as f:
+                await f.write(orjson.dumps(data))
+        except Exception as e:
+            logger.warning(f"[Refresh] 保存检查点失败: {e}")
+
+    # === 扫描 ===
+
+    @staticmethod
+    def _plan(scope: str, since: int) -> List[Tuple[TokenType, str]]:
+        """生成本轮待检查列表：数据最旧优先，按绑定代理交错"""
+        from app.core.proxy_pool import proxy_pool
+
+        candidates = []
+        for token_type in [TokenType.NORMAL, TokenType.SUPER]:
+            for sso, data in token_manager.token_data.get(token_type.value, {}).items():
+                if scope == "expired" and data.get("status") != "expired":
+                    continue
+                checked = data.get("lastCheckTime") or 0
+                if since and checked >= since:
+                    continue  # 续扫：检查点之后已刷新
+                candidates.append((checked, token_type, sso))
+        candidates.sort(key=lambda x: x[0])
+
+        # 按代理分桶后轮流取，保持桶内从旧到新
+        assignments = proxy_pool.get_sso_assignments()
+        buckets: Dict[str, deque] = {}
+        for _, token_type, sso in candidates:
+            buckets.setdefault(assignments.get(sso, ""), deque()).append((token_type, sso))
+
+        plan = []
+        queues = list(buckets.values())
+        while queues:
+            for queue in queues:
+                plan.append(queue.popleft())
+            queues = [q for q in queues if q]
+        return plan
+
+    async def run(self, scope: str = "expired", zero_threshold: int = 3) -> None:
+        """执行一轮刷新（同一时间只允许一轮）"""
+        if self._running or not token_manager.token_data:
+            return
+
+        scope = "all" if scope == "all" else "expired"
+        threshold = max(1, int(zero_threshold or 3))
+        max_concurrency = max(1, int(setting.global_config.get("token_refresh_concurrency", 8) or 1))
+
+        # 同范围的未完成扫描：继续
+        checkpoint = await self._load_checkpoint()
+        resumed = bool(checkpoint and not checkpoint.get("finished") and checkpoint.get("scope") == scope)
+        started_at = int(checkpoint["started_at"]) if resumed else int(time.time() * 1000)
+        if not resumed:
+            await self._save_checkpoint({"started_at": started_at, "scope": scope, "finished": False})
+
+        plan = self._plan(scope, started_at if resumed else 0)
+        total = sum(len(token_manager.token_data.get(t.value, {})) for t in [TokenType.NORMAL, TokenType.SUPER])
+
+        self._running = True
+        self._limit = max_concurrency
+        self._delay = 0.0
+        self._streak = 0
+        self._t0 = t0 = time.monotonic()
+        self._current = {
+            "scope": scope,
+            "resumed": resumed,
+            "started_at": started_at,
+            "planned": len(plan),
+            "checked": 0,
+            "failed": 0,
+            "rate_limited": 0,
+        }
+        if resumed:
+            logger.info(f"[Refresh] 继续未完成的扫描: 剩余{len(plan)}个 (scope={scope})")
+
+        queue = deque(plan)
+
+        async def worker(index: int) -> None:
+            while queue:
+                # 降速后超出并发上限的worker暂停
+                if index >= self._limit:
+                    await asyncio.sleep(0.5)
+                    continue
+                token_type, sso = queue.popleft()
+                if self._delay:
+                    await asyncio.sleep(self._delay)
+                await self._check(token_type, sso, threshold, max_concurrency)
+
+        try:
+            await asyncio.gather(*[worker(i) for i in range(max_concurrency)])
+        finally:
+            self._running = False
+            duration = time.monotonic() - t0
+            current = self._current
+            current.update({
+                "duration": round(duration, 2),
+                "throughput": round(current["checked"] / duration, 2) if duration > 0 else 0.0,
+                "finished_at": int(time.time() * 1000),
+            })
+            self._last, self._current = current, None
+
+        await self._save_checkpoint({"started_at": started_at, "scope": scope, "finished": True})
+        logger.info(
+            f"[Refresh] 状态刷新完成: {current['checked']}/{total} (scope={scope}), "
+            f"耗时{current['duration']}s, {current['throughput']}个/s, 429次数{current['rate_limited']}"
+        )
+
+    async def _check(self, token_type: TokenType, sso: str, threshold: int, max_concurrency: int) -> None:
+        """检查单个Token并调整节奏"""
+        limited_before = token_manager.rate_limited_count
+        epoch = self._epoch
+        try:
+            ok = await token_manager.refresh_one(token_type, sso, threshold)
+        except Exception as e:
+            logger.warning(f"[Refresh] 刷新失败: {sso[:10]}..., {e}")
+            ok = False
+
+        current = self._current
+        if token_manager.rate_limited_count > limited_before:
+            current["rate_limited"] += 1
+            self._streak = 0
+            if epoch == self._epoch:
+                self._slow_down()
+        else:
+            # 加性增：连续成功后逐步恢复
+            self._streak += 1
+            if self._streak >= RECOVER_STREAK:
+                self._streak = 0
+                self._delay = self._delay / 2 if self._delay > 0.1 else 0.0
+                self._limit = min(max_concurrency, self._limit + 1)
+
+        if ok:
+            current["checked"] += 1
+        else:
+            current["failed"] += 1
+
+    def _slow_down(self) -> None:
+        """乘性减：并发减半并加大间隔"""
+        self._epoch += 1
+        self._limit = max(1, self._limit // 2)
+        self._delay = min(MAX_DELAY, max(0.5, self._delay * 2))
+        logger.warning(f"[Refresh] 遇到429，降速: 并发{self._limit}, 间隔{self._delay:.1f}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """扫描耗时与吞吐统计"""
+        current = None
+        if self._current:
+            elapsed = time.monotonic() - self._t0
+            current = {
+                **self._current,
+                "concurrency": self._limit,
+                "delay": self._delay,
+                "progress": round(
+                    (self._current["checked"] + self._current["failed"]) / self._current["planned"], 4
+                ) if self._current["planned"] else 1.0,
+                "elapsed": round(elapsed, 2),
+            }
+        return {"running": self._running, "current": current, "last": self._last}
+
+
+# 全局实例
+token_refresher = TokenRefresher()
@@ -0,0 +1,390 @@
+"""Token调度索引 - 按模型类别与Token类型维护优先队列，选择为 O(log n)"""
+
+import heapq
+import itertools
+import time
+from typing import Dict, Any, Optional, Tuple, List
+
+from app.models.grok_models import TokenType
+
+
+# 常量
+MAX_FAILURES = 3
+NORMAL_FIELD = "remainingQueries"
+HEAVY_FIELD = "heavyremainingQueries"
+POLICIES = ("max_remaining", "round_robin", "lru")
+DEFAULT_POLICY = "round_robin"
+
+# 需要维护的索引：(Token类型, 配额字段)
+INDEX_KEYS: Tuple[Tuple[str, str], ...] = (
+    (TokenType.NORMAL.value, NORMAL_FIELD),
+    (TokenType.SUPER.value, NORMAL_FIELD),
+    (TokenType.SUPER.value, HEAVY_FIELD),
+)
+
+
+class HeapIndex:
+    """带惰性删除的小顶堆
+
+    每次写入都带全局递增版本号，旧条目在弹出时按版本号识别并丢弃。
+    """
+
+    __slots__ = ("_heap", "_live")
+
+    def __init__(self):
+        self._heap: List[Tuple[tuple, int, str]] = []
+        self._live: Dict[str, int] = {}  # sso -> 当前有效版本号
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def __contains__(self, sso: str) -> bool:
+        return sso in self._live
+
+    def push(self, sso: str, key: tuple, version: int) -> None:
+        """写入/更新条目"""
+        self._live[sso] = version
+        heapq.heappush(self._heap, (key, version, sso))
+        self._maybe_compact()
+
+    def discard(self, sso: str) -> None:
+        """移除条目（堆中旧条目惰性清理）"""
+        self._live.pop(sso, None)
+
+    def peek(self) -> Optional[Tuple[str, tuple]]:
+        """返回堆顶有效条目"""
+        heap = self._heap
+        while heap:
+            key, version, sso = heap[0]
+            if self._live.get(sso) == version:
+                return sso, key
+            heapq.heappop(heap)
+        return None
+
+    def clear(self) -> None:
+        self._heap.clear()
+        self._live.clear()
+
+    def load(self, entries: List[Tuple[tuple, int, str]]) -> None:
+        """批量装载（O(n) 建堆）"""
+        self._heap = list(entries)
+        self._live = {sso: version for _, version, sso in entries}
+        heapq.heapify(self._heap)
+
+    def _maybe_compact(self) -> None:
+        """旧条目过多时重建，避免堆无限增长"""
+        if len(self._heap) > 2 * len(self._live) + 64:
+            self._heap = [e for e in self._heap if self._live.get(e[2]) == e[1]]
+            heapq.heapify(self._heap)
+
+
+class TokenScheduler:
+    """Token调度器
+
+    策略:
+        - max_remaining: 未使用优先，其次剩余次数最多；同分按加入顺序
+        - round_robin: 同 max_remaining，但同分时轮转（未使用的Token依次分配）
+        - lru: 最久未被分配的Token优先
+
+    冷却: 数据中 cooldownUntil（毫秒时间戳）未到期的Token不进入选择索引，
+    而是按到期时间进入冷却堆，由 pop_cooldowns 在到期时取出。
+
+    并发: 排序键以在途请求数开头，各策略都优先选择负载最低的Token；
+    在途数达到 max_in_flight（0为不限）的Token暂时移出索引，释放后放回。
+    """
+
+    def __init__(self, policy: str = DEFAULT_POLICY, max_in_flight: int = 0):
+        self.policy = policy if policy in POLICIES else DEFAULT_POLICY
+        self.max_in_flight = max(0, max_in_flight)
+        self._indexes: Dict[Tuple[str, str], HeapIndex] = {key: HeapIndex() for key in INDEX_KEYS}
+        self._saturated: Dict[Tuple[str, str], set] = {key: set() for key in INDEX_KEYS}  # 因并发上限移出索引的Token
+        self._in_flight: Dict[str, int] = {}  # sso -> 在途请求数
+        self._cooldowns = HeapIndex()  # 冷却中的Token，按到期时间排序
+        self._tokens: Dict[str, Tuple[str, Dict[str, Any]]] = {}  # sso -> (token_type, data)
+        self._order: Dict[str, int] = {}  # sso -> 加入顺序
+        self._last_pick: Dict[str, int] = {}  # sso -> 最近一次被分配的序号
+        self._order_seq = itertools.count(1)
+        self._pick_seq = itertools.count(1)
+        self._version = itertools.count(1)
+
+    # === 维护 ===
+
+    def rebuild(self, token_data: Dict[str, Dict[str, Any]]) -> None:
+        """全量重建索引"""
+        self._tokens.clear()
+        for saturated in self._saturated.values():
+            saturated.clear()
+        buckets: Dict[Tuple[str, str], List[Tuple[tuple, int, str]]] = {key: [] for key in INDEX_KEYS}
+        cooldowns: List[Tuple[tuple, int, str]] = []
+        now = int(time.time() * 1000)
+
+        for token_type in (TokenType.NORMAL.value, TokenType.SUPER.value):
+            for sso, data in (token_data.get(token_type) or {}).items():
+                self._tokens[sso] = (token_type, data)
+                if sso not in self._order:
+                    self._order[sso] = next(self._order_seq)
+                until = self._cooldown_until(data, now)
+                if until:
+                    cooldowns.append(((until,), next(self._version), sso))
+                    continue
+                for index_key in INDEX_KEYS:
+                    if index_key[0] != token_type:
+                        continue
+                    remaining = self._eligible_remaining(data, index_key[1])
+                    if remaining is None:
+                        continue
+                    if self._is_saturated(sso):
+                        self._saturated[index_key].add(sso)
+                    else:
+                        buckets[index_key].append((self._key(sso, remaining), next(self._version), sso))
+
+        for index_key, entries in buckets.items():
+            self._indexes[index_key].load(entries)
+        self._cooldowns.load(cooldowns)
+
+        # 清理已不存在的Token元数据
+        for mapping in (self._order, self._last_pick):
+            for sso in [s for s in mapping if s not in self._tokens]:
+                del mapping[sso]
+
+    def export_state(self) -> Dict[str, Any]:
+        """导出索引与轮转状态（热启动快照用）"""
+        def live(index: HeapIndex) -> List[list]:
+            return [[list(key), version, sso] for key, version, sso in index._heap if index._live.get(sso) == version]
+
+        stale = set(self._in_flight) | self.saturated_tokens()  # 排序键含在途数，恢复后需重新计算
+        return {
+            "policy": self.policy,
+            "max_in_flight": self.max_in_flight,
+            "order": self._order,
+            "last_pick": self._last_pick,
+            "order_seq": next(self._order_seq),
+            "pick_seq": next(self._pick_seq),
+            "version": next(self._version),
+            "indexes": {f"{t}:{f}": live(index) for (t, f), index in self._indexes.items()},
+            "cooldowns": live(self._cooldowns),
+            "stale": sorted(stale),
+        }
+
+    def restore_state(self, state: Dict[str, Any], token_data: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+        """恢复轮转状态；给出 token_data（须与导出时一致）时直接装载索引，否则按恢复的轮转状态重建
+
+        Args:
+            token_data: 与快照同时导出的Token数据，为None时只恢复轮转顺序
+        """
+        self._order = dict(state["order"])
+        self._last_pick = dict(state["last_pick"])
+        self._order_seq = itertools.count(int(state["order_seq"]))
+        self._pick_seq = itertools.count(int(state["pick_seq"]))
+        if token_data is None:
+            return
+
+        self.policy = state["policy"] if state["policy"] in POLICIES else DEFAULT_POLICY
+        self.max_in_flight = max(0, int(state["max_in_flight"]))
+        self._version = itertools.count(int(state["version"]))
+        self._tokens.clear()
+        for token_type in (TokenType.NORMAL.value, TokenType.SUPER.value):
+            for sso, data in (token_data.get(token_type) or {}).items():
+                self._tokens[sso] = (token_type, data)
+
+        for (token_type, field), index in self._indexes.items():
+            index.load([(tuple(key), version, sso) for key, version, sso in state["indexes"][f"{token_type}:{field}"]])
+        self._cooldowns.load([(tuple(key), version, sso) for key, version, sso in state["cooldowns"]])
+        for saturated in self._saturated.values():
+            saturated.clear()
+        self._in_flight.clear()
+        for sso in state["stale"]:
+            if sso in self._tokens:
+                self._reindex(sso)
+
+    def update(self, token_type: str, sso: str, data: Dict[str, Any]) -> None:
+        """Token新增或字段变化后调用"""
+        self._tokens[sso] = (token_type, data)
+        if sso not in self._order:
+            self._order[sso] = next(self._order_seq)
+        self._reindex(sso)
+
+    def remove(self, sso: str) -> None:
+        """Token删除后调用"""
+        self._tokens.pop(sso, None)
+        self._order.pop(sso, None)
+        self._last_pick.pop(sso, None)
+        for index in self._indexes.values():
+            index.discard(sso)
+        for saturated in self._saturated.values():
+            saturated.discard(sso)
+        self._cooldowns.discard(sso)
+
+    def set_policy(self, policy: str) -> None:
+        """切换策略并重建排序键"""
+        policy = policy if policy in POLICIES else DEFAULT_POLICY
+        if policy == self.policy:
+            return
+        self.policy = policy
+        for sso in list(self._tokens):
+            self._reindex(sso)
+
+    def set_max_in_flight(self, limit: int) -> None:
+        """调整单Token并发上限（0为不限）"""
+        limit = max(0, int(limit or 0))
+        if limit == self.max_in_flight:
+            return
+        self.max_in_flight = limit
+        for sso in list(self._tokens):
+            self._reindex(sso)
+
+    def _reindex(self, sso: str) -> None:
+        token_type, data = self._tokens[sso]
+        until = self._cooldown_until(data, int(time.time() * 1000))
+        if until:
+            for index_key, index in self._indexes.items():
+                index.discard(sso)
+                self._saturated[index_key].discard(sso)
+            self._cooldowns.push(sso, (until,), next(self._version))
+            return
+        self._cooldowns.discard(sso)
+
+        saturated = self._is_saturated(sso)
+        for index_key, index in self._indexes.items():
+            remaining = self._eligible_remaining(data, index_key[1]) if index_key[0] == token_type else None
+            if remaining is None or saturated:
+                index.discard(sso)
+            else:
+                index.push(sso, self._key(sso, remaining), next(self._version))
+            if remaining is not None and saturated:
+                self._saturated[index_key].add(sso)
+            else:
+                self._saturated[index_key].discard(sso)
+
+    def _is_saturated(self, sso: str) -> bool:
+        return bool(self.max_in_flight) and self._in_flight.get(sso, 0) >= self.max_in_flight
+
+    @staticmethod
+    def _cooldown_until(data: Dict[str, Any], now: int) -> Optional[int]:
+        """冷却到期时间（毫秒），未冷却或已到期返回None"""
+        until = data.get("cooldownUntil")
+        if isinstance(until, (int, float)) and until > now:
+            return int(until)
+        return None
+
+    @staticmethod
+    def _eligible_remaining(data: Dict[str, Any], field: str) -> Optional[int]:
+        """返回可用Token的剩余次数（-1为未使用），不可用返回None"""
+        if data.get("status") == "expired":
+            return None
+        if data.get("failedCount", 0) >= MAX_FAILURES:
+            return None
+        try:
+            remaining = int(data.get(field, -1))
+        except (TypeError, ValueError):
+            remaining = -1
+        if remaining == 0:
+            return None
+        return -1 if remaining < 0 else remaining
+
+    def _key(self, sso: str, remaining: int) -> tuple:
+        """计算排序键（越小越优先，首位为在途请求数）"""
+        load = self._in_flight.get(sso, 0)
+        if self.policy == "lru":
+            return (load, self._last_pick.get(sso, 0), self._order.get(sso, 0))
+        tier, score = (0, 0) if remaining == -1 else (1, -remaining)
+        if self.policy == "round_robin":
+            return (load, tier, score, self._last_pick.get(sso, 0), self._order.get(sso, 0))
+        return (load, tier, score, self._order.get(sso, 0))
+
+    # === 选择 ===
+
+    def select(self, token_type: str, field: str) -> Tuple[Optional[str], Optional[int]]:
+        """选择最优Token
+
+        Returns:
+            (sso, remaining)，无可用Token时为 (None, None)
+        """
+        index = self._indexes.get((token_type, field))
+        if index is None:
+            return None, None
+
+        top = index.peek()
+        if top is None:
+            return None, None
+
+        sso, _ = top
+        _, data = self._tokens[sso]
+        remaining = self._eligible_remaining(data, field)
+
+        if self.policy != "max_remaining":
+            self._last_pick[sso] = next(self._pick_seq)
+            self._reindex(sso)
+
+        return sso, remaining
+
+    def saturated(self, token_type: str, field: str) -> int:
+        """可用但已达并发上限的Token数"""
+        return len(self._saturated.get((token_type, field), ()))
+
+    # === 并发 ===
+
+    def acquire(self, sso: str) -> None:
+        """登记一个在途请求"""
+        self._in_flight[sso] = self._in_flight.get(sso, 0) + 1
+        if sso in self._tokens:
+            self._reindex(sso)
+
+    def release(self, sso: str) -> None:
+        """请求结束后释放"""
+        count = self._in_flight.get(sso, 0) - 1
+        if count > 0:
+            self._in_flight[sso] = count
+        else:
+            self._in_flight.pop(sso, None)
+        if sso in self._tokens:
+            self._reindex(sso)
+
+    def in_flight(self, sso: str) -> int:
+        return self._in_flight.get(sso, 0)
+
+    def set_in_flight(self, sso: str, count: int) -> None:
+        """同步在途请求数（共享内存模式下为全部worker合计）"""
+        if count == self._in_flight.get(sso, 0):
+            return
+        if count > 0:
+            self._in_flight[sso] = count
+        else:
+            self._in_flight.pop(sso, None)
+        if sso in self._tokens:
+            self._reindex(sso)
+
+    def saturated_tokens(self) -> set:
+        """因并发上限移出索引的Token"""
+        return set().union(*self._saturated.values())
+
+    # === 冷却 ===
+
+    def next_cooldown(self) -> Optional[int]:
+        """最近的冷却到期时间（毫秒）"""
+        top = self._cooldowns.peek()
+        return top[1][0] if top else None
+
+    def pop_cooldowns(self, now: Optional[int] = None) -> List[str]:
+        """取出所有已到期的冷却Token"""
+        now = int(time.time() * 1000) if now is None else now
+        expired = []
+        while True:
+            top = self._cooldowns.peek()
+            if top is None or top[1][0] > now:
+                break
+            self._cooldowns.discard(top[0])
+            expired.append(top[0])
+        return expired
+
+    def stats(self) -> Dict[str, Any]:
+        """索引统计"""
+        return {
+            "policy": self.policy,
+            "tokens": len(self._tokens),
+            "cooling": len(self._cooldowns),
+            "max_in_flight": self.max_in_flight,
+            "in_flight": sum(self._in_flight.values()),
+            "saturated": len(set().union(*self._saturated.values())),
+            "indexes": {f"{t}:{f}": len(index) for (t, f), index in self._indexes.items()},
+        }
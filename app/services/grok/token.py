@@ -1,28 +1,44 @@
 """Grok Token 管理器 - 单例模式的Token负载均衡和状态管理"""
 
+import gc
 import orjson
 import time
 import asyncio
 import aiofiles
-import portalocker
+from contextlib import contextmanager
 from pathlib import Path
-from curl_cffi.requests import AsyncSession
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, List, Set, Iterable
 
 from app.models.grok_models import TokenType, Models
 from app.core.exception import GrokApiException
 from app.core.logger import logger
 from app.core.config import setting
+from app.core.storage import FileStorage, TokenCursor
+from app.core.redis_tokens import RedisTokenStore
+from app.core.session_pool import session_pool
+from app.core.breaker import circuit_breakers, RATE_LIMITS
+from app.core.deadline import request_deadline
+from app.core.retry import retry_engine, Retryable, RetryState, FORBIDDEN, STATUS
 from app.services.grok.statsig import get_dynamic_headers
+from app.services.grok.scheduler import TokenScheduler, NORMAL_FIELD, HEAVY_FIELD, MAX_FAILURES
+from app.services.grok.token_table import TokenTable, to_tables
 
 
 # 常量
 RATE_LIMIT_API = "https://grok.com/rest/rate-limits"
 TIMEOUT = 30
 BROWSER = "chrome133a"
-MAX_FAILURES = 3
 TOKEN_INVALID = 401
 STATSIG_INVALID = 403
+RATE_LIMITED = 429
+
+# 冷却原因
+COOLDOWN_RATE_LIMIT = "rate_limit"  # 429退避
+COOLDOWN_QUOTA = "quota"  # 配额耗尽，等待窗口重置
+COOLDOWN_SERVER_ERROR = "server_error"  # 连续5xx
+COOLDOWN_POLL = 60.0  # 冷却任务最长休眠（秒）
+REMOTE_LEASE_POLL = 0.2  # Redis/共享内存模式并发已满时的轮询间隔（秒），其他节点/worker释放名额不会唤醒本进程
+SHARED_POLL = 0.5  # 共享内存模式同步其他worker数值的间隔（秒）
 
 
 class GrokTokenManager:
@@ -30,6 +46,7 @@ class GrokTokenManager:
     
     _instance: Optional['GrokTokenManager'] = None
     _lock = asyncio.Lock()
+    _TYPES = [TokenType.NORMAL.value, TokenType.SUPER.value]
 
     def __new__(cls) -> 'GrokTokenManager':
         if cls._instance is None:
@@ -41,16 +58,40 @@ class GrokTokenManager:
             return
 
         self.token_file = Path(__file__).parents[3] / "data" / "token.json"
-        self._file_lock = asyncio.Lock()
         self.token_file.parent.mkdir(parents=True, exist_ok=True)
-        self._storage = None
+        self._storage = FileStorage(self.token_file.parent)  # 未注入存储时使用本地文件
         self.token_data = None  # 延迟加载
+        self._scheduler = TokenScheduler()  # Token选择索引
         
         # 批量保存队列
         self._save_pending = False  # 标记是否有待保存的数据
         self._save_task = None  # 后台保存任务
         self._refresh_task = None  # Token状态刷新任务
+        self._sync_task = None  # 多进程文件同步任务
+        self._cooldown_task = None  # 冷却到期恢复任务
+        self._cooldown_wakeup = asyncio.Event()
+        self._lease_released = asyncio.Event()  # 有Token释放并发名额时触发（唤醒等待队列）
+        self._lease_waiters = 0  # 因并发已满而等待的请求数
         self._shutdown = False  # 关闭标志
+
+        # 多进程同步：本进程未保存的修改，以及已读取到的快照/日志位置
+        self._dirty_tokens: set[str] = set()
+        self._file_cursor: Optional[TokenCursor] = None
+
+        # Redis模式：选择/租约/扣减/失败在Redis原子完成，token_data为本地镜像
+        self._redis_tokens = None
+        self._redis_cursor: Optional[str] = None  # 已读取到的变更流位置
+        self._remote_leases: Dict[str, List[str]] = {}  # sso -> 本进程持有的租约ID
+        self._remote_in_flight: Dict[str, int] = {}  # sso -> 全局在途数（最近一次观测）
+        self._changed_fields: Dict[str, Optional[Set[str]]] = {}  # sso -> 待写入的字段，None为整条
+        self._applying_remote = False
+        self._background: Set[asyncio.Task] = set()  # 后台Redis写入
+
+        # 共享内存模式（多worker文件存储）：数值状态与在途数在各worker间共享
+        self._shared = None  # SharedTokenState，仅开启 token_shared_memory 时按需导入（依赖 fcntl）
+        self._shared_task = None
+
+        self.rate_limited_count = 0  # rate-limits接口累计429次数（刷新任务据此降速）
         
         self._initialized = True
         logger.debug(f"[Token] 初始化完成: {self.token_file}")
@@ -58,68 +99,470 @@ class GrokTokenManager:
     def set_storage(self, storage) -> None:
         """设置存储实例"""
         self._storage = storage
+        store = getattr(storage, "token_store", None)
+        self._redis_tokens = store if isinstance(store, RedisTokenStore) else None
 
-    async def _load_data(self) -> None:
-        """异步加载Token数据（支持多进程）"""
+    async def _load_data(self, warm=None) -> None:
+        """异步加载Token数据（快照 + 变更日志，支持多进程）
+
+        Args:
+            warm: 热启动快照（WarmStart），可用时直接装载Token表、选择索引与轮转位置
+        """
+        # 加载期间会一次性创建大量对象，暂停分代回收，避免反复全量扫描
+        paused = gc.isenabled()
+        gc.disable()
+        try:
+            await self._load_tables(warm)
+        finally:
+            if paused:
+                gc.enable()
+
+    async def _load_tables(self, warm) -> None:
+        """_load_data 的实际加载过程"""
         default = {TokenType.NORMAL.value: {}, TokenType.SUPER.value: {}}
-        
+        scheduler_state = warm.json("scheduler") if warm is not None else None
+        replayed: Optional[Set[str]] = None
+
         try:
-            if self.token_file.exists():
-                # 使用进程锁读取文件
-                async with self._file_lock:
-                    with open(self.token_file, "r", encoding="utf-8") as f:
-                        portalocker.lock(f, portalocker.LOCK_SH)  # 共享锁（读）
-                        try:
-                            content = f.read()
-                            self.token_data = orjson.loads(content)
-                        finally:
-                            portalocker.unlock(f)
+            if self._file_sync_enabled():
+                if warm is not None:
+                    try:
+                        replayed = await self._load_warm(warm)
+                    except Exception as e:
+                        logger.warning(f"[Token] 热启动快照装载失败，改为常规加载: {e}")
+                if replayed is None:
+                    self._file_cursor, self.token_data, _ = await self._storage.read_token_updates(None)
             else:
-                self.token_data = default
-                logger.debug("[Token] 创建新数据文件")
+                if self._redis_tokens is not None:
+                    self._redis_cursor = await self._redis_tokens.change_cursor()  # 先取游标，加载期间的修改由同步任务补上
+                self.token_data = await self._storage.load_tokens()
         except Exception as e:
             logger.error(f"[Token] 加载失败: {e}")
             self.token_data = default
 
+        self.token_data = to_tables(self._normalize(self.token_data), self._TYPES)
+        if self._file_sync_enabled() and setting.global_config.get("token_shared_memory", False):
+            self._attach_shared()
+        if self._redis_tokens is not None or self._shared is not None:
+            for token_type in self._TYPES:
+                self.token_data[token_type].on_change = self._note_change
+        self._restore_scheduler(warm, scheduler_state, replayed)
+        if self._shared is not None:
+            self._pull_shared(self._all_ssos())
+
+    def _restore_scheduler(self, warm, state: Optional[Dict[str, Any]], replayed: Optional[Set[str]]) -> None:
+        """Token表来自快照时直接装载索引（只重算日志中变化的Token），否则延续轮转位置后重建"""
+        try:
+            if replayed is not None and state is not None:
+                self._scheduler.restore_state(state, self.token_data)
+                for sso in replayed:
+                    token_type, data = self._find_token(sso)
+                    if data is None:
+                        self._scheduler.remove(sso)
+                    else:
+                        self._scheduler.update(token_type, sso, data)
+                warm.restored["scheduler"] = True
+                return
+            if state is not None:
+                self._scheduler.restore_state(state)
+        except Exception as e:
+            logger.warning(f"[Token] 选择索引快照不可用，重建索引: {e}")
+        self._scheduler.rebuild(self.token_data)
+
+    async def _load_warm(self, warm) -> Optional[Set[str]]:
+        """由热启动快照装载Token表，并重放快照之后追加的变更日志
+
+        Returns:
+            日志中变化的SSO；快照不可用或token.json已被替换时返回None
+        """
+        restored = warm.token_tables()
+        if restored is None:
+            return None
+        cursor, tables = restored
+        cursor, full, records = await self._storage.read_token_updates(cursor)
+        if full is not None:
+            logger.info("[Token] token.json在快照之后已被替换，改为常规加载")
+            return None
+
+        replayed: Set[str] = set()
+        for record in records:
+            sso = record.get("k")
+            if not sso:
+                continue
+            for table in tables.values():
+                table.pop(sso, None)
+            token_type, value = record.get("t"), record.get("v")
+            if token_type in tables and value is not None:
+                tables[token_type][sso] = value
+            replayed.add(sso)
+
+        self._file_cursor = cursor
+        self.token_data = tables
+        warm.restored["tokens"] = True
+        logger.info(f"[Token] 已由热启动快照装载，重放日志 {len(records)} 条")
+        return replayed
+
+    async def warm_tables(self) -> Optional[Tuple[TokenCursor, Dict[str, TokenTable]]]:
+        """供热启动快照导出：合并其他进程的写入后，返回本地Token表及与之一致的文件游标
+
+        仅文件存储可用；仍有未保存的修改时返回None。
+        """
+        if self.token_data is None or not self._file_sync_enabled():
+            return None
+        await self._sync_from_file()
+        if self._dirty_tokens or self._file_cursor is None:
+            return None
+        return self._file_cursor, self.token_data
+
+    @staticmethod
+    def _normalize(data: Any) -> Dict[str, Any]:
+        """规范化Token数据结构"""
+        default = {TokenType.NORMAL.value: {}, TokenType.SUPER.value: {}}
+
         # 兼容旧key：sso -> ssoNormal
-        if not isinstance(self.token_data, dict):
-            self.token_data = default
-        else:
-            if "sso" in self.token_data:
-                if TokenType.NORMAL.value in self.token_data:
-                    # 合并旧数据，保留现有ssoNormal
-                    self.token_data[TokenType.NORMAL.value].update(self.token_data.get("sso", {}))
-                else:
-                    self.token_data[TokenType.NORMAL.value] = self.token_data.get("sso", {})
-                self.token_data.pop("sso", None)
+        if not isinstance(data, dict):
+            return default
+
+        if "sso" in data:
+            if TokenType.NORMAL.value in data:
+                # 合并旧数据，保留现有ssoNormal
+                data[TokenType.NORMAL.value].update(data.get("sso", {}))
+            else:
+                data[TokenType.NORMAL.value] = data.get("sso", {})
+            data.pop("sso", None)
 
-            # 确保必要key存在
-            self.token_data.setdefault(TokenType.NORMAL.value, {})
-            self.token_data.setdefault(TokenType.SUPER.value, {})
+        # 确保必要key存在
+        data.setdefault(TokenType.NORMAL.value, {})
+        data.setdefault(TokenType.SUPER.value, {})
+        return data
 
-    async def _save_data(self) -> None:
-        """保存Token数据（支持多进程）"""
+    async def _save_data(
+        self,
+        changes: Optional[Dict[str, Tuple[Optional[str], Optional[Dict]]]] = None,
+        fields: Optional[Dict[str, Optional[Set[str]]]] = None,
+    ) -> None:
+        """保存Token数据
+
+        Args:
+            changes: 变更的Token（sso -> (类型, 数据)），为None时全量保存
+            fields: 变更Token中修改过的字段（Redis按字段写入）
+        """
         try:
-            if not self._storage:
-                async with self._file_lock:
-                    # 使用进程锁写入文件
-                    with open(self.token_file, "w", encoding="utf-8") as f:
-                        portalocker.lock(f, portalocker.LOCK_EX)  # 独占锁（写）
-                        try:
-                            content = orjson.dumps(self.token_data, option=orjson.OPT_INDENT_2).decode()
-                            f.write(content)
-                            f.flush()  # 确保写入磁盘
-                        finally:
-                            portalocker.unlock(f)
-            else:
+            if changes is None:
                 await self._storage.save_tokens(self.token_data)
+            else:
+                await self._storage.save_token_changes(self.token_data, changes, fields)
         except IOError as e:
             logger.error(f"[Token] 保存失败: {e}")
             raise GrokApiException(f"保存失败: {e}", "TOKEN_SAVE_ERROR", {"file": str(self.token_file)})
 
-    def _mark_dirty(self) -> None:
-        """标记有待保存的数据"""
+    def _mark_dirty(self, *ssos: str) -> None:
+        """标记有待保存的数据
+
+        Args:
+            ssos: 被修改的Token，文件同步时这些Token以本地数据为准
+        """
         self._save_pending = True
+        self._dirty_tokens.update(ssos)
+
+    def _note_change(self, sso: str, key: Optional[str]) -> None:
+        """记录本地修改的字段（Redis模式只写入这些字段，不覆盖其他节点的原子修改；共享内存模式立即写入共享数值）"""
+        if self._applying_remote:
+            return
+        if self._shared is not None:
+            if key is None or key in self._shared.fields:
+                self._publish_shared(sso, key)
+            return
+        fields = self._changed_fields
+        if key is None or (sso in fields and fields[sso] is None):
+            fields[sso] = None
+        else:
+            fields.setdefault(sso, set()).add(key)
+
+    @contextmanager
+    def _remote_update(self):
+        """应用来自Redis的数据（不计为本地修改）"""
+        self._applying_remote = True
+        try:
+            yield
+        finally:
+            self._applying_remote = False
+
+    def _apply_remote_record(self, token_type: Optional[str], sso: str, record: Dict[str, Any], in_flight: int) -> None:
+        """用Redis返回的最新数据更新本地镜像（本地尚未写入的字段保留本地值）"""
+        if in_flight > 0:
+            self._remote_in_flight[sso] = in_flight
+        else:
+            self._remote_in_flight.pop(sso, None)
+
+        pending = self._changed_fields.get(sso, set())
+        if token_type not in self.token_data or pending is None:
+            return
+
+        local_type, local = self._find_token(sso)
+        with self._remote_update():
+            if local is None or local_type != token_type:
+                if local is not None:
+                    del self.token_data[local_type][sso]
+                self.token_data[token_type][sso] = record
+                local = self.token_data[token_type][sso]
+            else:
+                for key, value in record.items():
+                    if key not in pending and local.get(key) != value:
+                        local[key] = value
+        self._scheduler.update(token_type, sso, local)
+
+    # === 共享内存 ===
+
+    def _attach_shared(self) -> None:
+        """连接共享内存：新槽位写入本地数据，已有槽位以共享数值为准（加载后拉取）"""
+        try:
+            from app.services.grok.token_shm import SharedTokenState, segment_name
+        except ImportError as e:  # Windows 等没有 fcntl 的平台
+            logger.warning(f"[Token] 当前平台不支持共享内存Token状态，已忽略 token_shared_memory: {e}")
+            return
+
+        cfg = setting.global_config
+        data_dir = self._storage.data_dir
+        try:
+            self._shared = SharedTokenState(
+                segment_name(data_dir),
+                max(1024, int(cfg.get("token_shared_slots", 65536) or 65536)),
+                data_dir / "token_shm.lock",
+            )
+        except Exception as e:
+            logger.error(f"[Token] 共享内存不可用，使用进程内状态: {e}")
+            return
+
+        for token_type in self._TYPES:
+            for sso, data in self.token_data[token_type].items():
+                slot = self._shared.slot(sso)
+                if slot is not None and self._shared.is_new(slot):
+                    self._shared.write(slot, {f: data.get(f) for f in self._shared.fields if f in data})
+
+    def _all_ssos(self) -> List[str]:
+        return [sso for token_type in self._TYPES for sso in self.token_data[token_type]]
+
+    def _shared_slot(self, sso: str) -> Optional[int]:
+        return None if self._shared is None else self._shared.slot(sso)
+
+    def _publish_shared(self, sso: str, key: Optional[str]) -> None:
+        """本地修改写入共享内存（key为None时写入全部共享字段）"""
+        _, data = self._find_token(sso)
+        slot = None if data is None else self._shared.slot(sso)
+        if slot is None:
+            return
+        if key is None:
+            self._shared.write(slot, {f: data.get(f) for f in self._shared.fields if f in data})
+        else:
+            self._shared.write(slot, {key: data.get(key)})
+
+    def _pull_shared(self, ssos: Optional[Iterable[str]] = None) -> int:
+        """把共享内存中的数值与在途数同步到本地镜像和选择索引
+
+        Args:
+            ssos: 需要同步的Token，默认仅同步自上次以来有变化的Token
+
+        Returns:
+            数值发生变化的Token数
+        """
+        shared = self._shared
+        if shared is None or self.token_data is None:
+            return 0
+
+        changed = 0
+        for sso in (shared.changed_tokens() if ssos is None else ssos):
+            slot = shared.slot(sso, create=False)
+            if slot is None:
+                continue
+            self._scheduler.set_in_flight(sso, shared.in_flight(slot))
+            token_type, data = self._find_token(sso)
+            if data is None:
+                continue
+            diff = {k: v for k, v in shared.read(slot).items() if data.get(k) != v}
+            if diff:
+                with self._remote_update():
+                    data.update(diff)
+                self._scheduler.update(token_type, sso, data)
+                changed += 1
+        return changed
+
+    async def _shared_sync_worker(self) -> None:
+        """定期同步其他worker写入共享内存的数值，并回收已退出worker遗留的在途数"""
+        logger.info("[Token] 共享内存同步任务已启动")
+        while not self._shutdown:
+            await asyncio.sleep(SHARED_POLL)
+            try:
+                self._shared.reap_dead()
+                self._pull_shared()
+            except Exception as e:
+                logger.error(f"[Token] 共享内存同步失败: {e}")
+
+    def _spawn(self, coro) -> None:
+        """后台执行Redis写入（保留引用，关闭时等待完成）"""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _file_sync_enabled(self) -> bool:
+        """是否以本地token.json作为多进程共享状态"""
+        return isinstance(self._storage, FileStorage)
+
+    async def _sync_from_file(self) -> bool:
+        """快照或变更日志被其他进程修改时合并
+
+        仅在文件签名变化时读取：日志追加只读取新增记录，快照被替换时全量合并；
+        本地未保存的Token保留本地数据。
+
+        Returns:
+            是否发生了合并
+        """
+        if self.token_data is None or not self._file_sync_enabled():
+            return False
+
+        if not self._storage.token_changed(self._file_cursor):
+            return False
+
+        try:
+            cursor, full, records = await self._storage.read_token_updates(self._file_cursor)
+        except Exception as e:
+            # 保留旧游标，下轮重试
+            logger.debug(f"[Token] 同步读取失败: {e}")
+            return False
+
+        self._file_cursor = cursor
+        with self._remote_update():
+            if full is not None:
+                self._merge_remote(self._normalize(full))
+            else:
+                self._apply_remote_changes(records)
+        if self._shared is not None:
+            # 文件中的数值可能落后于共享内存，以共享内存为准
+            self._pull_shared(self._all_ssos() if full is not None else [r.get("k") for r in records if r.get("k")])
+        return True
+
+    def _apply_remote_changes(self, records: list) -> None:
+        """应用其他进程追加的变更日志"""
+        changed = 0
+        for record in records:
+            sso = record.get("k")
+            if not sso or sso in self._dirty_tokens:
+                continue
+
+            token_type, value = record.get("t"), record.get("v")
+            local_type, local = self._find_token(sso)
+
+            if token_type not in self.token_data or value is None:
+                if local is not None:
+                    del self.token_data[local_type][sso]
+                    self._scheduler.remove(sso)
+                    changed += 1
+                continue
+
+            if local_type == token_type:
+                if local == value:
+                    continue  # 本进程写入的记录
+                local.clear()
+                local.update(value)
+                value = local
+            else:
+                if local is not None:
+                    del self.token_data[local_type][sso]
+                self.token_data[token_type][sso] = value
+                value = self.token_data[token_type][sso]
+            self._scheduler.update(token_type, sso, value)
+            changed += 1
+
+        if changed:
+            logger.debug(f"[Token] 同步其他进程修改: {changed} 个Token")
+
+    def _merge_remote(self, remote: Dict[str, Any]) -> None:
+        """合并其他进程写入的数据"""
+        dirty = self._dirty_tokens
+        changed = 0
+
+        for token_type in [TokenType.NORMAL.value, TokenType.SUPER.value]:
+            local_map = self.token_data.setdefault(token_type, TokenTable())
+            remote_map = remote.get(token_type) or {}
+
+            # 其他进程删除的Token
+            for sso in [k for k in local_map if k not in remote_map and k not in dirty]:
+                del local_map[sso]
+                self._scheduler.remove(sso)
+                changed += 1
+
+            # 其他进程新增/修改的Token（原地更新，保持已有引用有效）
+            for sso, data in remote_map.items():
+                if sso in dirty:
+                    continue
+                local = local_map.get(sso)
+                if local == data:
+                    continue
+                if local is None:
+                    local_map[sso] = data
+                    data = local_map[sso]
+                else:
+                    local.clear()
+                    local.update(data)
+                    data = local
+                self._scheduler.update(token_type, sso, data)
+                changed += 1
+
+        if changed:
+            logger.debug(f"[Token] 同步其他进程修改: {changed} 个Token")
+
+    async def _file_sync_worker(self) -> None:
+        """轮询token.json签名，感知其他进程写入"""
+        from app.core.config import setting
+
+        logger.info("[Token] 文件同步任务已启动")
+        while not self._shutdown:
+            interval = setting.global_config.get("token_sync_interval", 1.0)
+            await asyncio.sleep(max(0.1, float(interval or 1.0)))
+            try:
+                await self._sync_from_file()
+            except Exception as e:
+                logger.error(f"[Token] 文件同步失败: {e}")
+
+    async def _sync_from_redis(self) -> None:
+        """读取Redis变更流，合并其他节点的修改（本地未写入的Token保留本地数据）"""
+        store = self._redis_tokens
+        if self.token_data is None or store is None:
+            return
+
+        cursor, ssos = await store.read_changes(self._redis_cursor or "0-0")
+        if ssos is None:
+            # 游标已被裁剪，全量重新加载
+            remote = await store.load_all()
+            self._redis_cursor = cursor
+            with self._remote_update():
+                self._merge_remote(self._normalize(remote))
+            return
+
+        self._redis_cursor = cursor
+        if not ssos:
+            return
+
+        records = []
+        for sso, (token_type, record, in_flight) in (await store.fetch(ssos)).items():
+            if in_flight > 0:
+                self._remote_in_flight[sso] = in_flight
+            else:
+                self._remote_in_flight.pop(sso, None)
+            records.append({"k": sso, "t": token_type, "v": record if token_type else None})
+        with self._remote_update():
+            self._apply_remote_changes(records)
+
+    async def _redis_sync_worker(self) -> None:
+        """按 token_sync_interval 读取Redis变更流"""
+        logger.info("[Token] Redis同步任务已启动")
+        while not self._shutdown:
+            interval = setting.global_config.get("token_sync_interval", 1.0)
+            await asyncio.sleep(max(0.1, float(interval or 1.0)))
+            try:
+                await self._sync_from_redis()
+            except Exception as e:
+                logger.error(f"[Token] Redis同步失败: {e}")
 
     async def _batch_save_worker(self) -> None:
         """批量保存后台任务"""
@@ -132,12 +575,38 @@ class GrokTokenManager:
             await asyncio.sleep(interval)
             
             if self._save_pending and not self._shutdown:
-                try:
-                    await self._save_data()
-                    self._save_pending = False
-                    logger.debug("[Token] 存储完成")
-                except Exception as e:
-                    logger.error(f"[Token] 存储失败: {e}")
+                await self._flush()
+
+    async def _flush(self) -> None:
+        """合并其他进程的修改后，仅写入本进程变更的Token"""
+        await self._sync_from_file()
+        dirty, self._dirty_tokens = self._dirty_tokens, set()
+        self._save_pending = False
+        if not dirty:
+            return
+
+        changes = {sso: self._find_token(sso) for sso in dirty}
+        fields = None
+        if self._redis_tokens is not None:
+            fields = {sso: self._changed_fields.pop(sso, set()) for sso in dirty}
+        try:
+            await self._save_data(changes, fields)
+            logger.debug(f"[Token] 存储完成: {len(changes)} 个Token")
+        except Exception as e:
+            self._dirty_tokens |= dirty
+            self._save_pending = True
+            for sso, pending in (fields or {}).items():
+                current = self._changed_fields.get(sso, set())
+                self._changed_fields[sso] = None if pending is None or current is None else pending | current
+            logger.error(f"[Token] 存储失败: {e}")
+            return
+
+        # 日志超过阈值时合并进快照
+        max_mb = setting.global_config.get("token_journal_max_mb", 8)
+        try:
+            await self._storage.compact_tokens(int(float(max_mb) * 1024 * 1024))
+        except Exception as e:
+            logger.error(f"[Token] 日志压缩失败: {e}")
 
     async def _refresh_status_worker(self) -> None:
         """定时刷新Token状态"""
@@ -158,6 +627,13 @@ class GrokTokenManager:
             except Exception as e:
                 logger.error(f"[Token] 状态刷新失败: {e}")
 
+            # 刷新后将长期失效/持续0次数的Token移入冷归档
+            try:
+                from app.services.grok.archive import token_archive
+                await token_archive.sweep()
+            except Exception as e:
+                logger.error(f"[Token] 冷归档失败: {e}")
+
             await asyncio.sleep(interval)
 
     async def start_batch_save(self) -> None:
@@ -166,14 +642,37 @@ class GrokTokenManager:
             self._save_task = asyncio.create_task(self._batch_save_worker())
             logger.info("[Token] 存储任务已创建")
 
+    async def start_file_sync(self) -> None:
+        """启动多进程同步任务（文件存储轮询文件签名，Redis存储读取变更流）"""
+        if self._sync_task is not None:
+            return
+        if self._redis_tokens is not None:
+            self._sync_task = asyncio.create_task(self._redis_sync_worker())
+            logger.info("[Token] Redis同步任务已创建")
+        elif self._file_sync_enabled():
+            self._sync_task = asyncio.create_task(self._file_sync_worker())
+            logger.info("[Token] 文件同步任务已创建")
+            if self._shared is not None and self._shared_task is None:
+                self._shared_task = asyncio.create_task(self._shared_sync_worker())
+
+    async def start_cooldown(self) -> None:
+        """启动冷却恢复任务"""
+        if self._cooldown_task is None:
+            self._cooldown_task = asyncio.create_task(self._cooldown_worker())
+            logger.info("[Token] 冷却恢复任务已创建")
+
     async def start_status_refresh(self) -> None:
         """启动状态刷新任务"""
         if self._refresh_task is None:
             self._refresh_task = asyncio.create_task(self._refresh_status_worker())
             logger.info("[Token] 状态刷新任务已创建")
 
-    async def shutdown(self) -> None:
-        """关闭并刷新所有待保存数据"""
+    async def shutdown(self, compact: bool = True) -> None:
+        """关闭并刷新所有待保存数据
+
+        Args:
+            compact: 是否将变更日志合并进快照（写入热启动快照时保留日志，使快照与token.json签名一致）
+        """
         self._shutdown = True
         
         if self._save_task:
@@ -183,18 +682,38 @@ class GrokTokenManager:
             except asyncio.CancelledError:
                 pass
 
-        if self._refresh_task:
-            self._refresh_task.cancel()
-            try:
-                await self._refresh_task
-            except asyncio.CancelledError:
-                pass
+        for task in (self._refresh_task, self._sync_task, self._cooldown_task, self._shared_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+        # 归还本进程持有的Redis租约，并等待后台写入完成
+        for leases in self._remote_leases.values():
+            for lease in leases:
+                self._spawn(self._release_remote(lease))
+        self._remote_leases.clear()
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
         
         # 最终刷新
         if self._save_pending:
-            await self._save_data()
+            await self._flush()
             logger.info("[Token] 关闭时刷新完成")
 
+        # 关闭时将变更日志合并进快照
+        if compact:
+            try:
+                await self._storage.compact_tokens()
+            except Exception as e:
+                logger.error(f"[Token] 关闭时日志压缩失败: {e}")
+
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
     @staticmethod
     def _extract_sso(auth_token: str) -> Optional[str]:
         """提取SSO值"""
@@ -231,12 +750,16 @@ class GrokTokenManager:
                 "zeroCount": 0,
                 "lastFailureTime": None,
                 "lastFailureReason": None,
+                "lastCheckTime": None,
+                "cooldownUntil": None,
+                "cooldownReason": None,
                 "tags": [],
                 "note": ""
             }
+            self._scheduler.update(token_type.value, token, self.token_data[token_type.value][token])
             count += 1
 
-        self._mark_dirty()  # 批量保存
+        self._mark_dirty(*tokens)  # 批量保存
         logger.info(f"[Token] 添加 {count} 个 {token_type.value} Token")
 
     async def delete_token(self, tokens: list[str], token_type: TokenType) -> None:
@@ -248,9 +771,11 @@ class GrokTokenManager:
         for token in tokens:
             if token in self.token_data[token_type.value]:
                 del self.token_data[token_type.value][token]
+                self._scheduler.remove(token)
+                self._sync_index(token)  # 另一类型中可能仍存在
                 count += 1
 
-        self._mark_dirty()  # 批量保存
+        self._mark_dirty(*tokens)  # 批量保存
         logger.info(f"[Token] 删除 {count} 个 {token_type.value} Token")
 
     async def update_token_tags(self, token: str, token_type: TokenType, tags: list[str]) -> None:
@@ -260,7 +785,7 @@ class GrokTokenManager:
         
         cleaned = [t.strip() for t in tags if t and t.strip()]
         self.token_data[token_type.value][token]["tags"] = cleaned
-        self._mark_dirty()  # 批量保存
+        self._mark_dirty(token)  # 批量保存
         logger.info(f"[Token] 更新标签: {token[:10]}... -> {cleaned}")
 
     async def update_token_note(self, token: str, token_type: TokenType, note: str) -> None:
@@ -269,84 +794,192 @@ class GrokTokenManager:
             raise GrokApiException("Token不存在", "TOKEN_NOT_FOUND", {"token": token[:10]})
         
         self.token_data[token_type.value][token]["note"] = note.strip()
-        self._mark_dirty()  # 批量保存
+        self._mark_dirty(token)  # 批量保存
         logger.info(f"[Token] 更新备注: {token[:10]}...")
     
     def get_tokens(self) -> Dict[str, Any]:
         """获取所有Token"""
         return self.token_data.copy()
 
-    def _reload_if_needed(self) -> None:
-        """在多进程模式下重新加载数据（同步版本，用于select_token）"""
-        # 只在文件模式且多进程环境下才重新加载
-        if self._storage:
-            return  # 数据库模式不需要
-        
-        try:
-            if self.token_file.exists():
-                with open(self.token_file, "r", encoding="utf-8") as f:
-                    portalocker.lock(f, portalocker.LOCK_SH)
-                    try:
-                        content = f.read()
-                        self.token_data = orjson.loads(content)
-                    finally:
-                        portalocker.unlock(f)
-        except Exception as e:
-            logger.warning(f"[Token] 重新加载失败: {e}")
-
     def get_token(self, model: str) -> str:
         """获取Token"""
         jwt = self.select_token(model)
         return f"sso-rw={jwt};sso={jwt}"
     
-    def select_token(self, model: str) -> str:
-        """选择最优Token（多进程安全）"""
-        # 重新加载最新数据（多进程模式）
-        self._reload_if_needed()
-        def select_best(tokens: Dict[str, Any], field: str) -> Tuple[Optional[str], Optional[int]]:
-            """选择最佳Token"""
-            unused, used = [], []
-
-            for key, data in tokens.items():
-                # 跳过已失效的token
-                if data.get("status") == "expired":
-                    continue
-                
-                # 跳过失败次数过多的token（任何错误状态码）
-                if data.get("failedCount", 0) >= MAX_FAILURES:
-                    continue
+    async def acquire_token(self, model: str) -> str:
+        """获取Token并登记在途请求，需配对调用 release_token
 
-                remaining = int(data.get(field, -1))
-                if remaining == 0:
-                    continue
+        所有可用Token都达到 token_max_concurrency 时进入等待队列，
+        有Token释放名额后按先来先得重新选择，最多等待 token_acquire_timeout 秒。
+        Redis存储时由Redis原子选择并登记全局租约。
+        """
+        if self._redis_tokens is not None:
+            return await self._acquire_remote(model)
 
-                if remaining == -1:
-                    unused.append(key)
-                elif remaining > 0:
-                    used.append((key, remaining))
-
-            if unused:
-                return unused[0], -1
-            if used:
-                used.sort(key=lambda x: x[1], reverse=True)
-                return used[0][0], used[0][1]
-            return None, None
-
-        # 快照
-        snapshot = {
-            TokenType.NORMAL.value: self.token_data[TokenType.NORMAL.value].copy(),
-            TokenType.SUPER.value: self.token_data[TokenType.SUPER.value].copy()
-        }
+        deadline = None
+        while True:
+            try:
+                jwt = self.select_token(model)
+            except GrokApiException:
+                if not self._saturated(model):
+                    raise
+                if self._shared is None:
+                    deadline = await self._wait_lease(model, deadline)
+                else:
+                    deadline = await self._wait_lease(model, deadline, REMOTE_LEASE_POLL)
+                    self._pull_shared(self._scheduler.saturated_tokens())
+                continue
 
-        # 选择策略
-        if model == "grok-4-heavy":
-            field = "heavyremainingQueries"
-            token_key, remaining = select_best(snapshot[TokenType.SUPER.value], field)
+            if self._lease(jwt):
+                return f"sso-rw={jwt};sso={jwt}"
+
+    def _lease(self, sso: str) -> bool:
+        """登记在途请求；共享内存模式按全部worker合计的在途数检查上限
+
+        Returns:
+            是否登记成功（失败时索引已按共享数值更新，需重新选择）
+        """
+        slot = self._shared_slot(sso)
+        if slot is None:
+            self._scheduler.acquire(sso)
+            return True
+        if self._pull_shared([sso]):
+            return False  # 其他worker已修改配额/状态，按最新数值重新选择
+        count = self._shared.try_acquire(slot, self._scheduler.max_in_flight)
+        self._scheduler.set_in_flight(sso, self._shared.in_flight(slot) if count is None else count)
+        return count is not None
+
+    async def _acquire_remote(self, model: str) -> str:
+        """Redis模式：跨节点原子选择并租用Token，节点崩溃时租约按 redis_lease_ttl 过期归还"""
+        cfg = setting.global_config
+        store = self._redis_tokens
+        store.max_in_flight = max(0, int(cfg.get("token_max_concurrency", 0) or 0))
+        store.max_failures = MAX_FAILURES
+        ttl = float(cfg.get("redis_lease_ttl", 900) or 900)
+
+        deadline = None
+        while True:
+            picked, saturated = await store.acquire(self._select_keys(model), ttl)
+            if picked is not None:
+                token_type, sso, record, in_flight, lease = picked
+                self._remote_leases.setdefault(sso, []).append(lease)
+                self._apply_remote_record(token_type, sso, record, in_flight)
+                logger.debug(f"[Token] 分配Token: {model} (全局在途{in_flight})")
+                return f"sso-rw={sso};sso={sso}"
+
+            if not saturated:
+                raise GrokApiException(
+                    f"没有可用Token: {model}",
+                    "NO_AVAILABLE_TOKEN",
+                    {
+                        "model": model,
+                        "normal": len(self.token_data[TokenType.NORMAL.value]),
+                        "super": len(self.token_data[TokenType.SUPER.value])
+                    }
+                )
+            deadline = await self._wait_lease(model, deadline, REMOTE_LEASE_POLL)
+
+    async def _wait_lease(self, model: str, deadline: Optional[float], poll: Optional[float] = None) -> float:
+        """并发已满时等待名额释放，超过 token_acquire_timeout 抛出异常
+
+        Returns:
+            等待截止时间（首次等待时确定）
+        """
+        loop = asyncio.get_running_loop()
+        if deadline is None:
+            wait = float(setting.global_config.get("token_acquire_timeout", 30) or 0)
+            remaining = request_deadline.remaining()  # 不超过请求剩余时间
+            deadline = loop.time() + (wait if remaining is None else min(wait, remaining))
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            request_deadline.check("选择Token")  # 等待被请求截止时间截短时按超时返回
+            raise GrokApiException(
+                f"Token并发已满: {model}",
+                "NO_AVAILABLE_TOKEN",
+                {
+                    "model": model,
+                    "max_concurrency": int(setting.global_config.get("token_max_concurrency", 0) or 0),
+                    "waiting": self._lease_waiters
+                }
+            )
+
+        released = self._lease_released
+        self._lease_waiters += 1
+        try:
+            await asyncio.wait_for(released.wait(), timeout=remaining if poll is None else min(remaining, poll))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._lease_waiters -= 1
+        return deadline
+
+    def release_token(self, auth_token: str) -> None:
+        """释放 acquire_token 登记的在途请求"""
+        sso = self._extract_sso(auth_token)
+        if not sso:
+            return
+        if self._redis_tokens is not None:
+            leases = self._remote_leases.get(sso)
+            if leases:
+                lease = leases.pop()
+                if not leases:
+                    del self._remote_leases[sso]
+                self._spawn(self._release_remote(lease))
+            return
+        slot = self._shared_slot(sso)
+        if slot is None:
+            self._scheduler.release(sso)
         else:
-            field = "remainingQueries"
-            token_key, remaining = select_best(snapshot[TokenType.NORMAL.value], field)
-            if token_key is None:
-                token_key, remaining = select_best(snapshot[TokenType.SUPER.value], field)
+            self._scheduler.set_in_flight(sso, self._shared.release(slot))
+        self._wake_waiters()
+
+    async def _release_remote(self, lease: str) -> None:
+        """归还Redis租约，完成后唤醒本进程的等待者"""
+        try:
+            result = await self._redis_tokens.release(lease)
+        except Exception as e:
+            logger.warning(f"[Token] 租约归还失败，将按TTL过期: {e}")
+            return
+        if result:
+            token_type, sso, record, in_flight = result
+            self._apply_remote_record(token_type, sso, record, in_flight)
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        if self._lease_waiters:
+            # 唤醒全部等待者，按等待顺序依次重新选择
+            released, self._lease_released = self._lease_released, asyncio.Event()
+            released.set()
+
+    def in_flight(self, sso: str) -> int:
+        """Token当前在途请求数（本进程；Redis/共享内存模式为最近一次观测到的全局值）"""
+        if self._redis_tokens is not None:
+            return self._remote_in_flight.get(sso, 0)
+        return self._scheduler.in_flight(sso)
+
+    @staticmethod
+    def _select_keys(model: str) -> Tuple[Tuple[str, str], ...]:
+        """模型对应的候选索引，按优先顺序"""
+        if model == "grok-4-heavy":
+            return ((TokenType.SUPER.value, HEAVY_FIELD),)
+        return ((TokenType.NORMAL.value, NORMAL_FIELD), (TokenType.SUPER.value, NORMAL_FIELD))
+
+    def _saturated(self, model: str) -> bool:
+        """是否存在仅因并发上限而不可选的Token"""
+        return any(self._scheduler.saturated(*key) for key in self._select_keys(model))
+
+    def select_token(self, model: str) -> str:
+        """选择最优Token（多进程数据由后台文件同步任务收敛）"""
+        cfg = setting.global_config
+        self._scheduler.set_policy(cfg.get("token_select_policy", "round_robin"))
+        self._scheduler.set_max_in_flight(cfg.get("token_max_concurrency", 0))
+
+        # 选择策略（索引维护可用Token，选择为 O(log n)，在途请求少者优先）
+        token_key, remaining = None, None
+        for token_type, field in self._select_keys(model):
+            token_key, remaining = self._scheduler.select(token_type, field)
+            if token_key is not None:
+                break
 
         if token_key is None:
             raise GrokApiException(
@@ -354,14 +987,20 @@ class GrokTokenManager:
                 "NO_AVAILABLE_TOKEN",
                 {
                     "model": model,
-                    "normal": len(snapshot[TokenType.NORMAL.value]),
-                    "super": len(snapshot[TokenType.SUPER.value])
+                    "normal": len(self.token_data[TokenType.NORMAL.value]),
+                    "super": len(self.token_data[TokenType.SUPER.value])
                 }
             )
 
         status = "未使用" if remaining == -1 else f"剩余{remaining}次"
         logger.debug(f"[Token] 分配Token: {model} ({status})")
         return token_key
+
+    def _sync_index(self, sso: str) -> None:
+        """Token字段变化后同步选择索引"""
+        token_type, data = self._find_token(sso)
+        if data is not None:
+            self._scheduler.update(token_type, sso, data)
     
     async def check_limits(self, auth_token: str, model: str) -> Optional[Dict[str, Any]]:
         """检查速率限制"""
@@ -374,101 +1013,73 @@ class GrokTokenManager:
             headers = get_dynamic_headers("/rest/rate-limits")
             headers["Cookie"] = f"{auth_token};{cf}" if cf else auth_token
 
-            # 外层重试：可配置状态码（401/429等）
             retry_codes = setting.grok_config.get("retry_status_codes", [401, 429])
-            MAX_OUTER_RETRY = 3
-            
-            for outer_retry in range(MAX_OUTER_RETRY + 1):  # +1 确保实际重试3次
-                # 内层重试：403代理池重试
-                max_403_retries = 5
-                retry_403_count = 0
-                
-                while retry_403_count <= max_403_retries:
-                    # 异步获取代理（支持代理池）
-                    from app.core.proxy_pool import proxy_pool
-                    
-                    # 如果是403重试且使用代理池，强制刷新代理
-                    if retry_403_count > 0 and proxy_pool._enabled:
-                        logger.info(f"[Token] 403重试 {retry_403_count}/{max_403_retries}，刷新代理...")
-                        if sso_token:
-                            proxy = await proxy_pool.get_proxy_for_sso(sso_token)
-                        else:
-                            proxy = await proxy_pool.force_refresh()
-                    else:
-                        proxy = await proxy_pool.get_proxy_for_sso(sso_token) if sso_token else await setting.get_proxy_async("service")
-                    
-                    proxies = {"http": proxy, "https": proxy} if proxy else None
-                    
-                    async with AsyncSession() as session:
+
+            async def attempt(state: RetryState):
+                from app.core.proxy_pool import proxy_pool
+
+                # 异步获取代理（403重试时换代理）
+                proxy = await proxy_pool.get_request_proxy(sso_token, rotate=state.count(FORBIDDEN) > 0)
+
+                with circuit_breakers.permit(RATE_LIMITS, proxy) as permit:
+                    async with session_pool.session(proxy, BROWSER) as session:
                         response = await session.post(
                             RATE_LIMIT_API,
                             headers=headers,
                             json=payload,
-                            impersonate=BROWSER,
                             timeout=TIMEOUT,
-                            proxies=proxies
                         )
+                    blame = permit.record_status(response.status_code)
+                connect, ttfb = session_pool.timings(response)
+                proxy_pool.observe(proxy, response.status_code, ttfb, connect)
+
+                if response.status_code == 429:
+                    self.rate_limited_count += 1
+
+                # 403：仅当有代理池时换代理重试
+                if response.status_code == 403 and proxy_pool._enabled:
+                    if proxy and blame:
+                        proxy_pool.mark_failure(proxy)
+                    raise Retryable(FORBIDDEN, "遇到403错误", response=response)
+
+                # 可配置状态码错误
+                if response.status_code in retry_codes:
+                    raise Retryable(STATUS, f"遇到{response.status_code}错误", response=response)
+                return response
+
+            try:
+                response = await retry_engine.run("rate_limits", attempt)
+            except Retryable as e:
+                response = e.response
+
+            if response.status_code == 200:
+                data = response.json()
+                sso = self._extract_sso(auth_token)
 
-                        # 内层403重试：仅当有代理池时触发
-                        if response.status_code == 403 and proxy_pool._enabled:
-                            if proxy:
-                                proxy_pool.mark_failure(proxy)
-                            retry_403_count += 1
-                            
-                            if retry_403_count <= max_403_retries:
-                                logger.warning(f"[Token] 遇到403错误，正在重试 ({retry_403_count}/{max_403_retries})...")
-                                await asyncio.sleep(0.5)
-                                continue
-                            
-                            # 内层重试全部失败
-                            logger.error(f"[Token] 403错误，已重试{retry_403_count-1}次，放弃")
-                            sso = self._extract_sso(auth_token)
-                            if sso:
-                                await self.record_failure(auth_token, 403, "服务器被Block")
-                        
-                        # 检查可配置状态码错误 - 外层重试
-                        if response.status_code in retry_codes:
-                            if outer_retry < MAX_OUTER_RETRY:
-                                delay = (outer_retry + 1) * 0.1  # 渐进延迟：0.1s, 0.2s, 0.3s
-                                logger.warning(f"[Token] 遇到{response.status_code}错误，外层重试 ({outer_retry+1}/{MAX_OUTER_RETRY})，等待{delay}s...")
-                                await asyncio.sleep(delay)
-                                break  # 跳出内层循环，进入外层重试
-                            else:
-                                logger.error(f"[Token] {response.status_code}错误，已重试{outer_retry}次，放弃")
-                                sso = self._extract_sso(auth_token)
-                                if sso:
-                                    if response.status_code == 401:
-                                        await self.record_failure(auth_token, 401, "Token失效")
-                                    else:
-                                        await self.record_failure(auth_token, response.status_code, f"错误: {response.status_code}")
-                                return None
-
-                        if response.status_code == 200:
-                            data = response.json()
-                            sso = self._extract_sso(auth_token)
-                            
-                            if outer_retry > 0 or retry_403_count > 0:
-                                logger.info(f"[Token] 重试成功！")
-                            
-                            if sso:
-                                # 解析视频配额（如果存在）
-                                video_remaining = data.get("videoRemainingQueries", data.get("videoRemaining", -1))
-                                
-                                if model == "grok-4-heavy":
-                                    await self.update_limits(sso, normal=None, heavy=data.get("remainingQueries", -1), video=video_remaining if video_remaining != -1 else None)
-                                    logger.info(f"[Token] 更新限制: {sso[:10]}..., heavy={data.get('remainingQueries', -1)}, video={video_remaining}")
-                                else:
-                                    await self.update_limits(sso, normal=data.get("remainingTokens", -1), heavy=None, video=video_remaining if video_remaining != -1 else None)
-                                    logger.info(f"[Token] 更新限制: {sso[:10]}..., basic={data.get('remainingTokens', -1)}, video={video_remaining}")
-                            
-                            return data
-                        else:
-                            # 其他错误
-                            logger.warning(f"[Token] 获取限制失败: {response.status_code}")
-                            sso = self._extract_sso(auth_token)
-                            if sso:
-                                await self.record_failure(auth_token, response.status_code, f"错误: {response.status_code}")
-                            return None
+                if sso:
+                    # 解析视频配额（如果存在）
+                    video_remaining = data.get("videoRemainingQueries", data.get("videoRemaining", -1))
+
+                    if model == "grok-4-heavy":
+                        await self.update_limits(sso, normal=None, heavy=data.get("remainingQueries", -1), video=video_remaining if video_remaining != -1 else None)
+                        logger.info(f"[Token] 更新限制: {sso[:10]}..., heavy={data.get('remainingQueries', -1)}, video={video_remaining}")
+                    else:
+                        await self.update_limits(sso, normal=data.get("remainingTokens", -1), heavy=None, video=video_remaining if video_remaining != -1 else None)
+                        logger.info(f"[Token] 更新限制: {sso[:10]}..., basic={data.get('remainingTokens', -1)}, video={video_remaining}")
+
+                return data
+
+            # 重试后仍失败或其他错误
+            logger.warning(f"[Token] 获取限制失败: {response.status_code}")
+            if self._extract_sso(auth_token):
+                if response.status_code == 403:
+                    reason = "服务器被Block"
+                elif response.status_code == 401:
+                    reason = "Token失效"
+                else:
+                    reason = f"错误: {response.status_code}"
+                await self.record_failure(auth_token, response.status_code, reason)
+            return None
 
         except Exception as e:
             logger.error(f"[Token] 检查限制错误: {e}")
@@ -488,62 +1099,50 @@ class GrokTokenManager:
         return normal
 
     async def refresh_token_status(self, scope: str = "expired", zero_threshold: int = 3) -> None:
-        """刷新Token状态并处理连续0次数失效"""
-        if not self.token_data:
-            return
+        """刷新Token状态并处理连续0次数失效（有界并发流水线）"""
+        from app.services.grok.refresh import token_refresher
+        await token_refresher.run(scope=scope, zero_threshold=zero_threshold)
 
-        scope = "all" if scope == "all" else "expired"
-        threshold = max(1, int(zero_threshold or 3))
+    async def refresh_one(self, token_type: TokenType, sso: str, zero_threshold: int) -> bool:
+        """刷新单个Token的配额与状态
 
-        total = 0
-        checked = 0
-        for token_type in [TokenType.NORMAL, TokenType.SUPER]:
-            token_map = self.token_data.get(token_type.value, {})
-            total += len(token_map)
-            for sso, data in list(token_map.items()):
-                if scope == "expired" and data.get("status") != "expired":
-                    continue
+        Returns:
+            是否完成检查（Token已被删除或请求异常返回False）
+        """
+        auth_token = f"sso-rw={sso};sso={sso}"
+        await self.check_limits(auth_token, "grok-4-fast")
+        if token_type == TokenType.SUPER:
+            await self.check_limits(auth_token, "grok-4-heavy")
 
-                auth_token = f"sso-rw={sso};sso={sso}"
-                try:
-                    await self.check_limits(auth_token, "grok-4-fast")
-                    if token_type == TokenType.SUPER:
-                        await self.check_limits(auth_token, "grok-4-heavy")
-                except Exception as e:
-                    logger.warning(f"[Token] 刷新失败: {sso[:10]}..., {e}")
-                    continue
+        data = self.token_data.get(token_type.value, {}).get(sso)
+        if not data:
+            return False
 
-                data = self.token_data.get(token_type.value, {}).get(sso)
-                if not data:
-                    continue
+        data.setdefault("zeroCount", 0)
+        normal = data.get("remainingQueries", -1)
+        heavy = data.get("heavyremainingQueries", -1)
+        relevant = self._calc_relevant_remaining(token_type, normal, heavy)
 
-                data.setdefault("zeroCount", 0)
-                normal = data.get("remainingQueries", -1)
-                heavy = data.get("heavyremainingQueries", -1)
-                relevant = self._calc_relevant_remaining(token_type, normal, heavy)
+        if relevant == 0:
+            data["zeroCount"] += 1
+            if data["zeroCount"] >= zero_threshold:
+                data["status"] = "expired"
+                logger.info(f"[Token] 连续0次数失效: {sso[:10]}... ({data['zeroCount']}/{zero_threshold})")
+        else:
+            if data.get("zeroCount", 0) != 0:
+                data["zeroCount"] = 0
+            if data.get("status") == "expired":
+                data["status"] = "active"
+            if data.get("failedCount", 0) != 0:
+                data["failedCount"] = 0
+                data["lastFailureTime"] = None
+                data["lastFailureReason"] = None
 
-                if relevant == 0:
-                    data["zeroCount"] += 1
-                    if data["zeroCount"] >= threshold:
-                        data["status"] = "expired"
-                        logger.info(f"[Token] 连续0次数失效: {sso[:10]}... ({data['zeroCount']}/{threshold})")
-                else:
-                    if data.get("zeroCount", 0) != 0:
-                        data["zeroCount"] = 0
-                    if data.get("status") == "expired":
-                        data["status"] = "active"
-                    if data.get("failedCount", 0) != 0:
-                        data["failedCount"] = 0
-                        data["lastFailureTime"] = None
-                        data["lastFailureReason"] = None
-
-                checked += 1
-                if checked % 10 == 0:
-                    await asyncio.sleep(0.1)
-
-        if checked:
-            self._mark_dirty()
-        logger.info(f"[Token] 状态刷新完成: {checked}/{total} (scope={scope})")
+        # 请求失败时也记录检查时间，续扫与排序以此为准
+        data["lastCheckTime"] = int(time.time() * 1000)
+        self._scheduler.update(token_type.value, sso, data)
+        self._mark_dirty(sso)
+        return True
 
     async def update_limits(self, sso: str, normal: Optional[int] = None, heavy: Optional[int] = None, video: Optional[int] = None) -> None:
         """更新限制"""
@@ -556,13 +1155,69 @@ class GrokTokenManager:
                         self.token_data[token_type][sso]["heavyremainingQueries"] = heavy
                     if video is not None:
                         self.token_data[token_type][sso]["videoRemaining"] = video
-                    self._mark_dirty()  # 批量保存
+                    self.token_data[token_type][sso]["lastCheckTime"] = int(time.time() * 1000)
+                    self._scheduler.update(token_type, sso, self.token_data[token_type][sso])
+                    self._mark_dirty(sso)  # 批量保存
+                    self._park_if_exhausted(token_type, sso, self.token_data[token_type][sso])
                     logger.info(f"[Token] 更新限制: {sso[:10]}...")
                     return
             logger.warning(f"[Token] 未找到: {sso[:10]}...")
         except Exception as e:
             logger.error(f"[Token] 更新限制错误: {e}")
     
+    def consume_quota(self, sso: str, field: str, cost: int) -> Optional[int]:
+        """本地扣减剩余次数（未知配额-1保持不变）
+
+        Returns:
+            扣减后的剩余次数，Token不存在返回None
+        """
+        token_type, data = self._find_token(sso)
+        if data is None:
+            return None
+
+        try:
+            remaining = int(data.get(field, -1))
+        except (TypeError, ValueError):
+            remaining = -1
+
+        slot = self._shared_slot(sso) if self._shared is not None and field in self._shared.fields else None
+        if slot is not None:
+            # 跨worker原子扣减，以共享内存的结果为准
+            remaining = self._shared.consume(slot, field, cost)
+            if data.get(field) != remaining:
+                with self._remote_update():
+                    data[field] = remaining
+                self._scheduler.update(token_type, sso, data)
+                self._mark_dirty(sso)
+                if remaining == 0:
+                    self._park_if_exhausted(token_type, sso, data)
+            return remaining
+
+        if remaining > 0:
+            remaining = max(0, remaining - cost)
+            if self._redis_tokens is not None:
+                # 本地镜像先行扣减，Redis原子扣减后以返回值为准（多节点并发不丢失扣减）
+                with self._remote_update():
+                    data[field] = remaining
+                self._spawn(self._consume_remote(sso, field, cost))
+            else:
+                data[field] = remaining
+                self._mark_dirty(sso)
+            self._scheduler.update(token_type, sso, data)
+            if remaining == 0:
+                self._park_if_exhausted(token_type, sso, data)
+        return remaining
+
+    async def _consume_remote(self, sso: str, field: str, cost: int) -> None:
+        try:
+            result = await self._redis_tokens.consume(sso, field, cost)
+        except Exception as e:
+            logger.error(f"[Token] Redis扣减失败: {e}")
+            return
+        if result:
+            token_type, record, in_flight = result
+            self._apply_remote_record(token_type, sso, record, in_flight)
+    
     async def record_failure(self, auth_token: str, status: int, msg: str) -> None:
         """记录失败"""
         try:
@@ -579,10 +1234,30 @@ class GrokTokenManager:
                 logger.warning(f"[Token] 未找到: {sso[:10]}...")
                 return
 
-            data["failedCount"] = data.get("failedCount", 0) + 1
+            if self._redis_tokens is not None:
+                await self._fail_remote(sso, status, msg)
+                return
+
             data["lastFailureTime"] = int(time.time() * 1000)
             data["lastFailureReason"] = f"{status}: {msg}"
 
+            # 429：指数退避冷却，不计入失效次数
+            if status == RATE_LIMITED:
+                cfg = setting.global_config
+                count = data.get("cooldownCount", 0) + 1
+                data["cooldownCount"] = count
+                base = float(cfg.get("token_cooldown_429", 60) or 60)
+                cap = float(cfg.get("token_cooldown_429_max", 900) or 900)
+                self._park(sso, COOLDOWN_RATE_LIMIT, min(cap, base * 2 ** (count - 1)))
+                return
+
+            slot = self._shared_slot(sso)
+            if slot is None:
+                data["failedCount"] = data.get("failedCount", 0) + 1
+            else:
+                with self._remote_update():
+                    data["failedCount"] = self._shared.add(slot, "failedCount", 1)
+
             logger.warning(
                 f"[Token] 失败: {sso[:10]}... (状态:{status}), "
                 f"次数: {data['failedCount']}/{MAX_FAILURES}, 原因: {msg}"
@@ -592,11 +1267,39 @@ class GrokTokenManager:
                 data["status"] = "expired"
                 logger.error(f"[Token] 标记失效: {sso[:10]}... (连续{status}错误{data['failedCount']}次)")
 
-            self._mark_dirty()  # 批量保存
+            self._sync_index(sso)
+            self._mark_dirty(sso)  # 批量保存
+
+            # 连续5xx：短暂冷却后自动恢复，而不是等待定时刷新
+            if status >= 500 and data["failedCount"] >= MAX_FAILURES:
+                self._park(sso, COOLDOWN_SERVER_ERROR, float(setting.global_config.get("token_cooldown_5xx", 30) or 30))
 
         except Exception as e:
             logger.error(f"[Token] 记录失败错误: {e}")
 
+    async def _fail_remote(self, sso: str, status: int, msg: str) -> None:
+        """Redis模式：失败计数与冷却在Redis原子更新，多节点同时失败不丢失计数"""
+        cfg = setting.global_config
+        result = await self._redis_tokens.fail(
+            sso, status, f"{status}: {msg}",
+            float(cfg.get("token_cooldown_429", 60) or 60),
+            float(cfg.get("token_cooldown_429_max", 900) or 900),
+            float(cfg.get("token_cooldown_5xx", 30) or 30),
+        )
+        if result is None:
+            return
+        token_type, record, in_flight = result
+        self._apply_remote_record(token_type, sso, record, in_flight)
+
+        if status != RATE_LIMITED:
+            failed = record.get("failedCount", 0)
+            logger.warning(f"[Token] 失败: {sso[:10]}... (状态:{status}), 次数: {failed}/{MAX_FAILURES}, 原因: {msg}")
+            if 400 <= status < 500 and record.get("status") == "expired":
+                logger.error(f"[Token] 标记失效: {sso[:10]}... (连续{status}错误{failed}次)")
+        if self._in_cooldown(record):
+            self._cooldown_wakeup.set()
+            logger.info(f"[Token] 冷却: {sso[:10]}... ({record.get('cooldownReason')})")
+
     async def reset_failure(self, auth_token: str) -> None:
         """重置失败计数"""
         try:
@@ -608,16 +1311,101 @@ class GrokTokenManager:
             if not data:
                 return
 
-            if data.get("failedCount", 0) > 0:
+            if data.get("failedCount", 0) > 0 or data.get("cooldownCount", 0) > 0:
                 data["failedCount"] = 0
+                data["cooldownCount"] = 0
                 data["lastFailureTime"] = None
                 data["lastFailureReason"] = None
-                self._mark_dirty()  # 批量保存
+                self._sync_index(sso)
+                self._mark_dirty(sso)  # 批量保存
                 logger.info(f"[Token] 重置失败计数: {sso[:10]}...")
 
         except Exception as e:
             logger.error(f"[Token] 重置失败错误: {e}")
     
+    # === 冷却 ===
+
+    def _park(self, sso: str, reason: str, seconds: float) -> None:
+        """让Token冷却指定时间，期间不参与选择，到期由冷却任务恢复"""
+        _, data = self._find_token(sso)
+        if data is None:
+            return
+        data["cooldownUntil"] = int((time.time() + seconds) * 1000)
+        data["cooldownReason"] = reason
+        self._sync_index(sso)
+        self._mark_dirty(sso)
+        self._cooldown_wakeup.set()
+        logger.info(f"[Token] 冷却: {sso[:10]}... ({reason}, {seconds:.0f}s)")
+
+    def _park_if_exhausted(self, token_type: str, sso: str, data: Dict[str, Any]) -> None:
+        """配额耗尽时按配额窗口冷却"""
+        if self._in_cooldown(data):
+            return
+        relevant = self._calc_relevant_remaining(
+            TokenType(token_type),
+            data.get("remainingQueries", -1),
+            data.get("heavyremainingQueries", -1),
+        )
+        if relevant == 0:
+            self._park(sso, COOLDOWN_QUOTA, float(setting.global_config.get("token_cooldown_quota", 1800) or 1800))
+
+    @staticmethod
+    def _in_cooldown(data: Dict[str, Any]) -> bool:
+        until = data.get("cooldownUntil")
+        return isinstance(until, (int, float)) and until > time.time() * 1000
+
+    async def _cooldown_worker(self) -> None:
+        """在冷却到期时把Token放回选择索引"""
+        logger.info("[Token] 冷却恢复任务已启动")
+        while not self._shutdown:
+            # 其他进程写入的冷却不会唤醒本任务，最多等待 COOLDOWN_POLL 秒
+            due = self._scheduler.next_cooldown()
+            timeout = COOLDOWN_POLL if due is None else min(COOLDOWN_POLL, max(0.0, due / 1000 - time.time()))
+            self._cooldown_wakeup.clear()
+            try:
+                await asyncio.wait_for(self._cooldown_wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+            expired = self._scheduler.pop_cooldowns()
+            if expired:
+                await asyncio.gather(*[self._end_cooldown(sso) for sso in expired], return_exceptions=True)
+
+    async def _end_cooldown(self, sso: str) -> None:
+        """冷却到期：可选探测后恢复，探测仍不可用则再次冷却"""
+        token_type, data = self._find_token(sso)
+        if data is None:
+            return
+        if self._in_cooldown(data):
+            self._sync_index(sso)  # 期间被重新冷却（可能来自其他进程）
+            return
+
+        reason = data.get("cooldownReason")
+        if setting.global_config.get("token_cooldown_probe", True) and data.get("status") != "expired":
+            result = await self.check_limits(f"sso-rw={sso};sso={sso}", "grok-4-fast")
+            token_type, data = self._find_token(sso)
+            if data is None or self._in_cooldown(data):
+                return  # 探测中已被删除或再次冷却（429/配额仍为0）
+            if result is None:
+                seconds = float(setting.global_config.get(
+                    "token_cooldown_5xx" if reason == COOLDOWN_SERVER_ERROR else "token_cooldown_429", 60
+                ) or 60)
+                self._park(sso, reason or COOLDOWN_SERVER_ERROR, seconds)
+                return
+        elif reason == COOLDOWN_QUOTA:
+            # 不探测时标记为未知，由配额对账在首次使用后获取真实值
+            for field in (NORMAL_FIELD, HEAVY_FIELD):
+                if data.get(field) == 0:
+                    data[field] = -1
+
+        data["cooldownUntil"] = None
+        data["cooldownReason"] = None
+        if reason in (COOLDOWN_RATE_LIMIT, COOLDOWN_SERVER_ERROR):
+            data["failedCount"] = 0
+        self._sync_index(sso)
+        self._mark_dirty(sso)
+        logger.info(f"[Token] 冷却结束，恢复可用: {sso[:10]}... ({reason})")
+
     async def update_video_limits(self, sso: str, remaining: int, limit: Optional[int] = None) -> None:
         """更新视频配额
         
@@ -632,7 +1420,7 @@ class GrokTokenManager:
                     self.token_data[token_type][sso]["videoRemaining"] = remaining
                     if limit is not None:
                         self.token_data[token_type][sso]["videoLimit"] = limit
-                    self._mark_dirty()
+                    self._mark_dirty(sso)
                     logger.info(f"[Token] 更新视频配额: {sso[:10]}..., remaining={remaining}")
                     return
             logger.warning(f"[Token] 未找到: {sso[:10]}...")
@@ -647,10 +1435,8 @@ class GrokTokenManager:
         exhausted_tokens = 0
         
         for token_type in [TokenType.NORMAL.value, TokenType.SUPER.value]:
-            for sso, data in self.token_data.get(token_type, {}).items():
-                video_remaining = data.get("videoRemaining", -1)
-                video_limit = data.get("videoLimit", -1)
-                
+            table = self.token_data.get(token_type) or TokenTable()
+            for video_remaining, video_limit in zip(table.column("videoRemaining", -1), table.column("videoLimit", -1)):
                 if video_remaining >= 0:
                     tokens_with_video += 1
                     total_remaining += video_remaining
@@ -0,0 +1,389 @@
+"""共享内存Token状态 - 多worker文件存储时，各worker共享Token的数值状态
+
+段布局（均为 int64）:
+    头部 HEADER 个:      魔数、槽位数、附加进程数、全局变更计数
+    每槽 NF 个:          SSO哈希、剩余次数、Heavy剩余、失败计数、状态、冷却到期、在途数、版本
+    进程表 PROCS 个:     已附加进程的PID（0为空）
+    租约表 PROCS×LEASES: 每个进程持有的租约所在槽位+1（0为空），只由所属进程写入
+
+槽位按 SSO 的64位哈希开放寻址分配，各worker对同一SSO得到相同槽位；
+读取直接访问内存，写入按槽位分条加 fcntl 字节范围锁（进程间互斥）。
+worker异常退出时（uvicorn会重新拉起，其余worker继续映射该段）其租约与附加计数不会归还，
+由其他worker定期按进程表检查存活并回收，与Redis存储按 redis_lease_ttl 回收过期租约对应。
+"""
+
+import os
+import time
+import fcntl
+import hashlib
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.logger import logger
+
+
+MAGIC = 0x47524F4B53484D32  # "GROKSHM2"
+HEADER = 8
+NF = 8
+STRIPES = 64
+DIFF_BLOCK = 512
+PROCS = 64  # 进程表容量
+LEASES = 1024  # 每个进程可登记的在途租约数
+
+# 槽内字段偏移
+KEY, REMAINING, HEAVY, FAILED, STATUS, COOLDOWN, IN_FLIGHT, VERSION = range(NF)
+# 头部字段偏移
+H_MAGIC, H_CAPACITY, H_ATTACHED, H_CHANGES = range(4)
+
+# 共享字段 -> 槽内偏移
+SHARED_FIELDS: Dict[str, int] = {
+    "remainingQueries": REMAINING,
+    "heavyremainingQueries": HEAVY,
+    "failedCount": FAILED,
+    "status": STATUS,
+    "cooldownUntil": COOLDOWN,
+}
+STATUS_CODES = {"active": 1, "expired": 2}  # 0 表示未知（保留本地值）
+_STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+
+def segment_name(data_dir: Path) -> str:
+    """共享内存段名：同一次启动、同一数据目录的所有worker一致（主进程设置环境变量，否则取父进程PID）"""
+    run = os.getenv("GROK2API_SHM_NAME") or str(os.getppid())
+    return f"grok2api_{run}_{hashlib.blake2b(str(data_dir.resolve()).encode(), digest_size=4).hexdigest()}"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _hash(sso: str) -> int:
+    value = int.from_bytes(hashlib.blake2b(sso.encode(), digest_size=8).digest(), "little", signed=True)
+    return value or 1  # 0 表示空槽
+
+
+def encode(field: str, value: Any) -> Optional[int]:
+    """字段值 -> 槽内整数，无法表示时返回None"""
+    if field == "status":
+        return STATUS_CODES.get(value)
+    if field == "cooldownUntil":
+        return int(value) if isinstance(value, (int, float)) and value > 0 else 0
+    if value is None:
+        return -1 if field != "failedCount" else 0
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def decode(field: str, value: int) -> Any:
+    """槽内整数 -> 字段值（状态未知返回None）"""
+    if field == "status":
+        return _STATUS_NAMES.get(value)
+    if field == "cooldownUntil":
+        return value or None
+    return value
+
+
+class SharedTokenState:
+    """多进程共享的Token数值状态"""
+
+    fields = SHARED_FIELDS
+
+    def __init__(self, name: str, capacity: int, lock_file: Path):
+        size = (HEADER + capacity * NF + PROCS * (1 + LEASES)) * 8
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.created = True
+        except FileExistsError:
+            self._shm = self._attach(name)
+            self.created = False
+
+        self._mem = self._shm.buf.cast("q")
+        self._lock_fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        self._slots: Dict[str, int] = {}  # sso -> 槽位（本进程缓存）
+        self._owners: Dict[int, str] = {}  # 槽位 -> sso
+        self._seen_versions: List[int] = []
+        self._seen_in_flight: List[int] = []
+        self._full_warned = False
+        self._pid = os.getpid()
+        self._proc: Optional[int] = None  # 本进程在进程表中的位置
+        self._free: List[int] = list(range(LEASES - 1, -1, -1))  # 本进程空闲的租约登记位
+        self._held: Dict[int, List[int]] = {}  # 槽位 -> 本进程登记的租约位
+        self._leases_warned = False
+
+        mem = self._mem
+        with self._locked(-1):
+            if mem[H_MAGIC] != MAGIC:
+                # 以段的实际大小为上限，避免与创建者配置不同时越界
+                mem[H_CAPACITY] = min(capacity, (len(mem) - HEADER - PROCS * (1 + LEASES)) // NF)
+                mem[H_MAGIC] = MAGIC
+            mem[H_ATTACHED] += 1
+            self.capacity = mem[H_CAPACITY]
+            self._procs = HEADER + self.capacity * NF
+            self._leases = self._procs + PROCS
+            self._register()
+        if self.capacity != capacity:
+            logger.warning(f"[Token] 共享内存槽位数以首个worker为准: {self.capacity}")
+        logger.info(f"[Token] 共享内存状态{'已创建' if self.created else '已连接'}: {name} ({self.capacity} 槽)")
+
+    @staticmethod
+    def _attach(name: str) -> shared_memory.SharedMemory:
+        # 创建者尚未设置段大小时映射会失败，稍后重试
+        for _ in range(50):
+            try:
+                return shared_memory.SharedMemory(name=name)
+            except ValueError:
+                time.sleep(0.01)
+        return shared_memory.SharedMemory(name=name)
+
+    def close(self) -> None:
+        """断开共享内存，最后一个进程负责删除"""
+        with self._locked(-1):
+            if self._proc is not None:
+                self._reap(self._proc)  # 关闭时仍未归还的租约一并释放
+                self._proc = None
+            else:
+                self._mem[H_ATTACHED] -= 1
+            last = self._mem[H_ATTACHED] <= 0
+        self._mem.release()
+        self._shm.close()
+        if last:
+            self._shm.unlink()
+        os.close(self._lock_fd)
+
+    @contextmanager
+    def _locked(self, slot: int) -> Iterator[None]:
+        """按槽位分条加锁（-1为头部锁）"""
+        offset = STRIPES if slot < 0 else slot % STRIPES
+        fcntl.lockf(self._lock_fd, fcntl.LOCK_EX, 1, offset)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, offset)
+
+    # === 进程与租约登记 ===
+
+    def _register(self) -> None:
+        """在进程表登记本进程（需持有头部锁）；同PID的旧记录来自已退出的进程，先回收"""
+        mem, procs = self._mem, self._procs
+        for i in range(PROCS):
+            if mem[procs + i] == self._pid:
+                self._reap(i)
+        for i in range(PROCS):
+            if mem[procs + i] == 0:
+                mem[procs + i] = self._pid
+                for j in range(LEASES):
+                    mem[self._leases + i * LEASES + j] = 0
+                self._proc = i
+                return
+        logger.warning(f"[Token] 共享内存进程表已满（{PROCS}），本进程退出时在途数无法被回收")
+
+    def _reap(self, proc: int) -> int:
+        """释放进程表中一个进程的全部租约并移除该进程（需持有头部锁），返回释放的租约数"""
+        mem = self._mem
+        base = self._leases + proc * LEASES
+        released = 0
+        for j, value in enumerate(mem[base:base + LEASES].tolist()):
+            if value:
+                self._decrement(value - 1)
+                mem[base + j] = 0
+                released += 1
+        mem[self._procs + proc] = 0
+        mem[H_ATTACHED] -= 1
+        return released
+
+    def reap_dead(self) -> int:
+        """回收已退出进程的租约与附加计数，返回回收的租约数"""
+        mem, procs = self._mem, self._procs
+        dead = [
+            i for i, pid in enumerate(mem[procs:procs + PROCS].tolist())
+            if pid and i != self._proc and not _alive(pid)
+        ]
+        if not dead:
+            return 0
+        released = 0
+        with self._locked(-1):
+            for i in dead:
+                pid = mem[procs + i]
+                if not pid or _alive(pid):  # 已被其他进程回收
+                    continue
+                count = self._reap(i)
+                released += count
+                logger.warning(f"[Token] 回收已退出worker的共享内存状态: pid={pid}, 在途租约 {count} 个")
+        return released
+
+    def _record(self, slot: int) -> None:
+        """登记本进程持有的一个租约"""
+        if self._proc is None:
+            return
+        if not self._free:
+            if not self._leases_warned:
+                self._leases_warned = True
+                logger.warning(f"[Token] 本进程在途租约超过 {LEASES} 个，超出部分在进程退出时无法被回收")
+            return
+        entry = self._free.pop()
+        self._mem[self._leases + self._proc * LEASES + entry] = slot + 1
+        self._held.setdefault(slot, []).append(entry)
+
+    def _forget(self, slot: int) -> None:
+        entries = self._held.get(slot)
+        if not entries:
+            return
+        entry = entries.pop()
+        if not entries:
+            del self._held[slot]
+        self._mem[self._leases + self._proc * LEASES + entry] = 0
+        self._free.append(entry)
+
+    def _decrement(self, slot: int) -> int:
+        offset = HEADER + slot * NF + IN_FLIGHT
+        mem = self._mem
+        with self._locked(slot):
+            count = max(0, mem[offset] - 1)
+            mem[offset] = count
+        return count
+
+    def _touch(self, base: int) -> None:
+        mem = self._mem
+        mem[base + VERSION] += 1
+        mem[H_CHANGES] += 1
+
+    # === 槽位 ===
+
+    def slot(self, sso: str, create: bool = True) -> Optional[int]:
+        """SSO对应的槽位，不存在时按需分配；槽位已满返回None"""
+        slot = self._slots.get(sso)
+        if slot is not None:
+            return slot
+
+        key = _hash(sso)
+        mem, capacity = self._mem, self.capacity
+        start = key % capacity
+        for i in range(capacity):
+            candidate = (start + i) % capacity
+            base = HEADER + candidate * NF
+            current = mem[base + KEY]
+            if current == 0 and create:
+                with self._locked(candidate):
+                    current = mem[base + KEY]
+                    if current == 0:
+                        mem[base + KEY] = key
+                        current = key
+            if current == key:
+                self._slots[sso] = candidate
+                self._owners[candidate] = sso
+                return candidate
+            if current == 0:
+                return None
+
+        if not self._full_warned:
+            self._full_warned = True
+            logger.warning(f"[Token] 共享内存槽位已满（{capacity}），新增Token仅在本进程生效，请调大 token_shared_slots")
+        return None
+
+    def is_new(self, slot: int) -> bool:
+        """槽位是否尚未写入过数值"""
+        return self._mem[HEADER + slot * NF + VERSION] == 0
+
+    # === 读写 ===
+
+    def changes(self) -> int:
+        """全局变更计数（任一槽位写入后递增）"""
+        return self._mem[H_CHANGES]
+
+    def changed_tokens(self) -> List[str]:
+        """自上次调用以来数值或在途数变化的Token（仅本进程已解析过槽位的Token）
+
+        按列整段读取版本与在途数，按块比较后只逐个检查有变化的块。
+        """
+        mem, end = self._mem, self._procs
+        versions = mem[HEADER + VERSION:end:NF].tolist()
+        in_flight = mem[HEADER + IN_FLIGHT:end:NF].tolist()
+        seen_versions = self._seen_versions or [0] * len(versions)
+        seen_in_flight = self._seen_in_flight or [0] * len(in_flight)
+        self._seen_versions, self._seen_in_flight = versions, in_flight
+
+        slots = set()
+        for current, seen in ((versions, seen_versions), (in_flight, seen_in_flight)):
+            for start in range(0, len(current), DIFF_BLOCK):
+                end = start + DIFF_BLOCK
+                if current[start:end] != seen[start:end]:
+                    slots.update(i for i in range(start, min(end, len(current))) if current[i] != seen[i])
+
+        owners = self._owners
+        return [owners[slot] for slot in slots if slot in owners]
+
+    def read(self, slot: int) -> Dict[str, Any]:
+        """读取槽位的共享字段（状态未知的字段不返回）"""
+        base = HEADER + slot * NF
+        mem = self._mem
+        values = {}
+        for field, offset in SHARED_FIELDS.items():
+            value = decode(field, mem[base + offset])
+            if value is not None or field == "cooldownUntil":
+                values[field] = value
+        return values
+
+    def in_flight(self, slot: int) -> int:
+        return self._mem[HEADER + slot * NF + IN_FLIGHT]
+
+    def write(self, slot: int, record: Dict[str, Any]) -> None:
+        """写入字段（本地修改/初始化，后写者生效）"""
+        base = HEADER + slot * NF
+        mem = self._mem
+        with self._locked(slot):
+            for field, value in record.items():
+                offset = SHARED_FIELDS.get(field)
+                encoded = None if offset is None else encode(field, value)
+                if encoded is not None:
+                    mem[base + offset] = encoded
+            self._touch(base)
+
+    def add(self, slot: int, field: str, delta: int) -> int:
+        """原子加减计数字段，返回新值"""
+        base = HEADER + slot * NF
+        mem = self._mem
+        with self._locked(slot):
+            value = mem[base + SHARED_FIELDS[field]] + delta
+            mem[base + SHARED_FIELDS[field]] = value
+            self._touch(base)
+        return value
+
+    def consume(self, slot: int, field: str, cost: int) -> int:
+        """原子扣减剩余次数（未知配额-1不变），返回扣减后的值"""
+        base = HEADER + slot * NF
+        offset = base + SHARED_FIELDS[field]
+        mem = self._mem
+        with self._locked(slot):
+            remaining = mem[offset]
+            if remaining > 0:
+                remaining = max(0, remaining - cost)
+                mem[offset] = remaining
+                self._touch(base)
+        return remaining
+
+    def try_acquire(self, slot: int, limit: int) -> Optional[int]:
+        """在途数未达上限（0为不限）时加一，返回新在途数；已满返回None"""
+        offset = HEADER + slot * NF + IN_FLIGHT
+        mem = self._mem
+        with self._locked(slot):
+            count = mem[offset]
+            if limit and count >= limit:
+                return None
+            mem[offset] = count + 1
+        self._record(slot)
+        return count + 1
+
+    def release(self, slot: int) -> int:
+        """在途数减一，返回新在途数"""
+        self._forget(slot)
+        return self._decrement(slot)
@@ -0,0 +1,430 @@
+"""Token表 - 列式存储Token数据，对外保持 dict 接口
+
+每种Token类型一张表：固定整数字段存于 array('q') 列，状态/冷却原因与标签组合
+以驻留ID存于 array('H') / array('I') 列，SSO 字符串只保存一份。
+`table[sso]` 返回轻量视图 TokenRecord，读写直接落到列上，因此
+`token_data[type][sso]["remainingQueries"] = n` 等既有写法无需修改。
+设置 `on_change` 后，经映射接口的写入会回调 (sso, 字段)，整条替换/删除时字段为None。
+"""
+
+import sys
+from array import array
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+# 整数列哨兵：None 与「字段不存在」分别编码
+_NONE = -(2 ** 63)
+_ABSENT = _NONE + 1
+_MISSING = object()  # 文本列「字段不存在」
+
+# 字段 -> 存储类别（顺序即序列化时的key顺序）
+FIELDS: Dict[str, str] = {
+    "createdTime": "int",
+    "remainingQueries": "int",
+    "heavyremainingQueries": "int",
+    "videoRemaining": "int",
+    "videoLimit": "int",
+    "status": "enum",
+    "failedCount": "int",
+    "zeroCount": "int",
+    "lastFailureTime": "int",
+    "lastFailureReason": "text",
+    "lastCheckTime": "int",
+    "cooldownUntil": "int",
+    "cooldownReason": "enum",
+    "cooldownCount": "int",
+    "expiredTime": "int",
+    "tags": "tags",
+    "note": "text",
+}
+
+
+class _Symbols:
+    """值驻留表：值 <-> 小整数ID，ID 0 表示字段不存在"""
+
+    __slots__ = ("values", "ids", "limit")
+
+    def __init__(self, limit: int):
+        self.values: List[Any] = [_MISSING]
+        self.ids: Dict[Any, int] = {}
+        self.limit = limit
+
+    def intern(self, value: Any) -> Optional[int]:
+        """返回值的ID，超出列宽时返回None（由调用方转入溢出字典）"""
+        sid = self.ids.get(value)
+        if sid is None:
+            sid = len(self.values)
+            if sid > self.limit:
+                return None
+            self.values.append(value)
+            self.ids[value] = sid
+        return sid
+
+
+class TokenRecord(MutableMapping):
+    """单个Token的dict视图"""
+
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table: "TokenTable", row: int):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._table._get(self._row, key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self._table._get(self._row, key)
+        return default if value is _MISSING else value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        table = self._table
+        table._set(self._row, key, value)
+        if table.on_change is not None:
+            table.on_change(table._ssos[self._row], key)
+
+    def __delitem__(self, key: str) -> None:
+        table = self._table
+        if not table._delete(self._row, key):
+            raise KeyError(key)
+        if table.on_change is not None:
+            table.on_change(table._ssos[self._row], key)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self._table._get(self._row, key) is not _MISSING
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._table._row_dict(self._row))
+
+    def __len__(self) -> int:
+        return len(self._table._row_dict(self._row))
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, TokenRecord):
+            other = other.copy()
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return self.copy() == dict(other)
+
+    def clear(self) -> None:
+        table = self._table
+        table._clear(self._row)
+        if table.on_change is not None:
+            table.on_change(table._ssos[self._row], None)
+
+    def copy(self) -> Dict[str, Any]:
+        """导出为普通dict"""
+        return self._table._row_dict(self._row)
+
+    to_dict = copy
+
+    def __repr__(self) -> str:
+        return f"TokenRecord({self.copy()!r})"
+
+
+class TokenTable(MutableMapping):
+    """一种Token类型的列式表：sso -> TokenRecord
+
+    删除的行只清空不复用（已取出的视图不会串到其他Token上），重新加载时自然回收。
+    """
+
+    def __init__(self, data: Optional[Mapping] = None):
+        self._rows: Dict[str, int] = {}  # sso -> 行号
+        self._ssos: List[Optional[str]] = []  # 行号 -> sso（已删除为None）
+        self._ints: Dict[str, array] = {name: array("q") for name, kind in FIELDS.items() if kind == "int"}
+        self._enums: Dict[str, array] = {name: array("H") for name, kind in FIELDS.items() if kind == "enum"}
+        self._texts: Dict[str, list] = {name: [] for name, kind in FIELDS.items() if kind == "text"}
+        self._tags = array("I")
+        self._enum_symbols = _Symbols(0xFFFF)
+        self._tag_symbols = _Symbols(0xFFFFFFFF)
+        self._extra: Dict[int, Dict[str, Any]] = {}  # 行号 -> 未建列字段或不符合列类型的值
+        self._dead = 0
+        self.on_change: Optional[Callable[[str, Optional[str]], None]] = None  # 写入回调 (sso, 字段)
+
+        if data:
+            for sso, value in data.items():
+                self[sso] = value
+
+    # === 映射接口 ===
+
+    def __getitem__(self, sso: str) -> TokenRecord:
+        return TokenRecord(self, self._rows[sso])
+
+    def get(self, sso: str, default: Any = None) -> Any:
+        row = self._rows.get(sso)
+        return default if row is None else TokenRecord(self, row)
+
+    def __setitem__(self, sso: str, value: Mapping) -> None:
+        items = list(value.items())  # 先取出，允许用自身视图赋值
+        row = self._rows.get(sso)
+        if row is None:
+            row = self._alloc(sso)
+        else:
+            self._clear(row)
+        for key, item in items:
+            self._set(row, key, item)
+        if self.on_change is not None:
+            self.on_change(sso, None)
+
+    def __delitem__(self, sso: str) -> None:
+        row = self._rows.pop(sso)
+        self._clear(row)
+        self._ssos[row] = None
+        self._dead += 1
+        if self.on_change is not None:
+            self.on_change(sso, None)
+
+    def __contains__(self, sso: object) -> bool:
+        return sso in self._rows
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __repr__(self) -> str:
+        return f"TokenTable({len(self._rows)} tokens)"
+
+    def column(self, key: str, default: Any = None) -> Iterator[Any]:
+        """逐个Token读取单个字段（统计扫描用，不创建视图）"""
+        col = self._ints.get(key)
+        if col is not None:
+            extra = self._extra
+            for row in self._rows.values():
+                value = col[row]
+                if value > _ABSENT:
+                    yield value
+                elif value == _NONE:
+                    yield None
+                else:
+                    values = extra.get(row)
+                    yield default if values is None else values.get(key, default)
+            return
+        get = self._get
+        for row in self._rows.values():
+            value = get(row, key)
+            yield default if value is _MISSING else value
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        """导出为普通嵌套dict（序列化用）"""
+        row_dict = self._row_dict
+        return {sso: row_dict(row) for sso, row in self._rows.items()}
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "rows": len(self._ssos),
+            "tokens": len(self._rows),
+            "dead_rows": self._dead,
+            "symbols": len(self._enum_symbols.values) - 1,
+            "tag_sets": len(self._tag_symbols.values) - 1,
+            "overflow_rows": len(self._extra),
+        }
+
+    # === 二进制导出 / 导入（热启动快照） ===
+
+    def dump(self) -> Tuple[Dict[str, Any], Dict[str, bytes]]:
+        """导出为 (元数据, 列字节)；删除的行在导出时压缩掉"""
+        rows = list(self._rows.values())
+        compact = self._dead > 0
+        remap = {row: i for i, row in enumerate(rows)} if compact else None
+
+        def take(col: array) -> bytes:
+            return array(col.typecode, map(col.__getitem__, rows)).tobytes() if compact else col.tobytes()
+
+        columns = {f"int:{name}": take(col) for name, col in self._ints.items()}
+        columns.update({f"enum:{name}": take(col) for name, col in self._enums.items()})
+        columns["tags"] = take(self._tags)
+
+        texts = {}
+        for name, col in self._texts.items():
+            values = [col[row] for row in rows] if compact else list(col)
+            missing = [i for i, value in enumerate(values) if value is _MISSING]
+            for i in missing:
+                values[i] = None
+            texts[name] = {"values": values, "missing": missing}
+
+        meta = {
+            "ssos": list(self._rows),
+            "enum_symbols": self._enum_symbols.values[1:],
+            "tag_symbols": [list(tags) for tags in self._tag_symbols.values[1:]],
+            "texts": texts,
+            "extra": [[remap[row] if compact else row, values] for row, values in self._extra.items()],
+        }
+        return meta, columns
+
+    @classmethod
+    def load(cls, meta: Dict[str, Any], columns: Mapping) -> "TokenTable":
+        """由 dump() 的结果重建（列字节可为 mmap 的 memoryview）"""
+        table = cls()
+        ssos = [sys.intern(sso) for sso in meta["ssos"]]
+        table._ssos = ssos
+        table._rows = {sso: row for row, sso in enumerate(ssos)}
+
+        for name, col in table._ints.items():
+            col.frombytes(columns[f"int:{name}"])
+        for name, col in table._enums.items():
+            col.frombytes(columns[f"enum:{name}"])
+        table._tags.frombytes(columns["tags"])
+        for col in (*table._ints.values(), *table._enums.values(), table._tags):
+            if len(col) != len(ssos):
+                raise ValueError("列长度与Token数不符")
+
+        for name, text in meta["texts"].items():
+            values = text["values"]
+            for i in text["missing"]:
+                values[i] = _MISSING
+            table._texts[name] = values
+
+        for value in meta["enum_symbols"]:
+            table._enum_symbols.intern(sys.intern(value) if isinstance(value, str) else value)
+        for tags in meta["tag_symbols"]:
+            table._tag_symbols.intern(tuple(sys.intern(t) for t in tags))
+        table._extra = {row: values for row, values in meta["extra"]}
+        return table
+
+    # === 行操作 ===
+
+    def _alloc(self, sso: str) -> int:
+        row = len(self._ssos)
+        self._ssos.append(sso)
+        self._rows[sso] = row
+        for col in self._ints.values():
+            col.append(_ABSENT)
+        for col in self._enums.values():
+            col.append(0)
+        for col in self._texts.values():
+            col.append(_MISSING)
+        self._tags.append(0)
+        return row
+
+    def _clear(self, row: int) -> None:
+        for col in self._ints.values():
+            col[row] = _ABSENT
+        for col in self._enums.values():
+            col[row] = 0
+        for col in self._texts.values():
+            col[row] = _MISSING
+        self._tags[row] = 0
+        self._extra.pop(row, None)
+
+    def _get(self, row: int, key: str) -> Any:
+        col = self._ints.get(key)
+        if col is not None:
+            # 整数列最常读，单独走快路径
+            value = col[row]
+            if value > _ABSENT:
+                return value
+            if value == _NONE:
+                return None
+            kind = None
+        else:
+            kind = FIELDS.get(key)
+        if kind == "enum":
+            sid = self._enums[key][row]
+            if sid:
+                return self._enum_symbols.values[sid]
+        elif kind == "text":
+            value = self._texts[key][row]
+            if value is not _MISSING:
+                return value
+        elif kind == "tags":
+            sid = self._tags[row]
+            if sid:
+                return list(self._tag_symbols.values[sid])
+
+        extra = self._extra.get(row)
+        return _MISSING if extra is None else extra.get(key, _MISSING)
+
+    def _set(self, row: int, key: str, value: Any) -> None:
+        kind = FIELDS.get(key)
+        stored = False
+        if kind == "int":
+            col = self._ints[key]
+            if value is None:
+                col[row], stored = _NONE, True
+            elif type(value) is int and _ABSENT < value < 2 ** 63:
+                col[row], stored = value, True
+            else:
+                col[row] = _ABSENT
+        elif kind == "enum":
+            sid = self._enum_symbols.intern(sys.intern(value)) if isinstance(value, str) else (
+                self._enum_symbols.intern(None) if value is None else None
+            )
+            self._enums[key][row] = sid or 0
+            stored = sid is not None
+        elif kind == "text":
+            self._texts[key][row], stored = value, True
+        elif kind == "tags":
+            sid = None
+            if isinstance(value, (list, tuple)) and all(isinstance(t, str) for t in value):
+                sid = self._tag_symbols.intern(tuple(sys.intern(t) for t in value))
+            self._tags[row] = sid or 0
+            stored = sid is not None
+
+        extra = self._extra.get(row)
+        if stored:
+            if extra is not None:
+                extra.pop(key, None)
+                if not extra:
+                    del self._extra[row]
+        else:
+            if extra is None:
+                extra = self._extra[row] = {}
+            extra[key] = value
+
+    def _delete(self, row: int, key: str) -> bool:
+        existed = self._get(row, key) is not _MISSING
+        kind = FIELDS.get(key)
+        if kind == "int":
+            self._ints[key][row] = _ABSENT
+        elif kind == "enum":
+            self._enums[key][row] = 0
+        elif kind == "text":
+            self._texts[key][row] = _MISSING
+        elif kind == "tags":
+            self._tags[row] = 0
+        extra = self._extra.get(row)
+        if extra is not None:
+            extra.pop(key, None)
+            if not extra:
+                del self._extra[row]
+        return existed
+
+    def _row_dict(self, row: int) -> Dict[str, Any]:
+        """按列组装一行"""
+        out: Dict[str, Any] = {}
+        for key, kind in FIELDS.items():
+            if kind == "int":
+                value = self._ints[key][row]
+                if value == _ABSENT:
+                    continue
+                out[key] = None if value == _NONE else value
+            elif kind == "enum":
+                sid = self._enums[key][row]
+                if sid:
+                    out[key] = self._enum_symbols.values[sid]
+            elif kind == "text":
+                value = self._texts[key][row]
+                if value is not _MISSING:
+                    out[key] = value
+            else:
+                sid = self._tags[row]
+                if sid:
+                    out[key] = list(self._tag_symbols.values[sid])
+        extra = self._extra.get(row)
+        if extra:
+            out.update(extra)
+        return out
+
+
+def to_tables(data: Dict[str, Any], token_types: List[str]) -> Dict[str, Any]:
+    """把规范化后的Token数据中的各类型转换为 TokenTable"""
+    return {
+        key: value if key not in token_types or isinstance(value, TokenTable) else TokenTable(value)
+        for key, value in data.items()
+    }
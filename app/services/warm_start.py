@@ -0,0 +1,166 @@
+"""热启动快照 - 关闭时保存运行时状态，启动时 mmap 读取，重启后不必从零学习
+
+快照 data/warm_state.bin（二进制分段，见 app/core/snapshot.py）包含:
+    tokens:{type}[:{列}]  列式Token表的原始列（仅文件存储，且快照之后 token.json 未被替换时使用）
+    scheduler             选择索引、冷却堆与轮转/LRU位置
+    quota                 对账时间、累计扣减与未完成的对账队列
+    proxy                 代理延迟统计与代理池API最近取得的代理
+
+任一部分不可用时该部分回退为常规加载，不影响启动。
+"""
+
+import sys
+import time
+import asyncio
+import orjson
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import setting
+from app.core.logger import logger
+from app.core.snapshot import Snapshot, SnapshotError, open_snapshot, write_snapshot
+from app.models.grok_models import TokenType
+from app.services.grok.token_table import FIELDS, TokenTable
+
+
+# 常量
+SNAPSHOT_FILE = Path(__file__).parents[2] / "data" / "warm_state.bin"
+SNAPSHOT_VERSION = 1
+_TYPES = (TokenType.NORMAL.value, TokenType.SUPER.value)
+
+
+def _cursor(value: Any) -> Optional[tuple]:
+    """JSON中的文件游标 -> TokenCursor 元组"""
+    if not value:
+        return None
+    sig, journal_ino, offset = value
+    return (tuple(sig) if sig else None, journal_ino, offset)
+
+
+class WarmStart:
+    """热启动快照的读写"""
+
+    def __init__(self, path: Path = SNAPSHOT_FILE):
+        self.path = path
+        self._snapshot: Optional[Snapshot] = None
+        self._meta: Dict[str, Any] = {}
+        self.restored: Dict[str, bool] = {}  # 各部分是否由快照恢复
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(setting.global_config.get("warm_restart", True))
+
+    # === 读取 ===
+
+    def open(self) -> bool:
+        """打开快照（不存在、版本不符或已损坏时返回False）"""
+        if not self.enabled():
+            return False
+        try:
+            self._snapshot = open_snapshot(self.path, SNAPSHOT_VERSION)
+            if self._snapshot is None:
+                return False
+            self._meta = orjson.loads(self._snapshot.section("meta"))
+        except (SnapshotError, OSError, ValueError, KeyError) as e:
+            logger.warning(f"[WarmStart] 快照不可用，使用常规加载: {e}")
+            self.close()
+            return False
+        age = time.time() - self._snapshot.created_ms / 1000
+        logger.info(f"[WarmStart] 已映射快照: {self.path.name} ({age:.0f}s 前写入)")
+        return True
+
+    def json(self, name: str) -> Optional[Any]:
+        """读取JSON段（缺失或损坏返回None）"""
+        if self._snapshot is None:
+            return None
+        try:
+            data = self._snapshot.get(name)
+            return None if data is None else orjson.loads(data)
+        except (SnapshotError, ValueError) as e:
+            logger.warning(f"[WarmStart] 快照段 {name} 不可用: {e}")
+            return None
+
+    def token_tables(self) -> Optional[Tuple[tuple, Dict[str, TokenTable]]]:
+        """快照中的Token表与对应的文件游标（列布局或字节序不同时返回None）"""
+        cursor = _cursor(self._meta.get("token_cursor"))
+        if (
+            self._snapshot is None or cursor is None
+            or self._meta.get("fields") != list(FIELDS) or self._meta.get("byteorder") != sys.byteorder
+        ):
+            return None
+        try:
+            tables = {}
+            snapshot = self._snapshot
+            for token_type in _TYPES:
+                prefix = f"tokens:{token_type}"
+                meta = orjson.loads(snapshot.section(prefix))
+                columns = {}
+                for name in snapshot.names():
+                    if name.startswith(prefix + ":"):
+                        view = snapshot.section(name)
+                        columns[name[len(prefix) + 1:]] = view
+                tables[token_type] = TokenTable.load(meta, columns)
+                for view in columns.values():
+                    view.release()
+            return cursor, tables
+        except (SnapshotError, ValueError, KeyError) as e:
+            logger.warning(f"[WarmStart] Token表快照不可用: {e}")
+            return None
+
+    def restore_services(self) -> None:
+        """恢复配额对账与代理运行时状态（在代理池加载配置与绑定之后调用）"""
+        from app.core.proxy_pool import proxy_pool
+        from app.services.grok.quota import quota_manager
+
+        quota = self.json("quota")
+        if quota is not None:
+            quota_manager.restore_state(quota)
+            self.restored["quota"] = True
+        proxy = self.json("proxy")
+        if proxy is not None:
+            proxy_pool.restore_runtime(proxy)
+            self.restored["proxy"] = True
+
+    def close(self) -> None:
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+
+    # === 写入 ===
+
+    async def save(self) -> None:
+        """写入快照（在Token管理器关闭、数据落盘之后调用）"""
+        if not self.enabled():
+            return
+        from app.core.proxy_pool import proxy_pool
+        from app.services.grok.quota import quota_manager
+        from app.services.grok.token import token_manager
+
+        t0 = time.perf_counter()
+        sections: Dict[str, bytes] = {}
+        meta: Dict[str, Any] = {"fields": list(FIELDS), "byteorder": sys.byteorder, "token_cursor": None}
+
+        tables = await token_manager.warm_tables()
+        if tables is not None:
+            meta["token_cursor"], token_data = tables
+            for token_type in _TYPES:
+                table_meta, columns = token_data[token_type].dump()
+                sections[f"tokens:{token_type}"] = orjson.dumps(table_meta)
+                for name, payload in columns.items():
+                    sections[f"tokens:{token_type}:{name}"] = payload
+
+        sections["scheduler"] = orjson.dumps(token_manager._scheduler.export_state())
+        sections["quota"] = orjson.dumps(quota_manager.export_state())
+        sections["proxy"] = orjson.dumps(proxy_pool.export_runtime())
+        sections["meta"] = orjson.dumps(meta)
+
+        try:
+            size = await asyncio.to_thread(write_snapshot, self.path, sections, SNAPSHOT_VERSION)
+        except Exception as e:
+            logger.error(f"[WarmStart] 写入快照失败: {e}")
+            return
+        logger.info(f"[WarmStart] 快照已写入: {size / 1024:.1f}KB, 耗时 {(time.perf_counter() - t0) * 1000:.0f}ms")
+
+
+# 全局实例
+warm_start = WarmStart()
@@ -0,0 +1,7 @@
+"""性能基准 - 仅依赖标准库与项目本身，在仓库根目录以模块方式运行：
+
+    python -m benchmarks.token_select      Token选择：索引 vs 全量扫描（100 / 1万 / 10万个Token）
+    python -m benchmarks.token_memory      Token内存：嵌套字典 vs TokenTable 的RSS（1万 / 10万个Token）
+    python -m benchmarks.proxy_select      代理选择：异构代理下轮询 vs 二选一的延迟分布与 _pick 耗时
+    python -m benchmarks.proxy_persist     代理状态保存：不同请求速率下每次请求写入 vs 合并保存的写入次数
+"""
@@ -0,0 +1,91 @@
+"""代理状态保存基准 - 不同请求速率下 proxy_state.json 的写入次数：合并保存 vs 旧版每次请求写一次
+
+100个代理，按目标速率调用 mark_success / mark_failure（约1%失败），统计 FileStorage.save_proxy_state 调用次数：
+
+    python -m benchmarks.proxy_persist [--rates 10 100 1000] [--seconds 5] [--fail-rate 0.01]
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict
+
+from app.core.proxy_pool import ProxyPool
+from app.core.storage import FileStorage
+
+
+MODES = ("naive", "coalesced")
+PROXIES = [f"http://10.0.{i // 250}.{i % 250}:8080" for i in range(100)]
+
+
+async def simulate(mode: str, rate: int, seconds: float, fail_rate: float) -> Dict[str, float]:
+    """按 rate 次/秒标记代理成功或失败，返回请求数、写入次数与耗时
+
+    Args:
+        mode: naive 为旧版行为（每次标记都新建一个保存任务），coalesced 为后台按间隔合并保存
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = FileStorage(Path(tmp))
+        await storage.init_db()
+        writes = 0
+        save = storage.save_proxy_state
+
+        async def counted(data) -> None:
+            nonlocal writes
+            writes += 1
+            await save(data)
+
+        storage.save_proxy_state = counted
+        pool = ProxyPool()
+        pool.set_storage(storage)
+        for url in PROXIES:
+            pool.add_proxy(url)
+        await pool.load_state()
+        if mode == "coalesced":
+            await pool.start_persist()
+
+        rnd = random.Random(1)
+        loop = asyncio.get_running_loop()
+        pending = set()
+        calls = 0
+        t0 = time.monotonic()
+        while (elapsed := time.monotonic() - t0) < seconds:
+            while calls < int(elapsed * rate):  # 按目标速率补齐本轮的请求
+                url = rnd.choice(PROXIES)
+                (pool.mark_failure if rnd.random() < fail_rate else pool.mark_success)(url)
+                if mode == "naive":
+                    task = loop.create_task(pool._persist_state())
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                calls += 1
+            await asyncio.sleep(0.001)
+
+        await asyncio.gather(*pending, return_exceptions=True)
+        await pool.shutdown()
+        return {"calls": calls, "writes": writes, "elapsed": time.monotonic() - t0}
+
+
+async def run(args: argparse.Namespace) -> None:
+    print(f"{'req/s':>6}  {'mode':<10} {'requests':>9} {'writes':>7} {'writes/s':>9}")
+    for rate in args.rates:
+        for mode in MODES:
+            r = await simulate(mode, rate, args.seconds, args.fail_rate)
+            print(f"{rate:>6}  {mode:<10} {r['calls']:>9} {r['writes']:>7} {r['writes'] / r['elapsed']:>9.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rates", type=int, nargs="+", default=[10, 100, 1000], help="每秒请求数")
+    parser.add_argument("--seconds", type=float, default=5, help="每种情况的运行时长")
+    parser.add_argument("--fail-rate", type=float, default=0.01, help="标记失败的比例")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)  # 屏蔽代理池日志
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
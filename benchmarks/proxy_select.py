@@ -0,0 +1,127 @@
+"""代理选择基准 - 异构代理下轮询与二选一（按延迟/成功率评分）的请求延迟分布，以及 _pick 的单次耗时
+
+模拟10个代理：3个80ms、3个300ms、2个1s、1个握手3s、1个100ms但30%失败；
+每个请求按代理的首字节延迟（对数正态抖动）休眠，时间按 --scale 压缩：
+
+    python -m benchmarks.proxy_select [--requests 4000] [--concurrency 32] [--scale 0.02]
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import time
+from typing import Dict, Tuple
+
+from app.core.proxy_pool import ProxyPool
+
+
+# url -> (首字节延迟秒, 握手耗时秒, 失败率)
+PROFILE: Dict[str, Tuple[float, float, float]] = {
+    **{f"http://fast{i}:8080": (0.08, 0.05, 0.0) for i in range(3)},
+    **{f"http://mid{i}:8080": (0.3, 0.1, 0.0) for i in range(3)},
+    **{f"http://slow{i}:8080": (1.0, 0.2, 0.0) for i in range(2)},
+    "http://handshake:8080": (3.0, 3.0, 0.0),
+    "http://flaky:8080": (0.1, 0.05, 0.3),
+}
+MODES = ("rr", "p2c")
+
+
+def make_pool() -> ProxyPool:
+    pool = ProxyPool()
+    for url in PROFILE:
+        pool.add_proxy(url)
+    return pool
+
+
+async def simulate(mode: str, requests: int, concurrency: int, scale: float, seed: int = 1) -> Dict[str, object]:
+    """按给定选择方式发出 requests 个模拟请求，返回延迟分位、失败率与各代理占比
+
+    Args:
+        mode: rr 为按健康列表轮询（旧版），p2c 为 ProxyPool._select_proxy
+        scale: 模拟时间压缩比例（只影响墙钟时间，统计按未压缩的延迟）
+    """
+    rnd = random.Random(seed)
+    pool = make_pool()
+    counter = 0
+    latencies, failures, used = [], 0, {}
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        nonlocal counter, failures
+        if mode == "rr":
+            healthy = list(pool._healthy)
+            url = healthy[counter % len(healthy)]
+            counter += 1
+        else:
+            url = await pool._select_proxy()
+        used[url] = used.get(url, 0) + 1
+        ttfb, connect, fail_rate = PROFILE[url]
+        elapsed = ttfb * rnd.lognormvariate(0, 0.3)
+        await asyncio.sleep(elapsed * scale)
+        if rnd.random() < fail_rate:
+            failures += 1
+            pool.observe(url, 0)
+            return
+        latencies.append(elapsed)
+        pool.observe(url, 200, elapsed, connect)
+
+    async def guarded() -> None:
+        async with sem:
+            await one()
+
+    await asyncio.gather(*[guarded() for _ in range(requests)])
+    latencies.sort()
+    return {
+        "mean": statistics.mean(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p90": latencies[int(len(latencies) * 0.9)],
+        "p99": latencies[int(len(latencies) * 0.99)],
+        "fail": failures / requests,
+        "share": {url.split("//")[1].split(":")[0]: used.get(url, 0) / requests for url in PROFILE},
+    }
+
+
+def bench_pick(proxies: int, iterations: int) -> float:
+    """_pick 的平均耗时（微秒）"""
+    pool = ProxyPool()
+    for i in range(proxies):
+        pool.add_proxy(f"http://p{i}:8080")
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        pool._pick()
+    return (time.perf_counter() - t0) / iterations * 1e6
+
+
+async def run(args: argparse.Namespace) -> None:
+    print(f"{'mode':<5} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'fail':>6}")
+    shares = {}
+    for mode in MODES:
+        r = await simulate(mode, args.requests, args.concurrency, args.scale)
+        shares[mode] = r["share"]
+        print(
+            f"{mode:<5} " + " ".join(f"{r[k] * 1000:>6.0f}ms" for k in ("mean", "p50", "p90", "p99"))
+            + f" {r['fail']:>6.1%}"
+        )
+    print()
+    print(f"{'proxy':<10} " + " ".join(f"{mode:>6}" for mode in MODES))
+    for name in shares[MODES[0]]:
+        print(f"{name:<10} " + " ".join(f"{shares[mode][name]:>6.1%}" for mode in MODES))
+    print()
+    for n in (len(PROFILE), 5000):
+        print(f"_pick ({n} proxies): {bench_pick(n, 100_000):.2f}us")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--scale", type=float, default=0.02, help="模拟时间压缩比例")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)  # 屏蔽代理池日志
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Token内存基准 - 旧版嵌套字典与 TokenTable 在 1万 / 10万个Token时的RSS与Python堆占用
+
+每个 (存储方式, 规模) 在独立子进程中测量，避免前一轮释放的内存影响RSS；
+tracemalloc 自身也占内存，堆占用与RSS分两个子进程测量：
+
+    python -m benchmarks.token_memory [--sizes 10000 100000]
+"""
+
+import argparse
+import gc
+import json
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict
+
+
+MODES = ("dict", "table")
+
+
+def rss_mb() -> float:
+    """当前进程RSS（MB）；非Linux时退化为峰值RSS"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def make_record(rnd: random.Random, i: int) -> Dict[str, Any]:
+    return {
+        "createdTime": 1760000000000 + i,
+        "remainingQueries": rnd.choice([-1, 0, 5, 80]),
+        "heavyremainingQueries": -1,
+        "videoRemaining": -1,
+        "videoLimit": -1,
+        "status": rnd.choice(["active", "expired"]),
+        "failedCount": 0,
+        "zeroCount": 0,
+        "lastFailureTime": None,
+        "lastFailureReason": None,
+        "lastCheckTime": 1760000000000 + i * 7,
+        "cooldownUntil": None,
+        "cooldownReason": None,
+        "tags": rnd.choice([[], ["pool-a"], ["pool-b", "vip"]]),
+        "note": "",
+    }
+
+
+def intern_keys(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """与 orjson 的key缓存一致：各记录共用同一组字段名字符串"""
+    return {sys.intern(k): v for k, v in obj.items()}
+
+
+def measure(mode: str, n: int, trace: bool) -> Dict[str, float]:
+    """按从 token.json 加载的方式逐条解析写入（SSO约180字节），返回内存与扫描耗时
+
+    Args:
+        trace: 用 tracemalloc 统计Python堆占用（此时RSS不准确）
+    """
+    from app.services.grok.token_table import TokenTable
+
+    rnd = random.Random(1)
+    gc.collect()
+    base = rss_mb()
+    if trace:
+        tracemalloc.start()
+    data = {} if mode == "dict" else TokenTable()
+    for i in range(n):
+        data[f"eyJ{i:08d}" + "x" * 170] = json.loads(json.dumps(make_record(rnd, i)), object_hook=intern_keys)
+    gc.collect()
+    heap = tracemalloc.get_traced_memory()[0] / 2 ** 20 if trace else 0.0
+    tracemalloc.stop()
+    rss = rss_mb() - base
+
+    t0 = time.perf_counter()
+    if mode == "dict":
+        sum(v.get("remainingQueries", -1) for v in data.values())
+    else:
+        sum(data.column("remainingQueries", -1))
+    return {"heap": heap, "rss": rss, "scan_ms": (time.perf_counter() - t0) * 1000}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--case", nargs=3, metavar=("MODE", "N", "TRACE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        mode, n, trace = args.case
+        print(json.dumps(measure(mode, int(n), trace == "1")))
+        return
+
+    def run(mode: str, n: int, trace: bool) -> Dict[str, float]:
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.token_memory", "--case", mode, str(n), str(int(trace))],
+            capture_output=True, text=True, check=True,
+        )
+        return json.loads(out.stdout.strip().splitlines()[-1])
+
+    print(f"{'tokens':>8}  {'mode':<6} {'heap':>9} {'RSS':>9} {'scan':>9}")
+    for n in args.sizes:
+        for mode in MODES:
+            heap = run(mode, n, True)["heap"]
+            result = run(mode, n, False)
+            print(f"{n:>8}  {mode:<6} {heap:>7.1f}MB {result['rss']:>7.1f}MB {result['scan_ms']:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
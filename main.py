@@ -2,6 +2,7 @@
 
 import os
 import sys
+import time
 from contextlib import asynccontextmanager
 from pathlib import Path
 
@@ -12,8 +13,11 @@ from app.core.logger import logger
 from app.core.exception import register_exception_handlers
 from app.core.storage import storage_manager
 from app.core.config import setting
+from app.core.session_pool import session_pool
 from app.services.grok.token import token_manager
+from app.services.grok.quota import quota_manager
 from app.services.call_log import call_log_service
+from app.services.warm_start import warm_start
 from app.api.v1.chat import router as chat_router
 from app.api.v1.models import router as models_router
 from app.api.v1.images import router as images_router
@@ -50,6 +54,8 @@ async def lifespan(app: FastAPI):
     3. 关闭核心服务
     """
     # --- 启动过程 ---
+    started = time.perf_counter()
+
     # 1. 初始化核心服务
     await storage_manager.init()
 
@@ -70,8 +76,9 @@ async def lifespan(app: FastAPI):
     proxy_pool.set_storage(storage)
     proxy_pool.configure(proxy_url, proxy_pool_url, proxy_pool_interval)
     
-    # 3. 异步加载 token 数据
-    await token_manager._load_data()
+    # 3. 异步加载 token 数据（有热启动快照时直接装载Token表与选择索引）
+    warm_start.open()
+    await token_manager._load_data(warm_start)
     logger.info("[Grok2API] Token数据加载完成")
     
     # 4. 启动批量保存任务
@@ -79,6 +86,15 @@ async def lifespan(app: FastAPI):
 
     # 4.1. 启动Token状态刷新任务
     await token_manager.start_status_refresh()
+
+    # 4.2. 启动多进程Token文件同步任务（仅文件存储）
+    await token_manager.start_file_sync()
+
+    # 4.3. 启动配额对账任务
+    await quota_manager.start()
+
+    # 4.4. 启动Token冷却恢复任务
+    await token_manager.start_cooldown()
     
     # 4.5. 启动调用日志服务
     log_max_count = setting.global_config.get("log_max_count", 10000)
@@ -97,12 +113,33 @@ async def lifespan(app: FastAPI):
     # 4.7. 恢复代理绑定状态
     await proxy_pool.load_state()
 
+    # 4.7.1. 恢复配额对账与代理延迟统计等运行时状态，释放快照映射
+    warm_start.restore_services()
+    warm_start.close()
+
+    # 4.8. 配置上游会话池（可选预热健康代理）
+    session_pool.configure(
+        idle_timeout=setting.grok_config.get("session_idle_timeout", 300),
+        max_clients=setting.grok_config.get("session_max_clients", 100),
+        http2=setting.grok_config.get("session_http2", True),
+    )
+    if setting.grok_config.get("session_prewarm", False):
+        healthy = [p["url"] for p in proxy_pool.get_all_proxies() if p.get("healthy")]
+        await session_pool.prewarm(healthy or [""])
+
+    # 4.9. 启动代理主动探测、代理池预取、跨节点健康同步与状态保存任务
+    await proxy_pool.start_prober()
+    await proxy_pool.start_prefetch()
+    await proxy_pool.start_health_sync()
+    await proxy_pool.start_persist()
+
     # 5. 管理MCP服务的生命周期
     mcp_lifespan_context = mcp_app.lifespan(app)
     await mcp_lifespan_context.__aenter__()
     logger.info("[MCP] MCP服务初始化完成")
 
-    logger.info("[Grok2API] 应用启动成功")
+    restored = ", ".join(warm_start.restored) or "无"
+    logger.info(f"[Grok2API] 应用启动成功，耗时 {(time.perf_counter() - started) * 1000:.0f}ms（热启动恢复: {restored}）")
     
     try:
         yield
@@ -112,13 +149,21 @@ async def lifespan(app: FastAPI):
         await mcp_lifespan_context.__aexit__(None, None, None)
         logger.info("[MCP] MCP服务已关闭")
         
-        # 2. 关闭批量保存任务并刷新数据
-        await token_manager.shutdown()
+        # 2. 关闭配额对账、批量保存任务并刷新数据
+        await quota_manager.shutdown()
+        await token_manager.shutdown(compact=not warm_start.enabled())
         logger.info("[Token] Token管理器已关闭")
+
+        # 2.1. 写入热启动快照
+        await warm_start.save()
         
         # 2.5. 关闭调用日志服务
         await call_log_service.shutdown()
         logger.info("[CallLog] 调用日志服务已关闭")
+
+        # 2.6. 停止代理探测并写入代理状态，关闭上游会话池
+        await proxy_pool.shutdown()
+        await session_pool.close()
         
         # 3. 关闭核心服务
         await storage_manager.close()
@@ -177,6 +222,9 @@ if __name__ == "__main__":
     # 读取 worker 数量，默认为 1
     workers = int(os.getenv("WORKERS", "1"))
     
+    # 各worker据此连接同一个共享内存段（token_shared_memory）
+    os.environ.setdefault("GROK2API_SHM_NAME", str(os.getpid()))
+
     # 提示多进程模式
     if workers > 1:
         logger.info(
@@ -0,0 +1,243 @@
+"""代理主动探测测试：本地替身（目标HTTP服务、HTTP代理、SOCKS5代理、黑洞）上验证探测结果、
+连续失败降级、恢复后提前回到健康集合，以及批量测试接口的NDJSON输出"""
+
+import asyncio
+import struct
+import threading
+
+import orjson
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.admin import manage
+from app.core.config import setting
+from app.core.proxy_pool import MAX_FAIL_COUNT, PROBE_INFOS, ProxyPool
+from app.core.session_pool import DEFAULT_BROWSER
+from curl_cffi.requests import AsyncSession
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _target(reader, writer) -> None:
+    """探测目标：任何请求都返回200"""
+    await reader.readuntil(b"\r\n\r\n")
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok")
+    await writer.drain()
+    writer.close()
+
+
+async def _blackhole(reader, writer) -> None:
+    """接受连接但从不响应"""
+    await reader.read()
+    writer.close()
+
+
+class StandIns:
+    """在后台线程事件循环中运行的替身服务（探测与 TestClient 各自使用自己的事件循环）"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.ports = {}
+        self.broken = False  # 为True时 switch 代理表现为黑洞
+
+    def start(self) -> None:
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        handlers = {
+            "target": _target,
+            "http": self._http_proxy,
+            "socks5": self._socks5,
+            "blackhole": _blackhole,
+            "switch": self._switch,
+        }
+        for name, handler in handlers.items():
+            server = asyncio.run_coroutine_threadsafe(
+                asyncio.start_server(handler, "127.0.0.1", 0), self.loop
+            ).result(5)
+            self.ports[name] = server.sockets[0].getsockname()[1]
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def url(self, name: str) -> str:
+        scheme = "socks5h" if name == "socks5" else "http"
+        return f"{scheme}://127.0.0.1:{self.ports[name]}"
+
+    async def _http_proxy(self, reader, writer) -> None:
+        """HTTP代理：支持 CONNECT 隧道与绝对URI转发"""
+        head = await reader.readuntil(b"\r\n\r\n")
+        method, uri, _ = head.split(b"\r\n", 1)[0].decode().split(" ")
+        if method == "CONNECT":
+            host, port = uri.rsplit(":", 1)
+            upstream_reader, upstream_writer = await asyncio.open_connection(host, int(port))
+            writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+            await writer.drain()
+        else:
+            host, _, port = uri.split("/")[2].partition(":")
+            upstream_reader, upstream_writer = await asyncio.open_connection(host, int(port or 80))
+            path = "/" + uri.split("/", 3)[3] if uri.count("/") >= 3 else "/"
+            upstream_writer.write(head.replace(uri.encode(), path.encode(), 1))
+            await upstream_writer.drain()
+        await asyncio.gather(_pipe(reader, upstream_writer), _pipe(upstream_reader, writer))
+
+    async def _socks5(self, reader, writer) -> None:
+        """SOCKS5代理（无认证，仅 CONNECT）"""
+        methods = (await reader.readexactly(2))[1]
+        await reader.readexactly(methods)
+        writer.write(b"\x05\x00")
+        await writer.drain()
+        _, _, _, atyp = await reader.readexactly(4)
+        if atyp == 1:
+            host = ".".join(str(b) for b in await reader.readexactly(4))
+        else:
+            host = (await reader.readexactly((await reader.readexactly(1))[0])).decode()
+        port = struct.unpack(">H", await reader.readexactly(2))[0]
+        upstream_reader, upstream_writer = await asyncio.open_connection(host, port)
+        writer.write(b"\x05\x00\x00\x01" + bytes(6))
+        await writer.drain()
+        await asyncio.gather(_pipe(reader, upstream_writer), _pipe(upstream_reader, writer))
+
+    async def _switch(self, reader, writer) -> None:
+        if self.broken:
+            await _blackhole(reader, writer)
+        else:
+            await self._http_proxy(reader, writer)
+
+
+@pytest.fixture(scope="module")
+def standins():
+    servers = StandIns()
+    servers.start()
+    yield servers
+    servers.stop()
+
+
+@pytest.fixture
+def probe_config(standins, monkeypatch):
+    """探测指向本地目标，超时1秒，连续2次失败降级，不共享健康状态"""
+    for name in ("NO_PROXY", "no_proxy", "ALL_PROXY", "all_proxy"):
+        monkeypatch.delenv(name, raising=False)
+    for key, value in {
+        "proxy_probe_url": f"http://127.0.0.1:{standins.ports['target']}/",
+        "proxy_probe_timeout": 1,
+        "proxy_probe_failures": 2,
+        "proxy_probe_concurrency": 4,
+        "proxy_health_shared": False,
+    }.items():
+        monkeypatch.setitem(setting.grok_config, key, value)
+    standins.broken = False
+    yield standins
+    standins.broken = False
+
+
+def _pool(*urls: str) -> ProxyPool:
+    pool = ProxyPool()
+    for url in urls:
+        assert pool.add_proxy(url)
+    return pool
+
+
+def test_probe_measures_and_flags_unreachable(probe_config):
+    urls = {name: probe_config.url(name) for name in ("http", "socks5", "blackhole")}
+    pool = _pool(*urls.values())
+
+    async def main():
+        session = AsyncSession(impersonate=DEFAULT_BROWSER, curl_infos=PROBE_INFOS)
+        try:
+            return {name: await pool.probe(url, session) for name, url in urls.items()}
+        finally:
+            await session.close()
+
+    results = asyncio.run(main())
+    for name in ("http", "socks5"):
+        result = results[name]
+        assert result["ok"] and result["status"] == 200, result
+        assert result["ttfb_ms"] is not None and result["streak"] == 0
+        assert result["healthy"]
+        assert pool._latency[urls[name]].ttfb is not None  # 探测延迟计入评分
+    hole = results["blackhole"]
+    assert not hole["ok"] and hole["status"] == 0 and hole["error"]
+    assert hole["streak"] == 1 and hole["healthy"]  # 单次失败未达到阈值
+
+
+def test_probe_all_demotes_then_recovers(probe_config):
+    good = [probe_config.url("http"), probe_config.url("socks5")]
+    switch = probe_config.url("switch")
+    pool = _pool(*good, switch)
+
+    async def round_():
+        return {r["url"]: r async for r in pool.probe_all()}
+
+    probe_config.broken = True
+    first = asyncio.run(round_())
+    assert first[switch]["streak"] == 1 and switch in pool._healthy
+
+    second = asyncio.run(round_())
+    assert second[switch]["streak"] == 2 and not second[switch]["healthy"]
+    assert switch not in pool._healthy and not pool._proxies[switch].healthy
+    assert all(first[url]["ok"] and second[url]["ok"] for url in good)
+    assert sorted(pool._healthy) == sorted(good)
+
+    probe_config.broken = False
+    third = asyncio.run(round_())
+    assert third[switch]["ok"] and third[switch]["streak"] == 0 and third[switch]["healthy"]
+    assert switch in pool._healthy and pool._proxies[switch].fail_count == 0
+    assert pool.get_probe_stats()["rounds"] == 3
+
+
+def test_probe_failure_threshold_and_success_reset():
+    url = "http://127.0.0.1:9"
+    pool = _pool(url)
+    pool._sso_assignments["sso1"] = url
+    pool._proxies[url].assigned_sso = ["sso1"]
+
+    pool._probe_failure(url, streak=1, threshold=2)
+    assert pool._proxies[url].healthy and pool._proxies[url].fail_count == 1
+
+    pool._probe_failure(url, streak=2, threshold=2)
+    assert not pool._proxies[url].healthy and url not in pool._healthy
+    assert "sso1" not in pool._sso_assignments  # 降级时解绑SSO
+
+    pool._probe_success(url)
+    assert pool._proxies[url].healthy and pool._proxies[url].fail_count == 0
+    assert url in pool._healthy
+
+    # 阈值很高时，累计失败达到 MAX_FAIL_COUNT 同样降级
+    for streak in range(1, MAX_FAIL_COUNT + 1):
+        pool._probe_failure(url, streak=streak, threshold=100)
+    assert not pool._proxies[url].healthy
+
+
+def test_bulk_endpoint_streams_ndjson(probe_config, monkeypatch):
+    pooled = [probe_config.url("http"), probe_config.url("socks5"), probe_config.url("blackhole")]
+    outsider = f"http://127.0.0.1:{probe_config.ports['http']}/"  # 未加入代理池，只测试不记录
+    pool = _pool(*pooled)
+    monkeypatch.setattr(manage, "proxy_pool", pool)
+
+    app = FastAPI()
+    app.include_router(manage.router)
+    app.dependency_overrides[manage.verify_admin_session] = lambda: True
+
+    with TestClient(app) as client:
+        response = client.post("/api/proxies/test/bulk", json={"urls": pooled + [outsider]})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = [orjson.loads(line) for line in response.text.splitlines()]
+    results, summary = lines[:-1], lines[-1]
+    assert sorted(r["url"] for r in results) == sorted(pooled + [outsider])
+    assert summary == {"done": True, "total": 4, "ok": 3}
+
+    by_url = {r["url"]: r for r in results}
+    assert not by_url[pooled[2]]["ok"] and by_url[pooled[2]]["streak"] == 1
+    assert by_url[outsider]["ok"] and "healthy" not in by_url[outsider]
+    assert outsider not in pool._proxies
@@ -0,0 +1,217 @@
+"""Redis代理健康共享测试：多个节点（各自的 ProxyPool 与 Redis 连接，含多个 worker 进程）
+经 RedisProxyHealth.report / listen 互相同步降级与恢复"""
+
+import asyncio
+import multiprocessing
+import time
+from types import SimpleNamespace
+
+import pytest
+import redis.asyncio as aioredis
+
+from app.core.config import setting
+from app.core.proxy_pool import MAX_FAIL_COUNT, ProxyPool
+from app.core.redis_proxy_health import RedisProxyHealth
+
+
+PROXY = "http://10.0.0.1:8080"
+TTL = 60
+HEALTH_CONFIG = {
+    "proxy_health_shared": True,
+    "proxy_health_ttl": TTL,
+    "proxy_health_resync": 3600,  # 只验证订阅推送
+}
+PROPAGATION_BOUND = 1.0  # 其他worker跟随降级/恢复的最长时间（秒）
+
+
+@pytest.fixture(autouse=True)
+def health_config(monkeypatch):
+    for key, value in HEALTH_CONFIG.items():
+        monkeypatch.setitem(setting.grok_config, key, value)
+
+
+def _client(url: str):
+    return aioredis.Redis.from_url(url, encoding="utf-8", decode_responses=True)
+
+
+async def _node(url: str):
+    """一个节点：独立的Redis连接、健康存储（不同节点标识）与代理池"""
+    client = _client(url)
+    pool = ProxyPool()
+    pool.set_storage(SimpleNamespace(proxy_health=RedisProxyHealth(client)))
+    pool.add_proxy(PROXY)
+    await pool.start_health_sync()
+    return client, pool
+
+
+async def _until(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "等待跨节点同步超时"
+        await asyncio.sleep(0.02)
+
+
+async def _close(*nodes) -> None:
+    for client, pool in nodes:
+        await pool.shutdown()
+        await client.aclose()
+
+
+def test_report_counts_failures_cluster_wide(redis_url):
+    async def main():
+        a, b = _client(redis_url), _client(redis_url)
+        node_a, node_b = RedisProxyHealth(a), RedisProxyHealth(b)
+        assert await node_a.report(PROXY, True, False, TTL, MAX_FAIL_COUNT) == (True, 1)
+        assert await node_b.report(PROXY, True, False, TTL, MAX_FAIL_COUNT) == (True, 2)
+        assert await node_a.report(PROXY, True, False, TTL, MAX_FAIL_COUNT) == (False, MAX_FAIL_COUNT)
+        assert await node_b.fetch([PROXY, "http://10.0.0.2:8080"]) == {PROXY: (False, MAX_FAIL_COUNT)}
+
+        assert await node_b.report(PROXY, False, False, TTL, MAX_FAIL_COUNT) == (True, 0)
+        assert await node_a.report(PROXY, True, True, TTL, MAX_FAIL_COUNT) == (False, 1)  # 上报方已降级
+        assert 0 < await a.ttl(next(iter(await a.keys("grok:proxy:health:*")))) <= TTL
+        await a.aclose()
+        await b.aclose()
+
+    asyncio.run(main())
+
+
+def test_listen_skips_own_reports(redis_url):
+    async def main():
+        a, b = _client(redis_url), _client(redis_url)
+        node_a, node_b = RedisProxyHealth(a), RedisProxyHealth(b)
+        events = []
+
+        async def consume(health):
+            async for event in health.listen(timeout=0.05):
+                if event is not None:
+                    events.append(event)
+
+        listener = asyncio.create_task(consume(node_b))
+        await asyncio.sleep(0.2)  # 等待订阅建立
+        await node_b.report(PROXY, True, False, TTL, MAX_FAIL_COUNT)
+        await node_a.report(PROXY, True, True, TTL, MAX_FAIL_COUNT)
+        await _until(lambda: events)
+        await asyncio.sleep(0.1)
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+        assert events == [(PROXY, False, 2)]
+        await a.aclose()
+        await b.aclose()
+
+    asyncio.run(main())
+
+
+def test_demote_and_recover_across_nodes(redis_url):
+    async def main():
+        node_a, node_b = await _node(redis_url), await _node(redis_url)
+        pool_a, pool_b = node_a[1], node_b[1]
+        await asyncio.sleep(0.2)  # 等待订阅建立
+
+        # 本节点连续失败达到阈值：降级并广播，另一节点即时跟随
+        for _ in range(MAX_FAIL_COUNT):
+            pool_a.mark_failure(PROXY)
+        assert not pool_a._proxies[PROXY].healthy
+        await _until(lambda: not pool_b._proxies[PROXY].healthy)
+        assert PROXY not in pool_b._healthy and pool_b._proxies[PROXY].fail_count >= MAX_FAIL_COUNT
+
+        # 任一节点成功即全集群恢复
+        pool_a.mark_success(PROXY)
+        await _until(lambda: pool_b._proxies[PROXY].healthy)
+        assert PROXY in pool_b._healthy and pool_b._proxies[PROXY].fail_count == 0
+        assert pool_b.get_health_sync_stats()["received"] >= 2
+        await _close(node_a, node_b)
+
+    asyncio.run(main())
+
+
+def test_cluster_failures_demote_every_node(redis_url):
+    async def main():
+        node_a, node_b = await _node(redis_url), await _node(redis_url)
+        pool_a, pool_b = node_a[1], node_b[1]
+        await asyncio.sleep(0.2)
+
+        # 失败分散在两个节点上报，按全集群累计次数计数，达到阈值后所有节点降级
+        for i in range(1, MAX_FAIL_COUNT + 1):
+            (pool_a if i % 2 else pool_b).mark_failure(PROXY)
+            await _until(lambda: all(p._proxies[PROXY].fail_count >= i for p in (pool_a, pool_b)))
+        await _until(lambda: not pool_a._proxies[PROXY].healthy and not pool_b._proxies[PROXY].healthy)
+        assert pool_b._proxies[PROXY].fail_count == MAX_FAIL_COUNT
+        await _close(node_a, node_b)
+
+    asyncio.run(main())
+
+
+def _worker(url: str, demoter: bool, demote, recover, queue) -> None:
+    """worker进程：demoter 在收到信号后连续失败降级、随后成功恢复；其余worker记录观察到变化的时间"""
+    setting.grok_config.update(HEALTH_CONFIG)
+
+    async def wait(event) -> None:
+        while not event.is_set():
+            await asyncio.sleep(0.005)
+
+    async def main():
+        node = await _node(url)
+        pool = node[1]
+        await asyncio.sleep(0.3)  # 等待订阅建立
+        queue.put(("ready",))
+
+        await wait(demote)
+        if demoter:
+            queue.put(("demote", time.time()))
+            for _ in range(MAX_FAIL_COUNT):
+                pool.mark_failure(PROXY)
+        else:
+            await _until(lambda: not pool._proxies[PROXY].healthy)
+            queue.put(("down", time.time()))
+
+        await wait(recover)
+        if demoter:
+            queue.put(("recover", time.time()))
+            pool.mark_success(PROXY)
+        else:
+            await _until(lambda: pool._proxies[PROXY].healthy)
+            queue.put(("up", time.time()))
+        await asyncio.sleep(0.2)  # 等待上报完成
+        await _close(node)
+
+    try:
+        asyncio.run(main())
+    except BaseException as e:  # 子进程的断言失败交给主进程报告
+        queue.put(("error", e))
+
+
+def test_demote_and_recover_across_worker_processes(redis_url):
+    workers_count = 4
+    ctx = multiprocessing.get_context("spawn")
+    queue, demote, recover = ctx.Queue(), ctx.Event(), ctx.Event()
+    workers = [
+        ctx.Process(target=_worker, args=(redis_url, i == 0, demote, recover, queue))
+        for i in range(workers_count)
+    ]
+    for p in workers:
+        p.start()
+
+    def collect():
+        messages = [queue.get(timeout=60) for _ in workers]
+        for message in messages:
+            if message[0] == "error":
+                demote.set()
+                recover.set()
+                raise message[1]
+        return messages
+
+    try:
+        collect()  # 全部就绪
+        demote.set()
+        down = collect()
+        recover.set()
+        up = collect()
+    finally:
+        for p in workers:
+            p.join(15)
+
+    for messages, start, seen in ((down, "demote", "down"), (up, "recover", "up")):
+        t0 = next(m[1] for m in messages if m[0] == start)
+        delays = [m[1] - t0 for m in messages if m[0] == seen]
+        assert len(delays) == workers_count - 1
+        assert max(delays) < PROPAGATION_BOUND, delays
@@ -0,0 +1,137 @@
+"""RedisTokenStore 租约测试：多进程并发租用时单Token在途数不超过上限，归还后全部回到索引"""
+
+import asyncio
+import multiprocessing
+
+import redis.asyncio as aioredis
+
+from app.core.redis_tokens import PREFIX, RedisTokenStore
+
+
+CAP = 2
+TOKENS = [f"tok{i}" for i in range(3)]
+INDEX_KEYS = (("ssoNormal", "remainingQueries"),)
+
+
+def _store(url: str):
+    client = aioredis.Redis.from_url(url, encoding="utf-8", decode_responses=True)
+    store = RedisTokenStore(client)
+    store.max_in_flight = CAP
+    return client, store
+
+
+async def _seed(url: str) -> None:
+    client, store = _store(url)
+    await store.replace_all({
+        "ssoNormal": {sso: {"remainingQueries": 50, "status": "active", "failedCount": 0} for sso in TOKENS},
+        "ssoSuper": {},
+    })
+    await client.aclose()
+
+
+def _worker(url: str, jobs: int, result_queue) -> None:
+    """单个进程：jobs 个协程各租用一次Token，持有期间用独立计数器统计全局并发"""
+    async def main():
+        client, store = _store(url)
+        peak, over_cap, acquired = 0, 0, 0
+
+        async def job():
+            nonlocal peak, over_cap, acquired
+            while True:
+                picked, saturated = await store.acquire(INDEX_KEYS, ttl=30)
+                if picked is not None:
+                    break
+                assert saturated > 0  # 没有选到只可能是因为并发已满
+                await asyncio.sleep(0.005)
+            _, sso, _, in_flight, lease = picked
+            acquired += 1
+            holding = await client.incr(f"test:holding:{sso}")
+            peak = max(peak, holding)
+            if in_flight > CAP:
+                over_cap += 1
+            await asyncio.sleep(0.02)
+            await client.decr(f"test:holding:{sso}")
+            await store.release(lease)
+
+        await asyncio.gather(*[job() for _ in range(jobs)])
+        await client.aclose()
+        return peak, over_cap, acquired
+
+    try:
+        result_queue.put(asyncio.run(main()))
+    except BaseException as e:  # 子进程的断言失败交给主进程报告
+        result_queue.put(e)
+
+
+def test_lease_cap_across_processes(redis_url):
+    asyncio.run(_seed(redis_url))
+    processes, jobs = 4, 15
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    workers = [ctx.Process(target=_worker, args=(redis_url, jobs, queue)) for _ in range(processes)]
+    for p in workers:
+        p.start()
+    results = [queue.get(timeout=60) for _ in workers]
+    for p in workers:
+        p.join(10)
+    for r in results:
+        if isinstance(r, BaseException):
+            raise r
+
+    assert sum(r[2] for r in results) == processes * jobs
+    assert max(r[0] for r in results) <= CAP  # 实际同时持有数
+    assert sum(r[1] for r in results) == 0  # 脚本返回的全局在途数
+
+    async def check():
+        client, _ = _store(redis_url)
+        in_flight = [await client.hget(f"{PREFIX}token:{sso}", "_inFlight") for sso in TOKENS]
+        leases = await client.zcard(f"{PREFIX}leases")
+        indexed = await client.zcard(f"{PREFIX}idx:ssoNormal:remainingQueries")
+        saturated = await client.scard(f"{PREFIX}sat:ssoNormal:remainingQueries")
+        await client.aclose()
+        return in_flight, leases, indexed, saturated
+
+    in_flight, leases, indexed, saturated = asyncio.run(check())
+    assert all(int(v or 0) == 0 for v in in_flight)
+    assert (leases, indexed, saturated) == (0, len(TOKENS), 0)
+
+
+def test_saturated_until_release(redis_url):
+    async def main():
+        await _seed(redis_url)
+        client, store = _store(redis_url)
+        leases = []
+        for _ in range(CAP * len(TOKENS)):
+            picked, _ = await store.acquire(INDEX_KEYS, ttl=30)
+            assert picked is not None
+            leases.append(picked)
+        # 每个Token都租满：最少负载优先，不会有Token超过上限
+        assert sorted(p[3] for p in leases).count(CAP) == len(TOKENS)
+
+        picked, saturated = await store.acquire(INDEX_KEYS, ttl=30)
+        assert picked is None and saturated == len(TOKENS)
+
+        released = await store.release(leases[0][4])
+        assert released is not None and released[3] == CAP - 1
+        assert await store.release(leases[0][4]) is None  # 重复归还无副作用
+
+        picked, _ = await store.acquire(INDEX_KEYS, ttl=30)
+        assert picked is not None and picked[1] == leases[0][1]
+        await client.aclose()
+
+    asyncio.run(main())
+
+
+def test_expired_lease_is_reclaimed(redis_url):
+    async def main():
+        await _seed(redis_url)
+        client, store = _store(redis_url)
+        for _ in range(CAP * len(TOKENS)):
+            picked, _ = await store.acquire(INDEX_KEYS, ttl=0.05)  # 模拟持有节点崩溃，租约不归还
+            assert picked is not None
+        await asyncio.sleep(0.1)
+        picked, _ = await store.acquire(INDEX_KEYS, ttl=30)
+        assert picked is not None and picked[3] == 1
+        await client.aclose()
+
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""共享内存Token状态测试：worker持有租约时异常退出，其余worker回收其在途数与附加计数"""
+
+import multiprocessing
+import os
+import uuid
+from multiprocessing import shared_memory
+
+import pytest
+
+pytest.importorskip("fcntl")
+
+from app.services.grok.token_shm import H_ATTACHED, SharedTokenState  # noqa: E402
+
+
+CAPACITY = 1024
+
+
+def _state(name: str, lock_file) -> SharedTokenState:
+    return SharedTokenState(name, CAPACITY, lock_file)
+
+
+def _hold(name: str, lock_file, ssos, crash: bool, queue) -> None:
+    """子进程：租用后不归还；crash 时不断开直接退出，否则正常断开"""
+    state = _state(name, lock_file)
+    for sso in ssos:
+        assert state.try_acquire(state.slot(sso), 0) is not None
+    if not crash:
+        state.close()
+    queue.put(os.getpid())
+    queue.close()
+    queue.join_thread()
+    os._exit(0)
+
+
+def _run(name: str, lock_file, ssos, crash: bool) -> None:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    worker = ctx.Process(target=_hold, args=(name, lock_file, ssos, crash, queue))
+    worker.start()
+    queue.get(timeout=30)
+    worker.join(10)
+
+
+@pytest.fixture
+def segment(tmp_path):
+    return f"grok2api_test_{uuid.uuid4().hex[:8]}", tmp_path / "token_shm.lock"
+
+
+def test_dead_worker_leases_are_reclaimed(segment):
+    name, lock_file = segment
+    state = _state(name, lock_file)
+    slot = state.slot("sso-a")
+    other = state.slot("sso-b")
+    assert state.try_acquire(slot, 3) == 1
+
+    _run(name, lock_file, ["sso-a", "sso-a", "sso-b"], crash=True)
+    assert state.in_flight(slot) == 3 and state.in_flight(other) == 1
+    assert state.try_acquire(slot, 3) is None  # 退出的worker仍占着上限
+    assert state._mem[H_ATTACHED] == 2
+    state.changed_tokens()
+
+    assert state.reap_dead() == 3
+    assert state.in_flight(slot) == 1 and state.in_flight(other) == 0  # 本进程的租约保留
+    assert state._mem[H_ATTACHED] == 1
+    assert set(state.changed_tokens()) == {"sso-a", "sso-b"}  # 在途数变化随轮询同步到选择索引
+    assert state.reap_dead() == 0
+
+    assert state.release(slot) == 0
+    state.close()
+    with pytest.raises(FileNotFoundError):  # 最后一个进程断开时删除段
+        shared_memory.SharedMemory(name=name)
+
+
+def test_close_releases_own_leases(segment):
+    name, lock_file = segment
+    state = _state(name, lock_file)
+    _run(name, lock_file, ["sso-a", "sso-a"], crash=False)
+    assert state.in_flight(state.slot("sso-a")) == 0
+    assert state._mem[H_ATTACHED] == 1
+    state.close()